@@ -0,0 +1,215 @@
+"""
+A local stand-in for an OpenAI-compatible batch endpoint, for running the offline batch mode without a provider.
+
+Run it with `python batch_stub_server.py --port 8765`, then point the job scraper at it:
+LLM_OFFLINE_BATCH_MODE=true LLM_BATCH_BASE_URL=http://localhost:8765/v1 LLM_BATCH_API_KEY=stub
+
+Batches complete on the second status poll. Each request gets a canned answer: plain text for free-text
+requests, or a value matching the request's JSON schema for structured requests. Array items are generated
+once per "=== <name>_id: <id> ===" marker found in the prompt, so batched prompts get one entry per job or user.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ID_MARKER = re.compile(r'=== (\w+_id): (\S+) ===')
+
+
+def stub_value(schema, prompt, id_field=None, id_value=None):
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        value = {}
+        for name, property_schema in schema.get('properties', {}).items():
+            if name == id_field:
+                value[name] = id_value
+            else:
+                value[name] = stub_value(property_schema, prompt)
+        return value
+    if schema_type == 'array':
+        markers = ID_MARKER.findall(prompt)
+        return [stub_value(schema.get('items', {}), prompt, name.replace('candidate_id', 'user_id'), marker_id)
+                for name, marker_id in markers]
+    if schema_type == 'boolean':
+        return True
+    if schema_type == 'integer':
+        return 75
+    if schema_type == 'number':
+        return 0.75
+    return "You may like this job because it is a stub. The hiring manager may think you would be a good fit " \
+           "for this job because of the stub. Overall, I think this is a stub."
+
+
+def stub_completion(body):
+    prompt = "\n".join(str(message.get('content', '')) for message in body.get('messages', []))
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        content = json.dumps(stub_value(response_format['json_schema']['schema'], prompt))
+    else:
+        content = f"Stub answer from the local batch server for model {body.get('model')}."
+
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get('model'),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens}
+    }
+
+
+class BatchStubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+        self.polls = {}
+
+
+def file_object(file_id, content, purpose):
+    return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl", "purpose": purpose, "status": "processed"}
+
+
+def make_handler(state):
+    class BatchStubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            path = self.path.split('?')[0]
+            if path.endswith('/files'):
+                self.create_file()
+            elif path.endswith('/batches'):
+                self.create_batch()
+            elif path.endswith('/cancel'):
+                batch_id = path.split('/')[-2]
+                with state.lock:
+                    state.batches[batch_id]['status'] = 'cancelled'
+                    self.send_json(state.batches[batch_id])
+            else:
+                self.send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            parts = path.strip('/').split('/')
+            if len(parts) >= 2 and parts[-2] == 'batches':
+                self.retrieve_batch(parts[-1])
+            elif parts[-1] == 'content' and parts[-3] == 'files':
+                self.file_content(parts[-2])
+            else:
+                self.send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+        def create_file(self):
+            raw = self.read_body()
+            message = BytesParser(policy=default).parsebytes(
+                b"Content-Type: " + self.headers['Content-Type'].encode('utf-8') + b"\r\n\r\n" + raw)
+            content = b""
+            purpose = "batch"
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if name == 'file':
+                    content = part.get_payload(decode=True)
+                elif name == 'purpose':
+                    purpose = part.get_content().strip()
+
+            file_id = f"file-{uuid.uuid4().hex}"
+            with state.lock:
+                state.files[file_id] = content
+            self.send_json(file_object(file_id, content, purpose))
+
+        def create_batch(self):
+            request = json.loads(self.read_body())
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            lines = [line for line in state.files[request['input_file_id']].decode('utf-8').splitlines()
+                     if line.strip()]
+            batch = {
+                "id": batch_id, "object": "batch", "endpoint": request['endpoint'],
+                "input_file_id": request['input_file_id'], "completion_window": request['completion_window'],
+                "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                "error_file_id": None, "metadata": request.get('metadata'),
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0}
+            }
+            with state.lock:
+                state.batches[batch_id] = batch
+                state.polls[batch_id] = 0
+            self.send_json(batch)
+
+        def retrieve_batch(self, batch_id):
+            with state.lock:
+                batch = state.batches[batch_id]
+                state.polls[batch_id] += 1
+                if batch['status'] == 'in_progress' and state.polls[batch_id] >= 2:
+                    self.complete_batch(batch)
+                self.send_json(batch)
+
+        def complete_batch(self, batch):
+            output_lines = []
+            for line in state.files[batch['input_file_id']].decode('utf-8').splitlines():
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                output_lines.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": request['custom_id'],
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                                 "body": stub_completion(request['body'])},
+                    "error": None
+                }))
+
+            output_id = f"file-{uuid.uuid4().hex}"
+            state.files[output_id] = ("\n".join(output_lines) + "\n").encode('utf-8')
+            batch['output_file_id'] = output_id
+            batch['status'] = 'completed'
+            batch['request_counts']['completed'] = len(output_lines)
+
+        def file_content(self, file_id):
+            with state.lock:
+                content = state.files.get(file_id)
+            if content is None:
+                self.send_json({"error": {"message": f"No file {file_id}"}}, status=404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return BatchStubHandler
+
+
+def start_stub_server(port=0):
+    """Start the stub server on a background thread and return it. Port 0 picks a free port."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(BatchStubState()))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for an OpenAI-compatible batch endpoint")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    stub_server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(BatchStubState()))
+    print(f"Batch stub server listening on http://127.0.0.1:{args.port}/v1")
+    stub_server.serve_forever()
@@ -0,0 +1,94 @@
+"""
+Compares the full JSON schema evaluation with the compact answer-string encoding on real jobs: completion tokens,
+latency and how often the yes/no answers agree. Each job is evaluated once in each format.
+
+python benchmark_compact_output.py --jobs 10 [--user-id <id>]
+"""
+import argparse
+import statistics
+import time
+
+from compact_evaluation import ANSWER_FIELDS
+from llm import build_evaluation_request, parse_evaluation_response
+from llm_client import create_completion
+from persistent_storage import get_active_users_with_resume, get_user_by_id, get_user_configs, \
+    get_user_job_matches, get_job_by_id
+from resume_profile import get_resume_for_prompt
+from text_compaction import compact_job_description
+
+
+def timed_evaluation(job, rating_inputs, compact):
+    request = build_evaluation_request(job['title'], job['description'], rating_inputs['resume'],
+                                       rating_inputs['job_titles'], rating_inputs['skill_words'],
+                                       rating_inputs['stop_words'], compact=compact)
+    started = time.monotonic()
+    completion = create_completion(request)
+    latency = time.monotonic() - started
+
+    usage = getattr(completion, 'usage', None)
+    completion_tokens = usage.completion_tokens if usage else None
+    assessment = parse_evaluation_response(completion.choices[0].message.content, compact=compact)
+    return assessment, completion_tokens, latency
+
+
+def summarize(label, values, unit=''):
+    values = [value for value in values if value is not None]
+    if not values:
+        print(f"{label}: no data")
+        return
+    print(f"{label}: mean {statistics.mean(values):.1f}{unit}, median {statistics.median(values):.1f}{unit}, "
+          f"max {max(values):.1f}{unit}")
+
+
+def run_benchmark(user, job_count):
+    user_configs = get_user_configs(user['id']) or []
+    rating_inputs = {
+        'job_titles': [config['string_value'] for config in user_configs if config['key'] == 'job_titles'],
+        'skill_words': [config['string_value'] for config in user_configs if config['key'] == 'skill_words'],
+        'stop_words': [config['string_value'] for config in user_configs if config['key'] == 'stop_words'],
+        'resume': get_resume_for_prompt(user)
+    }
+
+    matches = get_user_job_matches(user['id']) or []
+    results = {False: {'tokens': [], 'latency': []}, True: {'tokens': [], 'latency': []}}
+    agreements = []
+    for match in matches[:job_count]:
+        job = get_job_by_id(match['job_id'])
+        if job is None:
+            continue
+        job['description'] = compact_job_description(job.get('description') or '')
+
+        assessments = {}
+        for compact in (False, True):
+            try:
+                assessment, tokens, latency = timed_evaluation(job, rating_inputs, compact)
+            except Exception as e:
+                print(f"{'Compact' if compact else 'Full'} evaluation failed for {job['title']}: {e}")
+                continue
+            assessments[compact] = assessment
+            results[compact]['tokens'].append(tokens)
+            results[compact]['latency'].append(latency)
+
+        if len(assessments) == 2:
+            same = sum(getattr(assessments[False], name) == getattr(assessments[True], name) for name in ANSWER_FIELDS)
+            agreements.append(same / len(ANSWER_FIELDS))
+            print(f"{job['title']}: {same} of {len(ANSWER_FIELDS)} answers agree")
+
+    for compact, label in ((False, 'Full schema'), (True, 'Compact')):
+        summarize(f"{label} completion tokens", results[compact]['tokens'])
+        summarize(f"{label} latency", results[compact]['latency'], 's')
+    if agreements:
+        print(f"Answer agreement: {statistics.mean(agreements):.0%} over {len(agreements)} jobs")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the compact evaluation encoding against the full schema")
+    parser.add_argument('--jobs', type=int, default=10, help="Number of the user's matched jobs to evaluate")
+    parser.add_argument('--user-id', help="User to benchmark with, defaults to the first active user with a resume")
+    args = parser.parse_args()
+
+    benchmark_user = get_user_by_id(args.user_id) if args.user_id else (get_active_users_with_resume() or [None])[0]
+    if benchmark_user is None:
+        print("No user to benchmark with")
+    else:
+        run_benchmark(benchmark_user, args.jobs)
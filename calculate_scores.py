@@ -1,7 +1,49 @@
+import argparse
 from typing import List
+
+import numpy as np
+
+from compact_evaluation import ANSWER_FIELDS
 from helpers import consolidate_text
-from llm import evaluate_job_match
+from llm import evaluate_job_match, EvaluationFailed
 from models import JobAssessment
+from persistent_storage import iter_user_job_assessments, update_user_job_scores
+
+# Each sub-score (named after its users_jobs column) weighs the yes/no answers to its four questions
+SUB_SCORE_WEIGHTS = {
+    'desire_score': {
+        'title_matches_preferred': 3,
+        'has_desired_skills': 3,
+        'free_from_stop_words': 3,
+        'logical_career_step': 2
+    },
+    'experience_score': {
+        'within_experience_range': 3,
+        'seniority_matches': 3,
+        'responsibilities_align': 2,
+        'level_appropriate': 2
+    },
+    'meets_requirements_score': {
+        'has_required_technical_skills': 3,
+        'has_required_domain_skills': 3,
+        'meets_education_requirements': 2,
+        'has_industry_experience': 2
+    },
+    'meets_experience_score': {
+        'meets_years_required': 3,
+        'has_similar_role_history': 3,
+        'shows_skill_growth': 2,
+        'has_similar_environment': 2
+    }
+}
+
+# The overall score is the weighted sum of the sub-scores, truncated to a whole number
+OVERALL_WEIGHTS = {
+    'desire_score': 0.25,
+    'experience_score': 0.25,
+    'meets_requirements_score': 0.25,
+    'meets_experience_score': 0.25
+}
 
 
 def get_job_ratings(original_df, db_user, user_configs):
@@ -34,14 +76,18 @@ def get_job_ratings(original_df, db_user, user_configs):
             continue
 
         # Get yes/no answers from LLM
-        assessment = evaluate_job_match(
-            job_title=job_title,
-            job_description=job_description,
-            resume=resume,
-            job_titles=job_titles,
-            skill_words=skill_words,
-            stop_words=stop_words
-        )
+        try:
+            assessment = evaluate_job_match(
+                job_title=job_title,
+                job_description=job_description,
+                resume=resume,
+                job_titles=job_titles,
+                skill_words=skill_words,
+                stop_words=stop_words
+            )
+        except EvaluationFailed as e:
+            print(f"{index}: {e}, leaving it unscored")
+            continue
 
         # Calculate scores based on the yes/no responses
         desire_score = calculate_desire_score(assessment)
@@ -88,115 +134,97 @@ def create_evaluation_prompt(job_title: str, job_description: str, resume: str,
     """
 
 
-def calculate_desire_score(assessment: JobAssessment) -> int:
-    """Calculate desire score based on weighted criteria"""
-    weights = {
-        'title_matches_preferred': 3,
-        'has_desired_skills': 3,
-        'free_from_stop_words': 3,
-        'logical_career_step': 2
-    }
+def assessment_bitmask(assessment: JobAssessment) -> int:
+    """The sixteen yes/no answers packed into an int, bit i holding the answer to ANSWER_FIELDS[i]."""
+    return sum(1 << bit for bit, field in enumerate(ANSWER_FIELDS) if getattr(assessment, field))
 
-    score = 0
-    total_weight = sum(weights.values())
 
-    if assessment.title_matches_preferred:
-        score += weights['title_matches_preferred']
-    if assessment.has_desired_skills:
-        score += weights['has_desired_skills']
-    if assessment.free_from_stop_words:
-        score += weights['free_from_stop_words']
-    if assessment.logical_career_step:
-        score += weights['logical_career_step']
+def sub_score(assessment: JobAssessment, name: str, weights: dict = SUB_SCORE_WEIGHTS) -> int:
+    """Weighted share of YES answers to the sub-score's questions, as a whole number from 0 to 100"""
+    field_weights = weights[name]
+    score = sum(weight for field, weight in field_weights.items() if getattr(assessment, field))
+    return (score * 100) // sum(field_weights.values())
 
-    # Use integer division
-    return (score * 100) // total_weight
 
+def calculate_desire_score(assessment: JobAssessment) -> int:
+    return sub_score(assessment, 'desire_score')
 
-# Similar changes for other calculation functions:
-def calculate_experience_score(assessment: JobAssessment) -> int:
-    weights = {
-        'within_experience_range': 3,
-        'seniority_matches': 3,
-        'responsibilities_align': 2,
-        'level_appropriate': 2
-    }
-
-    score = 0
-    total_weight = sum(weights.values())
-
-    if assessment.within_experience_range:
-        score += weights['within_experience_range']
-    if assessment.seniority_matches:
-        score += weights['seniority_matches']
-    if assessment.responsibilities_align:
-        score += weights['responsibilities_align']
-    if assessment.level_appropriate:
-        score += weights['level_appropriate']
 
-    return (score * 100) // total_weight
+def calculate_experience_score(assessment: JobAssessment) -> int:
+    return sub_score(assessment, 'experience_score')
 
 
 def calculate_requirements_score(assessment: JobAssessment) -> int:
-    weights = {
-        'has_required_technical_skills': 3,
-        'has_required_domain_skills': 3,
-        'meets_education_requirements': 2,
-        'has_industry_experience': 2
-    }
-
-    score = 0
-    total_weight = sum(weights.values())
-
-    if assessment.has_required_technical_skills:
-        score += weights['has_required_technical_skills']
-    if assessment.has_required_domain_skills:
-        score += weights['has_required_domain_skills']
-    if assessment.meets_education_requirements:
-        score += weights['meets_education_requirements']
-    if assessment.has_industry_experience:
-        score += weights['has_industry_experience']
-
-    return (score * 100) // total_weight
+    return sub_score(assessment, 'meets_requirements_score')
 
 
 def calculate_experience_requirements_score(assessment: JobAssessment) -> int:
-    weights = {
-        'meets_years_required': 3,
-        'has_similar_role_history': 3,
-        'shows_skill_growth': 2,
-        'has_similar_environment': 2
-    }
-
-    score = 0
-    total_weight = sum(weights.values())
-
-    if assessment.meets_years_required:
-        score += weights['meets_years_required']
-    if assessment.has_similar_role_history:
-        score += weights['has_similar_role_history']
-    if assessment.shows_skill_growth:
-        score += weights['shows_skill_growth']
-    if assessment.has_similar_environment:
-        score += weights['has_similar_environment']
-
-    return (score * 100) // total_weight
+    return sub_score(assessment, 'meets_experience_score')
 
 
 def calculate_overall_score(desire_score: int, experience_score: int,
                             requirements_score: int, experience_req_score: int) -> int:
-    weights = {
-        'desire_score': 0.25,
-        'experience_score': 0.25,
-        'requirements_score': 0.25,
-        'experience_req_score': 0.25
+    sub_scores = {
+        'desire_score': desire_score,
+        'experience_score': experience_score,
+        'meets_requirements_score': requirements_score,
+        'meets_experience_score': experience_req_score
     }
+    # The small epsilon keeps float weights like 0.3 from truncating 59.99999 down to 59
+    return int(sum(sub_scores[name] * weight for name, weight in OVERALL_WEIGHTS.items()) + 1e-9)
 
-    overall_score = int(
-        desire_score * weights['desire_score'] +
-        experience_score * weights['experience_score'] +
-        requirements_score * weights['requirements_score'] +
-        experience_req_score * weights['experience_req_score']
-    )
 
-    return overall_score
+def score_bitmasks(bitmasks, sub_score_weights: dict = SUB_SCORE_WEIGHTS,
+                   overall_weights: dict = OVERALL_WEIGHTS) -> dict:
+    """
+    Vectorized scoring of many stored assessments at once. Returns a dict of numpy int arrays, one per sub-score
+    plus 'score', matching what the per-assessment functions above compute for the same weights.
+    """
+    # There are only 2^16 possible answer sets, so score each of them once and look the bitmasks up
+    every_bitmask = np.arange(1 << len(ANSWER_FIELDS), dtype=np.int64)
+    answers = ((every_bitmask[:, None] >> np.arange(len(ANSWER_FIELDS))) & 1).astype(float)
+
+    names = list(sub_score_weights)
+    weight_matrix = np.array([[sub_score_weights[name].get(field, 0) for name in names] for field in ANSWER_FIELDS],
+                             dtype=float)
+    sub_scores = (np.rint(answers @ weight_matrix).astype(np.int64) * 100) // weight_matrix.sum(axis=0).astype(np.int64)
+    overall = np.floor(sub_scores @ np.array([overall_weights[name] for name in names], dtype=float) + 1e-9)
+
+    bitmasks = np.asarray(bitmasks, dtype=np.int64)
+    scores = {name: sub_scores[bitmasks, column] for column, name in enumerate(names)}
+    scores['score'] = overall.astype(np.int64)[bitmasks]
+    return scores
+
+
+def rescore(dry_run=False, page_size=1000):
+    """Recompute every stored score from its assessment bitmask with the current weight tables."""
+    scanned = 0
+    changed = 0
+    crossed_50 = 0
+    for rows in iter_user_job_assessments(page_size):
+        scores = score_bitmasks([row['assessment_bits'] for row in rows])
+        updates = []
+        for position, row in enumerate(rows):
+            new_row = {name: int(values[position]) for name, values in scores.items()}
+            if any(row.get(name) != value for name, value in new_row.items()):
+                updates.append({'user_id': row['user_id'], 'job_id': row['job_id'], **new_row})
+                old_score = row.get('score') or 0
+                if (old_score > 50) != (new_row['score'] > 50):
+                    crossed_50 += 1
+
+        scanned += len(rows)
+        changed += len(updates)
+        if updates and not dry_run:
+            update_user_job_scores(updates)
+
+    print(f"Rescored {scanned} assessments, {changed} changed, {crossed_50} crossed the over-50 line"
+          f"{' (dry run, nothing written)' if dry_run else ''}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Re-score stored assessments with the current weight tables")
+    parser.add_argument('command', choices=['rescore'])
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without writing")
+    args = parser.parse_args()
+
+    rescore(dry_run=args.dry_run)
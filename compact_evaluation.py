@@ -0,0 +1,130 @@
+"""
+Compact response encoding for job evaluations. Instead of sixteen named booleans and three prose fields, the
+model returns one fixed-order answer string ("YNYY...") and two short reason codes, and decode_compact_assessment
+turns that back into a JobAssessment with locally templated reasons and guidance.
+"""
+import json
+
+from models import JobAssessment
+
+# The yes/no fields in the order their answers appear in the answer string
+ANSWER_FIELDS = [name for name, field in JobAssessment.model_fields.items() if field.annotation is bool]
+DESIRE_FIELDS = ANSWER_FIELDS[:4]
+REQUIREMENT_FIELDS = ANSWER_FIELDS[8:]
+
+DESIRE_CODES = {
+    'TITLE': "the title lines up with the roles you are targeting",
+    'SKILLS': "it uses the skills you want to work with",
+    'GROWTH': "it would be a logical next step in your career",
+    'ALL': "it matches your target role, skills and career direction",
+    'OFFTITLE': "the title is outside the roles you are targeting",
+    'NOSKILLS': "it doesn't use many of the skills you want to work with",
+    'AVOID': "it includes things you said you want to avoid",
+    'OFFPATH': "it doesn't fit the direction of your career",
+}
+REQUIREMENT_CODES = {
+    'STRONG': "a background that covers the required skills and experience",
+    'TECH': "technical skills that match what they require",
+    'HISTORY': "your history in similar roles",
+    'INDUSTRY': "industry experience that fits this position",
+    'TECHGAP': "gaps in the required technical skills",
+    'YEARS': "fewer years of experience than they ask for",
+    'EDUCATION': "possible gaps against their education requirements",
+    'DOMAIN': "domain experience that differs from what they need",
+    'LEVEL': "a role level that doesn't match your experience",
+}
+
+
+def asked_fields(known_answers: dict = None) -> list:
+    """The answer string covers the yes/no fields, in order, that weren't already answered locally."""
+    return [name for name in ANSWER_FIELDS if name not in (known_answers or {})]
+
+
+def create_compact_evaluation_prompt(job_title: str, job_description: str, resume: str, questions: dict,
+                                     known_answers: dict = None) -> str:
+    """`questions` is the field name -> question mapping from create_evaluation_questions."""
+    fields = asked_fields(known_answers)
+    numbered_questions = "\n".join(f"{position + 1}. {questions[name]}" for position, name in enumerate(fields))
+
+    return f"""Evaluate this job opportunity for the candidate. Be direct and definitive in your assessment.
+
+       Job Details:
+       Title: {job_title}
+       Description: {job_description}
+
+       Candidate Information:
+       Resume: {resume}
+
+       Answer these {len(fields)} questions in order:
+{numbered_questions}
+
+       Put the answers in "answers" as exactly {len(fields)} letters, Y or N, one per question in order.
+       Set "desire_code" to the code that best explains why the candidate would like or dislike this job:
+       {', '.join(f"{code} ({reason})" for code, reason in DESIRE_CODES.items())}.
+       Set "requirements_code" to the code that best explains how a hiring manager would see the candidate:
+       {', '.join(f"{code} ({reason})" for code, reason in REQUIREMENT_CODES.items())}.
+       """
+
+
+def compact_evaluation_response_format() -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "compact_job_assessment",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "answers": {"type": "string"},
+                    "desire_code": {"type": "string", "enum": list(DESIRE_CODES)},
+                    "requirements_code": {"type": "string", "enum": list(REQUIREMENT_CODES)}
+                },
+                "required": ["answers", "desire_code", "requirements_code"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def local_guidance(answers: dict, desire_reason: str, requirements_reason: str) -> str:
+    """The same guidance template the model fills in, filled in from the answers instead."""
+    desire_yes = sum(answers[name] for name in DESIRE_FIELDS)
+    requirement_yes = sum(answers[name] for name in REQUIREMENT_FIELDS)
+    total_yes = sum(answers.values())
+
+    feeling = 'like' if desire_yes >= 3 else 'be lukewarm on' if desire_yes == 2 else 'dislike'
+    fit = 'good' if requirement_yes >= 6 else 'reasonable' if requirement_yes >= 4 else 'bad'
+    if total_yes >= 12:
+        overall = "this is a strong match worth applying for"
+    elif total_yes >= 8:
+        overall = "this is a reasonable match if the gaps above aren't deal breakers"
+    else:
+        overall = "this job is probably not the right match for you"
+
+    return (f"You may {feeling} this job because of the following reasons: {desire_reason}. "
+            f"The hiring manager may think you would be a {fit} fit for this job because of {requirements_reason}. "
+            f"Overall, I think {overall}.")
+
+
+def decode_compact_assessment(content: str, known_answers: dict = None) -> JobAssessment:
+    """
+    Decode a compact response into a JobAssessment, merging in the locally known answers.
+    Raises ValueError if it can't be decoded.
+    """
+    fields = asked_fields(known_answers)
+    compact = json.loads(content)
+    letters = ''.join(letter for letter in compact.get('answers', '').upper() if letter in 'YN')
+    if len(letters) != len(fields):
+        raise ValueError(f"Expected {len(fields)} answers, got {len(letters)}: {compact.get('answers')!r}")
+
+    answers = {**{name: letter == 'Y' for name, letter in zip(fields, letters)}, **(known_answers or {})}
+    answers = {name: answers[name] for name in ANSWER_FIELDS}
+    desire_reason = DESIRE_CODES.get(compact.get('desire_code'))
+    requirements_reason = REQUIREMENT_CODES.get(compact.get('requirements_code'))
+    if desire_reason is None or requirements_reason is None:
+        raise ValueError(f"Unknown reason codes: {compact.get('desire_code')}, {compact.get('requirements_code')}")
+
+    return JobAssessment(**answers,
+                         desire_reason=desire_reason[0].upper() + desire_reason[1:],
+                         requirements_reason=requirements_reason[0].upper() + requirements_reason[1:],
+                         guidance_text=local_guidance(answers, desire_reason, requirements_reason))
@@ -0,0 +1,18 @@
+-- Step 3 of moving job descriptions to jobscraper.job_descriptions, see 001_job_descriptions_expand.sql.
+-- Run it once the code that writes job_descriptions is deployed everywhere. Descriptions the old code wrote to
+-- jobs.description after step 1 are copied over, and ones the new code already wrote are left alone.
+
+BEGIN;
+
+INSERT INTO jobscraper.job_descriptions (job_id, description)
+SELECT id, description
+FROM jobscraper.jobs
+WHERE description IS NOT NULL
+ON CONFLICT (job_id) DO NOTHING;
+
+ALTER TABLE jobscraper.jobs DROP COLUMN description;
+
+COMMIT;
+
+-- Reclaim the space the dropped column held
+VACUUM FULL jobscraper.jobs;
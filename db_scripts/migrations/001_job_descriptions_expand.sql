@@ -0,0 +1,38 @@
+-- Moves job descriptions out of jobscraper.jobs into jobscraper.job_descriptions, compressed with lz4.
+-- Descriptions are most of the bytes in jobs, and almost no query needs them. Without them, a jobs row
+-- fits in a few hundred bytes, so scans, the recent_high_score_jobs view and select('*') stay small.
+-- Read a description through PostgREST with select('*, job_descriptions(description)').
+--
+-- The move is done in three steps, so no description is lost while old and new code overlap:
+--   1. Run this file. It creates job_descriptions and copies the descriptions stored so far. jobs.description
+--      stays, so the code that is running keeps working.
+--   2. Deploy the code that reads and writes job_descriptions (and the GCP function).
+--   3. Run 001_job_descriptions_contract.sql. It copies descriptions the old code wrote after step 1 and drops
+--      jobs.description.
+
+BEGIN;
+
+CREATE TABLE jobscraper.job_descriptions (
+    job_id uuid NOT NULL,
+    description text COMPRESSION lz4
+);
+
+ALTER TABLE jobscraper.job_descriptions OWNER TO postgres;
+
+ALTER TABLE ONLY jobscraper.job_descriptions
+    ADD CONSTRAINT job_descriptions_pkey PRIMARY KEY (job_id);
+
+ALTER TABLE ONLY jobscraper.job_descriptions
+    ADD CONSTRAINT job_descriptions_job_id_fkey FOREIGN KEY (job_id) REFERENCES jobscraper.jobs(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
+GRANT ALL ON TABLE jobscraper.job_descriptions TO anon;
+GRANT ALL ON TABLE jobscraper.job_descriptions TO authenticated;
+GRANT ALL ON TABLE jobscraper.job_descriptions TO service_role;
+
+-- Values are recompressed with lz4 as they are copied
+INSERT INTO jobscraper.job_descriptions (job_id, description)
+SELECT id, description
+FROM jobscraper.jobs
+WHERE description IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,121 @@
+-- Changes users_jobs.score and the four sub-scores from text to smallint, and adds a partial index for the
+-- recommendations recent_high_score_jobs returns. While the scores were text, the view cast uj.score::INT for
+-- every row, so no index on score could be used, and ORDER BY score in the email digest sorted the scores as
+-- strings ('9' > '85'). Scores that aren't a number become null.
+-- Deploy the code that writes integer scores before running this.
+--
+-- Query plans. No production-sized Postgres was available when this was written, so the Postgres plans below are
+-- EXPECTED SHAPES, not captured output. Capture the real plans by running these before and after the migration:
+--
+--   -- Email digest (get_unemailed_jobs)
+--   EXPLAIN (ANALYZE, BUFFERS)
+--   SELECT id, user_id, score, title, company, location, comp_min, comp_max, guidance
+--   FROM jobscraper.recent_high_score_jobs
+--   WHERE user_id = '<user id>' AND email_sent = false
+--   ORDER BY score DESC;
+--
+--   -- Derived data backfill (get_job_ids_missing_derived_data)
+--   EXPLAIN (ANALYZE, BUFFERS)
+--   SELECT id, score FROM jobscraper.recent_high_score_jobs
+--   WHERE short_summary IS NULL
+--   ORDER BY score DESC LIMIT 200;
+--
+-- Expected before: the plan of the email digest query has this shape. The cast in the filter rules out an index on
+-- score, and the sort compares text:
+--   Sort  (Sort Key: uj.score DESC)
+--     ->  Nested Loop
+--           ->  Index Scan using users_jko_pkey on users_jobs uj
+--                 Index Cond: (user_id = '<user id>')
+--                 Filter: ((NOT email_sent) AND ((score)::integer >= 50))
+--           ->  Index Scan using jobs_pkey on jobs j  (Filter: recent, interested or applied)
+-- and the backfill query does a Seq Scan on users_jobs with Filter: ((score)::integer >= 50).
+--
+-- Expected after: the email digest reads users_jobs_email_score_idx in score order, so the Sort node goes away.
+-- Only rows at or above 50 are in the index. The view also reads interested, has_applied and guidance, which
+-- aren't in the index, so it is an Index Scan that visits the heap for each matching row, not an Index Only Scan:
+--   Nested Loop
+--     ->  Index Scan using users_jobs_email_score_idx on users_jobs uj
+--           Index Cond: ((user_id = '<user id>') AND (email_sent = false))
+--     ->  Index Scan using jobs_pkey on jobs j  (Filter: recent, interested or applied)
+-- and the backfill query can use a scan of the partial index instead of a scan of the whole table.
+--
+-- Captured output: the same change in the SQLite schema (storage_backends.py), from EXPLAIN QUERY PLAN:
+--   before: SEARCH uj USING INDEX sqlite_autoindex_users_jobs_1 (user_id=?)
+--           SEARCH j USING INDEX sqlite_autoindex_jobs_1 (id=?)
+--           USE TEMP B-TREE FOR ORDER BY
+--   after:  SEARCH uj USING INDEX users_jobs_email_score_idx (user_id=? AND email_sent=? AND score>?)
+--           SEARCH j USING INDEX sqlite_autoindex_jobs_1 (id=?)
+
+BEGIN;
+
+-- The view depends on users_jobs.score, so it has to be dropped while the column type changes
+DROP VIEW jobscraper.recent_high_score_jobs;
+
+ALTER TABLE jobscraper.users_jobs
+    ALTER COLUMN score TYPE smallint
+        USING CASE WHEN score ~ '^\s*\d+(\.\d+)?\s*$' THEN round(score::numeric)::smallint END,
+    ALTER COLUMN desire_score TYPE smallint
+        USING CASE WHEN desire_score ~ '^\s*\d+(\.\d+)?\s*$' THEN round(desire_score::numeric)::smallint END,
+    ALTER COLUMN experience_score TYPE smallint
+        USING CASE WHEN experience_score ~ '^\s*\d+(\.\d+)?\s*$' THEN round(experience_score::numeric)::smallint END,
+    ALTER COLUMN meets_requirements_score TYPE smallint
+        USING CASE WHEN meets_requirements_score ~ '^\s*\d+(\.\d+)?\s*$'
+                   THEN round(meets_requirements_score::numeric)::smallint END,
+    ALTER COLUMN meets_experience_score TYPE smallint
+        USING CASE WHEN meets_experience_score ~ '^\s*\d+(\.\d+)?\s*$'
+                   THEN round(meets_experience_score::numeric)::smallint END;
+
+-- Same as views.sql
+CREATE VIEW jobscraper.recent_high_score_jobs AS
+SELECT
+    uj.user_id,
+    uj.score,
+    uj.desire_score,
+    uj.experience_score,
+    uj.meets_requirements_score,
+    uj.meets_experience_score,
+    uj.interested,
+    uj.has_applied,
+    uj.email_sent,
+    uj.guidance,
+    j.id,
+    j.created_at,
+    j.title,
+    j.company,
+    j.short_summary,
+    j.hard_requirements,
+    j.job_site,
+    j.url,
+    j.location,
+    j.date_posted,
+    j.comp_interval,
+    j.comp_min,
+    j.comp_max,
+    j.comp_currency,
+    j.emails,
+    j.date_pulled
+FROM
+    jobscraper.users_jobs uj
+JOIN
+    jobscraper.jobs j ON uj.job_id = j.id
+WHERE
+    (
+      ((uj.interested is null or uj.interested = false) and (j.date_posted > CURRENT_DATE - interval '14 days' OR j.date_pulled > CURRENT_DATE - interval '14 days'))
+      or uj.interested = true
+      or uj.has_applied = true
+    )
+    AND
+    uj.score >= 50;
+
+-- Dropping the view dropped its grants
+GRANT ALL ON TABLE jobscraper.recent_high_score_jobs TO anon;
+GRANT ALL ON TABLE jobscraper.recent_high_score_jobs TO authenticated;
+GRANT ALL ON TABLE jobscraper.recent_high_score_jobs TO service_role;
+
+COMMIT;
+
+-- Outside the transaction, so users_jobs stays writable while it builds
+CREATE INDEX CONCURRENTLY users_jobs_email_score_idx ON jobscraper.users_jobs USING btree (user_id, email_sent, score DESC)
+    INCLUDE (job_id) WHERE (score >= 50);
+
+ANALYZE jobscraper.users_jobs;
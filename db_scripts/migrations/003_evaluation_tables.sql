@@ -0,0 +1,55 @@
+-- Adds the column and tables the evaluation code writes to: users_jobs.assessment_bits (the packed yes/no answers
+-- of an assessment), resume_profiles (resume profiles cached by resume hash), evaluation_cursors (how far each
+-- user's ranked jobs have been evaluated today) and evaluation_store (stored assessments, reused when the resume,
+-- profile and job are unchanged). Same definitions as tables.sql.
+-- Run this before deploying the code that writes them. Every users_jobs upsert sends assessment_bits, so without the
+-- column each one fails.
+-- Everything is created with IF NOT EXISTS, so running it again is harmless.
+
+BEGIN;
+
+ALTER TABLE jobscraper.users_jobs ADD COLUMN IF NOT EXISTS assessment_bits integer;
+
+CREATE TABLE IF NOT EXISTS jobscraper.resume_profiles (
+    resume_hash text NOT NULL,
+    profile jsonb NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT resume_profiles_pkey PRIMARY KEY (resume_hash)
+);
+
+ALTER TABLE jobscraper.resume_profiles OWNER TO postgres;
+
+GRANT ALL ON TABLE jobscraper.resume_profiles TO service_role;
+
+CREATE TABLE IF NOT EXISTS jobscraper.evaluation_cursors (
+    user_id uuid NOT NULL,
+    evaluated_urls jsonb DEFAULT '[]'::jsonb NOT NULL,
+    good_jobs_today integer DEFAULT 0 NOT NULL,
+    cursor_date date,
+    updated_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT evaluation_cursors_pkey PRIMARY KEY (user_id)
+);
+
+ALTER TABLE jobscraper.evaluation_cursors OWNER TO postgres;
+
+GRANT ALL ON TABLE jobscraper.evaluation_cursors TO service_role;
+
+CREATE TABLE IF NOT EXISTS jobscraper.evaluation_store (
+    id bigint GENERATED ALWAYS AS IDENTITY NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    resume_hash text NOT NULL,
+    profile_hash text NOT NULL,
+    fingerprint bigint NOT NULL,
+    title text,
+    assessment jsonb NOT NULL,
+    CONSTRAINT evaluation_store_pkey PRIMARY KEY (id)
+);
+
+ALTER TABLE jobscraper.evaluation_store OWNER TO postgres;
+
+CREATE INDEX IF NOT EXISTS evaluation_store_key_idx
+    ON jobscraper.evaluation_store USING btree (resume_hash, profile_hash, created_at);
+
+GRANT ALL ON TABLE jobscraper.evaluation_store TO service_role;
+
+COMMIT;
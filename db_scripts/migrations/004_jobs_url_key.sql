@@ -0,0 +1,94 @@
+-- Makes jobs.url unique and adds the date indexes get_recent_jobs filters on.
+-- save_jobs_to_supabase upserts jobs with on_conflict='url', which PostgREST can only do when url has a unique
+-- constraint, so run this before deploying that code. Without it, every job save fails.
+--
+-- Jobs are stored under their canonical URL (job_cache.canonical_url), so the URLs stored before are canonicalized
+-- here with the same rules, and jobs whose URLs only differed by tracking parameters, case or a trailing slash become
+-- duplicates. Existing duplicates are merged first. For each URL the oldest job is kept, and the others are folded
+-- into it:
+--   - users_jobs rows move to the kept job. When a user has rows for more than one copy, the row the user marked
+--     interested or not interested wins, then the one already emailed, then the highest score.
+--   - The kept job takes a duplicate's description when it has none.
+--   - The duplicates are deleted. Their job_descriptions rows go with them (ON DELETE CASCADE).
+--   - The kept job's URL is replaced with the canonical URL.
+-- jobs is locked against writes while this runs, so the old code can't add a duplicate between the merge and the
+-- constraint.
+
+BEGIN;
+
+LOCK TABLE jobscraper.jobs IN SHARE ROW EXCLUSIVE MODE;
+
+-- Same as job_cache.canonical_url: lowercase scheme and host, no fragment, no trailing slash, and no query parameters
+-- starting with utm_, trk or refid. The other parameters are kept as written.
+CREATE FUNCTION pg_temp.canonical_url(url text) RETURNS text LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN url IS NULL OR url = '' THEN url ELSE
+        coalesce(lower(m[1]) || ':', '') || coalesce('//' || lower(nullif(m[2], '')), '') || rtrim(m[3], '/')
+        || coalesce('?' || nullif(array_to_string(ARRAY(
+               SELECT parameter
+               FROM unnest(string_to_array(m[4], '&')) WITH ORDINALITY AS parameters(parameter, position)
+               WHERE parameter <> '' AND lower(split_part(parameter, '=', 1)) !~ '^(utm_|trk|refid)'
+               ORDER BY position), '&'), ''), '')
+    END
+    FROM regexp_match(btrim(url, E' \t\n\r\f'),
+                      '^(?:([A-Za-z][A-Za-z0-9+.-]*):)?(?://([^/?#]*))?([^?#]*)(?:\?([^#]*))?') AS m
+$$;
+
+CREATE TEMPORARY TABLE job_merges ON COMMIT DROP AS
+SELECT id AS old_id, keep_id
+FROM (
+    SELECT id, first_value(id) OVER (PARTITION BY pg_temp.canonical_url(url) ORDER BY created_at, id) AS keep_id
+    FROM jobscraper.jobs
+    WHERE url IS NOT NULL
+) copies
+WHERE id <> keep_id;
+
+-- One row per user for each kept job, so moving the rest doesn't break users_jko_pkey
+DELETE FROM jobscraper.users_jobs uj
+USING (
+    SELECT
+        a.user_id,
+        a.job_id,
+        row_number() OVER (
+            PARTITION BY a.user_id, coalesce(m.keep_id, a.job_id)
+            ORDER BY a.interested IS NOT NULL DESC, a.email_sent DESC, a.score DESC NULLS LAST, m.keep_id IS NULL DESC
+        ) AS rank
+    FROM jobscraper.users_jobs a
+    LEFT JOIN job_merges m ON m.old_id = a.job_id
+    WHERE coalesce(m.keep_id, a.job_id) IN (SELECT keep_id FROM job_merges)
+) ranked
+WHERE uj.user_id = ranked.user_id AND uj.job_id = ranked.job_id AND ranked.rank > 1;
+
+UPDATE jobscraper.users_jobs uj
+SET job_id = m.keep_id
+FROM job_merges m
+WHERE uj.job_id = m.old_id;
+
+INSERT INTO jobscraper.job_descriptions (job_id, description)
+SELECT DISTINCT ON (m.keep_id) m.keep_id, d.description
+FROM job_merges m
+JOIN jobscraper.job_descriptions d ON d.job_id = m.old_id
+WHERE d.description IS NOT NULL
+ORDER BY m.keep_id, length(d.description) DESC
+ON CONFLICT (job_id) DO UPDATE SET description = EXCLUDED.description
+    WHERE jobscraper.job_descriptions.description IS NULL;
+
+DELETE FROM jobscraper.jobs j
+USING job_merges m
+WHERE j.id = m.old_id;
+
+UPDATE jobscraper.jobs
+SET url = pg_temp.canonical_url(url)
+WHERE url IS DISTINCT FROM pg_temp.canonical_url(url);
+
+ALTER TABLE ONLY jobscraper.jobs
+    ADD CONSTRAINT jobs_url_key UNIQUE (url);
+
+COMMIT;
+
+-- Outside the transaction, so jobs stays writable while they build
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_date_posted_idx ON jobscraper.jobs USING btree (date_posted);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_date_pulled_idx ON jobscraper.jobs USING btree (date_pulled);
+
+ANALYZE jobscraper.jobs;
+ANALYZE jobscraper.users_jobs;
@@ -42,7 +42,6 @@ CREATE TABLE jobscraper.jobs (
     comp_max integer,
     comp_currency text,
     emails text,
-    description text,
     searched_title text,
     id uuid DEFAULT gen_random_uuid() NOT NULL,
     date_pulled date
@@ -59,14 +58,15 @@ ALTER TABLE jobscraper.jobs OWNER TO postgres;
 CREATE TABLE jobscraper.users_jobs (
     user_id uuid NOT NULL,
     job_id uuid NOT NULL,
-    score text,
+    score smallint,
     interested boolean,
-    desire_score text,
-    experience_score text,
-    meets_requirements_score text,
-    meets_experience_score text,
+    desire_score smallint,
+    experience_score smallint,
+    meets_requirements_score smallint,
+    meets_experience_score smallint,
     email_sent boolean DEFAULT false NOT NULL,
-    guidance text
+    guidance text,
+    assessment_bits integer
 );
 
 
@@ -130,6 +130,90 @@ CREATE TABLE jobscraper.users (
 
 ALTER TABLE jobscraper.users OWNER TO postgres;
 
+--
+-- Name: job_descriptions; Type: TABLE; Schema: jobscraper; Owner: postgres
+--
+
+CREATE TABLE jobscraper.job_descriptions (
+    job_id uuid NOT NULL,
+    description text COMPRESSION lz4
+);
+
+
+ALTER TABLE jobscraper.job_descriptions OWNER TO postgres;
+
+ALTER TABLE ONLY jobscraper.job_descriptions
+    ADD CONSTRAINT job_descriptions_pkey PRIMARY KEY (job_id);
+
+ALTER TABLE ONLY jobscraper.job_descriptions
+    ADD CONSTRAINT job_descriptions_job_id_fkey FOREIGN KEY (job_id) REFERENCES jobscraper.jobs(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
+GRANT ALL ON TABLE jobscraper.job_descriptions TO anon;
+GRANT ALL ON TABLE jobscraper.job_descriptions TO authenticated;
+GRANT ALL ON TABLE jobscraper.job_descriptions TO service_role;
+
+--
+-- Name: resume_profiles; Type: TABLE; Schema: jobscraper; Owner: postgres
+--
+
+CREATE TABLE jobscraper.resume_profiles (
+    resume_hash text NOT NULL,
+    profile jsonb NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE jobscraper.resume_profiles OWNER TO postgres;
+
+ALTER TABLE ONLY jobscraper.resume_profiles
+    ADD CONSTRAINT resume_profiles_pkey PRIMARY KEY (resume_hash);
+
+GRANT ALL ON TABLE jobscraper.resume_profiles TO service_role;
+
+--
+-- Name: evaluation_cursors; Type: TABLE; Schema: jobscraper; Owner: postgres
+--
+
+CREATE TABLE jobscraper.evaluation_cursors (
+    user_id uuid NOT NULL,
+    evaluated_urls jsonb DEFAULT '[]'::jsonb NOT NULL,
+    good_jobs_today integer DEFAULT 0 NOT NULL,
+    cursor_date date,
+    updated_at timestamp with time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE jobscraper.evaluation_cursors OWNER TO postgres;
+
+ALTER TABLE ONLY jobscraper.evaluation_cursors
+    ADD CONSTRAINT evaluation_cursors_pkey PRIMARY KEY (user_id);
+
+GRANT ALL ON TABLE jobscraper.evaluation_cursors TO service_role;
+
+--
+-- Name: evaluation_store; Type: TABLE; Schema: jobscraper; Owner: postgres
+--
+
+CREATE TABLE jobscraper.evaluation_store (
+    id bigint GENERATED ALWAYS AS IDENTITY NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    resume_hash text NOT NULL,
+    profile_hash text NOT NULL,
+    fingerprint bigint NOT NULL,
+    title text,
+    assessment jsonb NOT NULL
+);
+
+
+ALTER TABLE jobscraper.evaluation_store OWNER TO postgres;
+
+ALTER TABLE ONLY jobscraper.evaluation_store
+    ADD CONSTRAINT evaluation_store_pkey PRIMARY KEY (id);
+
+CREATE INDEX evaluation_store_key_idx ON jobscraper.evaluation_store USING btree (resume_hash, profile_hash, created_at);
+
+GRANT ALL ON TABLE jobscraper.evaluation_store TO service_role;
+
 --
 -- TOC entry 3667 (class 2606 OID 31352)
 -- Name: jobs jobs_pkey; Type: CONSTRAINT; Schema: jobscraper; Owner: postgres
@@ -138,6 +222,18 @@ ALTER TABLE jobscraper.users OWNER TO postgres;
 ALTER TABLE ONLY jobscraper.jobs
     ADD CONSTRAINT jobs_pkey PRIMARY KEY (id);
 
+ALTER TABLE ONLY jobscraper.jobs
+    ADD CONSTRAINT jobs_url_key UNIQUE (url);
+
+-- Recent job lookups filter on date_posted, or date_pulled when it is null
+CREATE INDEX jobs_date_posted_idx ON jobscraper.jobs USING btree (date_posted);
+
+CREATE INDEX jobs_date_pulled_idx ON jobscraper.jobs USING btree (date_pulled);
+
+-- A user's unemailed recommendations, best first, for recent_high_score_jobs and the email digest
+CREATE INDEX users_jobs_email_score_idx ON jobscraper.users_jobs USING btree (user_id, email_sent, score DESC)
+    INCLUDE (job_id) WHERE (score >= 50);
+
 
 --
 -- TOC entry 3669 (class 2606 OID 30820)
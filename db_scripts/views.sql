@@ -38,4 +38,4 @@ WHERE
       or uj.has_applied = true
     )
     AND
-    uj.score::INT >= 50
+    uj.score >= 50
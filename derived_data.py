@@ -0,0 +1,103 @@
+"""
+short_summary and hard_requirements are generated when a job is about to be seen rather than for every rated job:
+when it makes an email digest, when the frontend opens it, or in a bounded background fill of the best matches.
+
+python derived_data.py fill [--limit N]   # fill the highest scoring recommended jobs still missing derived data
+python derived_data.py job <job_id>       # generate derived data for one job, e.g. on a frontend view
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from job_helpers import get_derived_data_for_job
+from llm_config import DERIVED_DATA_MAX_WORKERS, DERIVED_DATA_FILL_LIMIT
+from llm_metering import metering_context, allows_optional_work
+from persistent_storage import get_jobs_by_ids, save_derived_data, get_job_ids_missing_derived_data
+
+DERIVED_FIELDS = ('short_summary', 'hard_requirements')
+JOB_COLUMNS = 'id, title, company, location, description, comp_min, comp_max, comp_interval, ' + \
+              ', '.join(DERIVED_FIELDS)
+
+derived_data_stats = {
+    'generated': 0,
+    'failed': 0,
+}
+
+
+def needs_derived_data(job):
+    return any(not job.get(field) for field in DERIVED_FIELDS)
+
+
+def materialize_job(job):
+    """Generate and save the derived data for one stored job. Returns the job with the fields filled in, or None."""
+    # get_derived_data_for_job reads the scraper's column names
+    with metering_context(stage='derived_data', job_id=job['id']):
+        derived_data = get_derived_data_for_job({**job, 'min_amount': job.get('comp_min'),
+                                                 'max_amount': job.get('comp_max'),
+                                                 'interval': job.get('comp_interval')})
+    if any(derived_data.get(field) is None for field in DERIVED_FIELDS):
+        derived_data_stats['failed'] += 1
+        print(f"Unable to generate derived data for job {job['id']}")
+        return None
+
+    save_derived_data(job['id'], derived_data)
+    derived_data_stats['generated'] += 1
+    job.update(derived_data)
+    return job
+
+
+def materialize_derived_data(job_ids, max_workers=DERIVED_DATA_MAX_WORKERS):
+    """
+    Makes sure each job has its derived data, generating it for the ones that don't with at most max_workers
+    jobs in flight. Returns a dict of job_id -> job row.
+    """
+    jobs = get_jobs_by_ids(job_ids, columns=JOB_COLUMNS)
+    missing = [job for job in jobs if needs_derived_data(job)]
+    if missing:
+        print(f"Generating derived data for {len(missing)} of {len(jobs)} jobs")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(materialize_job, missing))
+
+    return {job['id']: job for job in jobs}
+
+
+def fill_derived_data(limit=DERIVED_DATA_FILL_LIMIT, max_workers=DERIVED_DATA_MAX_WORKERS):
+    """Background fill for the highest scoring recommended jobs that nobody has looked at yet."""
+    if not allows_optional_work():
+        print("LLM spend is close to the run budget, skipping the derived data fill")
+        return {}
+
+    job_ids = get_job_ids_missing_derived_data(limit)
+    if not job_ids:
+        return {}
+
+    return materialize_derived_data(job_ids, max_workers=max_workers)
+
+
+def print_derived_data_report():
+    if derived_data_stats['generated'] == 0 and derived_data_stats['failed'] == 0:
+        return
+
+    print(f"Derived data: generated for {derived_data_stats['generated']} jobs, "
+          f"{derived_data_stats['failed']} failed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate job summaries and hard requirements on demand")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fill_parser = subparsers.add_parser('fill')
+    fill_parser.add_argument('--limit', type=int, default=DERIVED_DATA_FILL_LIMIT)
+    job_parser = subparsers.add_parser('job')
+    job_parser.add_argument('job_id')
+    args = parser.parse_args()
+
+    if args.command == 'fill':
+        fill_derived_data(args.limit)
+    else:
+        job = materialize_derived_data([args.job_id]).get(args.job_id)
+        if job is None:
+            print(f"Job {args.job_id} not found")
+        else:
+            for field in DERIVED_FIELDS:
+                print(f"{field}:\n{job.get(field)}\n")
+
+    print_derived_data_report()
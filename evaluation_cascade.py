@@ -0,0 +1,163 @@
+import random
+import re
+
+from llm import build_json_schema_format
+from llm_client import create_completion
+from llm_metering import metering_context
+from llm_config import MODEL_FAST, SCREEN_MODE, SCREEN_CUTOFF, SCREEN_AUDIT_RATE, \
+    SCREEN_DESCRIPTION_TOKENS
+from models import JobScreenBatch
+from text_compaction import compact_description
+
+# Counts for the current run, per tier
+cascade_stats = {
+    'screened': 0,  # jobs that went through the screening tier
+    'screen_passed': 0,  # jobs at or above the cutoff, sent on to the full evaluation
+    'screen_rejected': 0,  # jobs below the cutoff
+    'screen_failed': 0,  # jobs the screen couldn't score, sent on to the full evaluation
+    'audited': 0,  # rejected jobs fully evaluated anyway to check the screen
+    'full_evaluations': 0,  # jobs sent to the structured evaluation
+    'passed_and_over_50': 0,  # passed jobs whose full score was over 50
+    'audited_and_over_50': 0,  # audited jobs whose full score was over 50, i.e. the screen was wrong
+}
+
+
+def create_screening_prompt(jobs, resume, job_titles, skill_words):
+    job_blocks = "\n".join(f"=== job_id: {job['job_id']} ===\nTitle: {job['title']}\nDescription: {job['snippet']}\n"
+                           for job in jobs)
+    return f"""Quickly screen these jobs for the candidate. For each job, give a rough fit score from 0 to 100,
+       where 0 is clearly wrong for the candidate (wrong field, wrong level, unwanted role) and 100 is a strong match.
+
+       Candidate: {resume}
+       Preferred titles: {', '.join(job_titles)}
+       Desired skills: {', '.join(skill_words)}
+
+{job_blocks}
+       Return one entry per job in "screens", with job_id copied exactly as given.
+       """
+
+
+def llm_fit_scores(jobs, rating_inputs):
+    """One MODEL_FAST request scoring every job on a short snippet of its description."""
+    screening_jobs = [{'job_id': job['job_id'], 'title': job['title'],
+                       'snippet': compact_description(job['description'], SCREEN_DESCRIPTION_TOKENS)[0]}
+                      for job in jobs]
+    properties = {
+        "screens": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"job_id": {"type": "string"}, "fit_score": {"type": "integer"}},
+                "required": ["job_id", "fit_score"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+    try:
+        with metering_context(stage='screen', user_id=rating_inputs.get('user_id')):
+            completion = create_completion({
+                "model": MODEL_FAST,
+                "messages": [
+                    {"role": "system",
+                     "content": "You are a recruiter screening jobs for a candidate. Be quick and decisive."},
+                    {"role": "user", "content": create_screening_prompt(screening_jobs, rating_inputs['resume'],
+                                                                        rating_inputs['job_titles'],
+                                                                        rating_inputs['skill_words'])}
+                ],
+                "response_format": build_json_schema_format("job_screens", properties)
+            })
+        screens = JobScreenBatch.model_validate_json(completion.choices[0].message.content)
+        return {screen.job_id: screen.fit_score for screen in screens.screens}
+    except Exception as e:
+        print(f"Error screening jobs: {e}")
+        return {}
+
+
+def words(text):
+    return set(re.findall(r'[a-z0-9+#]+', (text or '').lower()))
+
+
+def heuristic_fit_score(job, rating_inputs):
+    """Local fit score from title overlap with the preferred titles and coverage of the desired skills."""
+    job_title_words = words(job['title'])
+    title_match = max((len(job_title_words & words(title)) / len(words(title))
+                       for title in rating_inputs['job_titles'] if words(title)), default=0.5)
+
+    description = job['description'].lower()
+    skill_words = [skill.lower() for skill in rating_inputs['skill_words'] if skill.strip()]
+    skill_coverage = (sum(1 for skill in skill_words if skill in description) / len(skill_words)
+                      if skill_words else 0.5)
+
+    return int(100 * (0.5 * title_match + 0.5 * min(1.0, skill_coverage * 2)))
+
+
+def screen_jobs(pending_jobs, rating_inputs):
+    """
+    Screens pending jobs and returns (jobs_to_evaluate, rejected_jobs, audited_job_ids). Jobs below SCREEN_CUTOFF
+    are rejected, except for a random SCREEN_AUDIT_RATE sample that is evaluated anyway to check the screen.
+    """
+    if SCREEN_MODE == 'off' or len(pending_jobs) == 0:
+        return pending_jobs, [], set()
+
+    if SCREEN_MODE == 'heuristic':
+        fit_scores = {job['job_id']: heuristic_fit_score(job, rating_inputs) for job in pending_jobs}
+    else:
+        fit_scores = llm_fit_scores(pending_jobs, rating_inputs)
+
+    jobs_to_evaluate = []
+    rejected_jobs = []
+    audited_job_ids = set()
+    for job in pending_jobs:
+        cascade_stats['screened'] += 1
+        fit_score = fit_scores.get(job['job_id'])
+        if fit_score is None:
+            cascade_stats['screen_failed'] += 1
+            jobs_to_evaluate.append(job)
+        elif fit_score >= SCREEN_CUTOFF:
+            cascade_stats['screen_passed'] += 1
+            jobs_to_evaluate.append(job)
+        else:
+            cascade_stats['screen_rejected'] += 1
+            if random.random() < SCREEN_AUDIT_RATE:
+                cascade_stats['audited'] += 1
+                audited_job_ids.add(job['job_id'])
+                jobs_to_evaluate.append(job)
+            else:
+                print(f"{job['index']}: Screened out {job['title']} at {job['company']} (fit {fit_score})")
+                rejected_jobs.append(job)
+
+    cascade_stats['full_evaluations'] += len(jobs_to_evaluate)
+    return jobs_to_evaluate, rejected_jobs, audited_job_ids
+
+
+def record_cascade_results(jobs_df, evaluated_jobs):
+    """Compare the full evaluation with the screen, for agreement reporting. Audited jobs are flagged audit='screen'."""
+    if SCREEN_MODE == 'off':
+        return
+
+    for job in evaluated_jobs:
+        over_50 = float(jobs_df.at[job['index'], 'job_score']) > 50
+        if job.get('audit') == 'screen':
+            if over_50:
+                cascade_stats['audited_and_over_50'] += 1
+                print(f"{job['index']}: Screen disagreed on {job['title']} at {job['company']}, "
+                      f"full score {jobs_df.at[job['index'], 'job_score']}")
+        elif over_50 and not job.get('audit'):
+            cascade_stats['passed_and_over_50'] += 1
+
+
+def print_cascade_report():
+    if SCREEN_MODE == 'off':
+        return
+
+    stats = cascade_stats
+    calls_saved = stats['screen_rejected'] - stats['audited']
+    print(f"Cascade ({SCREEN_MODE} screen, cutoff {SCREEN_CUTOFF}): screened {stats['screened']} jobs, "
+          f"{stats['screen_passed']} passed, {stats['screen_rejected']} rejected, {stats['screen_failed']} failed")
+    print(f"Cascade: {stats['full_evaluations']} full evaluations, {calls_saved} saved")
+    if stats['screen_passed'] > 0:
+        print(f"Cascade: {stats['passed_and_over_50']} of {stats['screen_passed']} passed jobs scored over 50")
+    if stats['audited'] > 0:
+        agreement = 1 - stats['audited_and_over_50'] / stats['audited']
+        print(f"Cascade: audited {stats['audited']} rejected jobs, screen agreed on {agreement:.0%}")
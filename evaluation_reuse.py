@@ -0,0 +1,125 @@
+"""
+Reposted jobs (same role, trivial edits, new URL or board) reuse the stored evaluation of the earlier posting
+instead of going back to the LLM. Stored evaluations are keyed by a hash of the resume text in the prompt, a hash of
+the user's titles, skills and stop words, and a 64-bit simhash of the job title and description. A job reuses the
+closest stored evaluation whose simhash is within EVAL_REUSE_MAX_DISTANCE bits of its own.
+"""
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+
+from llm_config import EVAL_REUSE_MODE, EVAL_REUSE_MAX_DISTANCE, EVAL_REUSE_MAX_AGE_DAYS
+from models import JobAssessment
+from persistent_storage import get_stored_evaluations
+from write_behind import queue_stored_evaluation
+
+SIMHASH_BITS = 64
+SHINGLE_WORDS = 3
+
+reuse_stats = {
+    'looked_up': 0,
+    'reused': 0,
+    'stored': 0,
+}
+
+# (resume_hash, profile_hash) -> list of (fingerprint, assessment json), loaded once per run
+_stored_by_key = {}
+
+
+def short_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def evaluation_key(rating_inputs):
+    """(resume_hash, profile_hash) for the inputs an evaluation prompt is built from."""
+    profile = json.dumps({field: sorted(rating_inputs[field]) for field in ('job_titles', 'skill_words', 'stop_words')},
+                         sort_keys=True)
+    return short_hash(rating_inputs['resume'] or ''), short_hash(profile)
+
+
+def simhash(text):
+    """64-bit simhash over overlapping word shingles, so small edits only flip a few bits."""
+    words = re.findall(r'[a-z0-9]+', text.lower())
+    shingles = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))]
+
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    fingerprint = sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+    # Stored in a Postgres bigint, which is signed
+    return fingerprint - (1 << SIMHASH_BITS) if fingerprint >= 1 << (SIMHASH_BITS - 1) else fingerprint
+
+
+def hamming_distance(first, second):
+    return bin((first ^ second) & ((1 << SIMHASH_BITS) - 1)).count('1')
+
+
+def job_fingerprint(title, description):
+    return simhash(f"{title or ''} {description or ''}")
+
+
+def stored_evaluations(key):
+    if key not in _stored_by_key:
+        since = (datetime.now() - timedelta(days=EVAL_REUSE_MAX_AGE_DAYS)).isoformat()
+        _stored_by_key[key] = [(row['fingerprint'], row['assessment']) for row in get_stored_evaluations(*key, since)]
+    return _stored_by_key[key]
+
+
+def find_reusable_assessment(key, fingerprint, max_distance=EVAL_REUSE_MAX_DISTANCE):
+    """The stored assessment closest to the fingerprint within max_distance bits, or None."""
+    best = None
+    for stored_fingerprint, assessment in stored_evaluations(key):
+        distance = hamming_distance(fingerprint, stored_fingerprint)
+        if distance <= max_distance and (best is None or distance < best[0]):
+            best = (distance, assessment)
+
+    if best is None:
+        return None
+    assessment = best[1]
+    return JobAssessment.model_validate_json(assessment) if isinstance(assessment, str) \
+        else JobAssessment.model_validate(assessment)
+
+
+def reusable_assessments(pending_jobs, rating_inputs):
+    """Returns (reused_jobs, remaining_jobs), where reused_jobs is a list of (job, JobAssessment) for the reposts."""
+    if not EVAL_REUSE_MODE or len(pending_jobs) == 0:
+        return [], pending_jobs
+
+    key = evaluation_key(rating_inputs)
+    reused_jobs = []
+    remaining_jobs = []
+    for job in pending_jobs:
+        reuse_stats['looked_up'] += 1
+        assessment = find_reusable_assessment(key, job['fingerprint'])
+        if assessment is None:
+            remaining_jobs.append(job)
+        else:
+            reuse_stats['reused'] += 1
+            print(f"{job['index']}: Reusing the evaluation of a near-identical posting for {job['title']} "
+                  f"at {job['company']}")
+            reused_jobs.append((job, assessment))
+
+    return reused_jobs, remaining_jobs
+
+
+def store_assessment(job, rating_inputs, assessment):
+    if not EVAL_REUSE_MODE:
+        return
+
+    key = evaluation_key(rating_inputs)
+    assessment_json = assessment.model_dump()
+    queue_stored_evaluation(*key, job['fingerprint'], job['title'], assessment_json)
+    reuse_stats['stored'] += 1
+    stored_evaluations(key).append((job['fingerprint'], assessment_json))
+
+
+def print_reuse_report():
+    if reuse_stats['looked_up'] == 0:
+        return
+
+    print(f"Evaluation reuse: {reuse_stats['reused']} of {reuse_stats['looked_up']} jobs reused a stored evaluation, "
+          f"{reuse_stats['stored']} new evaluations stored")
@@ -1,7 +1,27 @@
 import re
 
+import tiktoken
+
+_encoding = None
+
 
 def consolidate_text(text):
     consolidated = text.replace('\r', ' ').replace('\n', ' ')
     consolidated = re.sub(' +', ' ', consolidated)
     return consolidated
+
+
+def count_tokens(text):
+    """Count prompt tokens with the cl100k encoding, falling back to a 4 chars/token estimate."""
+    global _encoding
+    if not text:
+        return 0
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Unable to load tiktoken encoding, estimating tokens instead: {e}")
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,111 @@
+"""
+Identity map for jobs rows, so a job is read from storage at most once per process. Rows are indexed by ID and by
+canonical URL, kept in least recently used order up to STORAGE_JOB_CACHE_SIZE rows, and remember which columns
+they were read with, so a row loaded without its description doesn't answer a request that needs one.
+persistent_storage reads through the cache and merges its own job writes into it.
+"""
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+TRACKING_PARAMS = ('utm_', 'trk', 'refid')
+
+job_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evicted': 0,
+}
+
+
+def canonical_url(url):
+    """
+    The URL with a lowercase scheme and host, no fragment, no tracking parameters and no trailing slash. Jobs are
+    stored under this URL. The other query parameters are kept exactly as written, so
+    migrations/004_jobs_url_key.sql can compute the same URL for rows stored before.
+    """
+    if not url or not isinstance(url, str):
+        return url
+    parts = urlsplit(url.strip())
+    query = '&'.join(parameter for parameter in parts.query.split('&')
+                     if parameter and not parameter.split('=', 1)[0].lower().startswith(TRACKING_PARAMS))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+
+def parse_columns(columns):
+    """None for '*', otherwise the set of column names in a select list."""
+    names = {column.strip() for column in columns.split(',') if column.strip()}
+    return None if '*' in names else names
+
+
+def with_key_columns(columns):
+    """The select list with id and url added, since the cache indexes rows by both."""
+    if parse_columns(columns) is None:
+        return columns
+    names = [column.strip() for column in columns.split(',') if column.strip()]
+    return ', '.join(['id', 'url'] + [name for name in names if name not in ('id', 'url')])
+
+
+class JobCache:
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.rows = OrderedDict()  # job_id -> (row, complete), complete when read with '*'
+        self.ids_by_url = {}
+
+    def _has_columns(self, entry, columns):
+        row, complete = entry
+        return complete or (columns is not None and columns <= row.keys())
+
+    def get(self, job_id, columns=None):
+        """The cached row if it has the columns (a set, None for all of them), otherwise None."""
+        with self.lock:
+            entry = self.rows.get(job_id)
+            if entry is None or not self._has_columns(entry, columns):
+                job_cache_stats['misses'] += 1
+                return None
+            self.rows.move_to_end(job_id)
+            job_cache_stats['hits'] += 1
+            return dict(entry[0])
+
+    def get_by_url(self, url, columns=None):
+        job_id = self.ids_by_url.get(canonical_url(url))
+        if job_id is None:
+            job_cache_stats['misses'] += 1
+            return None
+        return self.get(job_id, columns)
+
+    def put(self, row, complete=False):
+        """Adds or merges a row read from storage, it must include its id."""
+        if self.max_rows <= 0 or row.get('id') is None:
+            return
+        with self.lock:
+            job_id = row['id']
+            cached_row, cached_complete = self.rows.pop(job_id, ({}, False))
+            merged = {**cached_row, **row}
+            self.rows[job_id] = (merged, complete or cached_complete)
+            if merged.get('url'):
+                self.ids_by_url[canonical_url(merged['url'])] = job_id
+            while len(self.rows) > self.max_rows:
+                evicted_id, (evicted_row, _) = self.rows.popitem(last=False)
+                self.ids_by_url.pop(canonical_url(evicted_row.get('url')), None)
+                job_cache_stats['evicted'] += 1
+
+    def update(self, job_id, values):
+        """Applies one of our own writes to the cached row, if there is one."""
+        with self.lock:
+            entry = self.rows.get(job_id)
+            if entry is None:
+                return
+            row, complete = entry
+            if 'url' in values and row.get('url') != values['url']:
+                self.ids_by_url.pop(canonical_url(row.get('url')), None)
+                if values['url']:
+                    self.ids_by_url[canonical_url(values['url'])] = job_id
+            self.rows[job_id] = ({**row, **values}, complete)
+
+def print_job_cache_report():
+    if job_cache_stats['hits'] == 0 and job_cache_stats['misses'] == 0:
+        return
+
+    print(f"Job cache: {job_cache_stats['hits']} hits, {job_cache_stats['misses']} misses, "
+          f"{job_cache_stats['evicted']} rows evicted")
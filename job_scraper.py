@@ -138,6 +138,17 @@ def remove_titles_not_matching_go_words(df, go_words):
     return filtered_df
 
 
+def build_job_context(row):
+    job_description = f"Title: {row.get('title', 'N/A')}\nCompany: {row.get('company', 'N/A')}\nLocation: {row.get('location', 'N/A')}\n" \
+                      f"Description: {row.get('description', 'N/A')}\n"
+
+    pay_info = (
+        f"Pays between {row.get('min_amount', 'N/A')} and {row.get('max_amount', 'N/A')} on a(n) {row.get('interval', 'N/A')}'"
+        f" basis.") if row.get('interval', '') else ""
+
+    return job_description + pay_info
+
+
 def add_derived_data(jobs_df, derived_data_questions=[], resume=None):
     if len(derived_data_questions) == 0:
         return jobs_df
@@ -146,14 +157,7 @@ def add_derived_data(jobs_df, derived_data_questions=[], resume=None):
     derived_data = pd.DataFrame(index=jobs_df.index)
 
     for index, row in jobs_df.iterrows():
-        job_description = f"Title: {row.get('title', 'N/A')}\nCompany: {row.get('company', 'N/A')}\nLocation: {row.get('location', 'N/A')}\n" \
-                          f"Description: {row.get('description', 'N/A')}\n"
-
-        pay_info = (
-            f"Pays between {row.get('min_amount', 'N/A')} and {row.get('max_amount', 'N/A')} on a(n) {row.get('interval', 'N/A')}'"
-            f" basis.") if row.get('interval', '') else ""
-
-        job_description += pay_info
+        job_description = build_job_context(row)
 
         print(f"{index}: Processing: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}")
 
@@ -1,13 +1,17 @@
 import os
+import random
 import time
 import re
+import json
 
 from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit
 
 from supabase import create_client, Client
 from supabase.lib.client_options import ClientOptions
 
 import pandas as pd
+import openai
 from openai import OpenAI
 
 from jobspy import scrape_jobs  # python-jobspy package
@@ -15,6 +19,68 @@ from jobspy import scrape_jobs  # python-jobspy package
 # OpenRouter configuration
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 MODEL_FAST = os.environ.get("LLM_MODEL_FAST", "openai/gpt-4.1-nano")
+DESCRIPTION_TOKEN_BUDGET = int(os.environ.get("LLM_DESCRIPTION_TOKEN_BUDGET", "1500"))
+
+# Jobs are evaluated a chunk at a time until enough score over 70 or the evaluation budget is used
+EARLY_STOP_TARGET_JOBS = int(os.environ.get("LLM_EARLY_STOP_TARGET_JOBS", "3"))
+EARLY_STOP_MAX_EVALUATIONS = int(os.environ.get("LLM_EARLY_STOP_MAX_EVALUATIONS", "20"))
+EARLY_STOP_CHUNK_JOBS = 5
+
+# "lazy" leaves short_summary and hard_requirements for the first view of a job, "eager" makes them for every rated job
+DERIVED_DATA_MODE = os.environ.get("LLM_DERIVED_DATA_MODE", "lazy").lower()
+
+# Errors worth retrying, kept in sync with llm_client.py in the main app. Anything else (bad requests, auth) fails
+# the call at once.
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError, openai.ConflictError)
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+LLM_BACKOFF_BASE_SECONDS = 3
+LLM_BACKOFF_MAX_SECONDS = 30
+
+# Jobs are stored under their canonical URL, kept in sync with job_cache.py in the main app
+TRACKING_PARAMS = ('utm_', 'trk', 'refid')
+
+# Description compaction, kept in sync with text_compaction.py in the main app
+BOILERPLATE_HEADINGS = ['equal opportunity', 'equal employment', 'eeo', 'diversity', 'inclusion', 'accommodation',
+                        'about us', 'about the company', 'who we are', 'our mission', 'our values', 'our culture',
+                        'life at', 'why join', 'why work', 'privacy', 'disclaimer', 'legal', 'e-verify',
+                        'pay transparency', 'applicant', 'notice to', 'california residents']
+BENEFITS_HEADINGS = ['benefits', 'perks', 'what we offer', 'we offer', 'compensation and benefits']
+PRIORITY_HEADINGS = ['requirement', 'qualification', 'responsibilit', "what you'll do", 'what you will do',
+                     'what you bring', "what you'll bring", 'must have', 'skills', 'experience', 'about the role',
+                     'the role', 'your role', 'duties', 'you will', 'you have', 'education', 'nice to have',
+                     'preferred', 'salary', 'compensation', 'pay range']
+BOILERPLATE_PHRASES = ['equal opportunity employer', 'without regard to', 'regardless of race', 'sexual orientation',
+                       'gender identity', 'protected veteran', 'reasonable accommodation', 'e-verify',
+                       'pay transparency', 'fair chance', 'arrest and conviction', 'privacy policy',
+                       'privacy notice', 'do not accept unsolicited', 'recruitment agencies', 'drug-free workplace',
+                       'background check', 'at-will']
+# Rating fields, with the labels from the old free-text template so replies in that format can still be salvaged
+LEGACY_RATING_LABELS = {
+    'desire_score': 'Candidate desire match',
+    'experience_score': 'Candidate experience match',
+    'meets_requirements_score': 'Hiring manager skill match',
+    'meets_experience_score': 'Hiring manager experience match',
+    'overall_score': 'Final overall match assessment',
+    'guidance': 'Explanation of ratings'
+}
+RATING_INSTRUCTIONS = """make the following ratings:
+    1) How the candidate would rate this job on a scale from 1 to 100 in terms of how well it matches their
+    experience and the type of job they desire (desire_score).
+    2) How the candidate would rate this job on a scale from 1 to 100 as a match for their experience level,
+    they aren't underqualified or overqualified (experience_score).
+    3) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how well the
+    candidate meets the skill requirements for this job (meets_requirements_score).
+    4) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how well the
+    candidate meets the experience requirements for this job (meets_experience_score).
+    5) Consider the results from steps 1 through 4 then give a final assessment from 1 to 100, where 1 is very
+    little chance of this being a good match for the candidate and hiring manager, and 100 being a perfect match
+    where the candidate will have a great chance to succeed in this role (overall_score).
+    For experience level, look for cues in the jobs description that list years of experience, then compare that
+    to the level of experience you believe the candidate to have (make an assessment based on year in directly
+    applicable fields of work).
+    Address the candidate directly in the guidance, closely following this template:
+    You may <like, be lukewarm on, or dislike> this job because of the following reasons: <reasons in one sentence>. The hiring manager may think you would be a <good, reasonable, or bad> fit for this job because of <reasons, in one sentence>. Overall, I think <your overall thoughts about the match between the user and the job in one sentence>."""
 # import numpy as np
 # from sklearn.feature_extraction.text import TfidfVectorizer
 # from sklearn.metrics.pairwise import cosine_similarity
@@ -41,44 +107,59 @@ def jobs_app_function(context):
         jobs_app_scheduled(context.get_json(), context.context)
         return 'Scheduled job executed successfully', 200
 
-    def query_llm(model_name, system, messages=[]):
+    def is_retryable(error):
+        if isinstance(error, RETRYABLE_ERRORS):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+    def query_llm(model_name, system, messages=[], response_format=None):
         max_retries = 3
-        wait_time = 3
+
+        api_key = os.environ.get("OPENROUTER_API_KEY")
+        if not api_key:
+            logging.error("Environment variable OPENROUTER_API_KEY is not set.")
+            return None
+
+        client = OpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=api_key,
+            max_retries=0,
+            default_headers={
+                "HTTP-Referer": "https://jobs.timetovalue.org",
+                "X-Title": "Job Scraper GCP",
+            },
+        )
 
         # Build messages list without mutating the caller's list
         messages_with_system = [{"role": "system", "content": system}] + messages
 
         for attempt in range(max_retries):
             try:
-                api_key = os.environ.get("OPENROUTER_API_KEY")
-                if not api_key:
-                    raise ValueError("Environment variable OPENROUTER_API_KEY is not set.")
-
-                client = OpenAI(
-                    base_url=OPENROUTER_BASE_URL,
-                    api_key=api_key,
-                    default_headers={
-                        "HTTP-Referer": "https://jobs.timetovalue.org",
-                        "X-Title": "Job Scraper GCP",
-                    },
-                )
                 completion = client.chat.completions.create(
                     messages=messages_with_system,
-                    max_tokens=256,
+                    max_tokens=256 if response_format is None else 512,
                     model=model_name,
-                    temperature=1.0
+                    temperature=1.0,
+                    **({"response_format": response_format} if response_format else {})
                 )
                 return completion.choices[0].message.content
 
             except Exception as e:
-                logging.error(
-                    f"An unexpected error occurred: {e}. Attempt {attempt + 1} of {max_retries}. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-                wait_time *= 2  # Exponential backoff
+                if not is_retryable(e):
+                    logging.error(f"LLM call to {model_name} failed and won't be retried: {e}")
+                    return None
                 if attempt == max_retries - 1:
-                    logging.error(f"Failed after {max_retries} attempts.")
+                    logging.error(f"LLM call to {model_name} failed after {max_retries} attempts: {e}")
                     return None
 
+                # Full jitter exponential backoff
+                wait_time = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                logging.error(f"LLM call to {model_name} failed: {e}. Attempt {attempt + 1} of {max_retries}. "
+                              f"Retrying in {wait_time:.1f} seconds...")
+                time.sleep(wait_time)
+
         return None
 
     def get_jobs_for_user(job_site, user_id, job_titles):
@@ -220,27 +301,30 @@ def jobs_app_function(context):
 
     #     return df.iloc[indices_to_keep]
 
-    def get_jobs_with_derived(jobs_df, user_info):
-        derived_data_questions = [('short_summary',
-                                   'Provide a short summary of the job.  If the job is fully remote, start with'
-                                   ' the sentence "Fully remote! ", otherwise skip this step.  Then, after a'
-                                   ' newline, include a single sentence related to the compensation.'
-                                   ' Start this sentence with the words "Pay for this role is "'
-                                   ' OR simply state "Pay was not specified. "'
-                                   ' Next have a newline, then a single'
-                                   ' sentence with the minimum number of years experience.  Include the type of'
-                                   ' experience being looked for. Next have a newline, followed by key job'
-                                   ' responsibilities (no more than 3 sentences).  Finally, have a newline and'
-                                   ' follow with job benefits (no more than 3 sentences)'
-                                   ),
-                                  ('hard_requirements',
-                                   'Summarize the hard requirements, things the candidate "must have" from the'
-                                   ' description.  Start the list with the number of years experience,'
-                                   ' if specified.  Limit this list to 4 bullet points of no more than 1 sentence'
-                                   ' each')
-                                  ]
+    derived_data_questions = [('short_summary',
+                               'Provide a short summary of the job.  If the job is fully remote, start with'
+                               ' the sentence "Fully remote! ", otherwise skip this step.  Then, after a'
+                               ' newline, include a single sentence related to the compensation.'
+                               ' Start this sentence with the words "Pay for this role is "'
+                               ' OR simply state "Pay was not specified. "'
+                               ' Next have a newline, then a single'
+                               ' sentence with the minimum number of years experience.  Include the type of'
+                               ' experience being looked for. Next have a newline, followed by key job'
+                               ' responsibilities (no more than 3 sentences).  Finally, have a newline and'
+                               ' follow with job benefits (no more than 3 sentences)'
+                               ),
+                              ('hard_requirements',
+                               'Summarize the hard requirements, things the candidate "must have" from the'
+                               ' description.  Start the list with the number of years experience,'
+                               ' if specified.  Limit this list to 4 bullet points of no more than 1 sentence'
+                               ' each')
+                              ]
 
+    def get_jobs_with_derived(jobs_df, user_info):
         rated_jobs = get_job_ratings(jobs_df, user_info)
+        if DERIVED_DATA_MODE != 'eager':
+            return rated_jobs
+
         todays_jobs = add_derived_data(rated_jobs, derived_data_questions, user_provided_info=user_info)
 
         return todays_jobs
@@ -253,8 +337,10 @@ def jobs_app_function(context):
         derived_data = pd.DataFrame(index=jobs_df.index)
 
         for index, row in jobs_df.iterrows():
+            description = compact_job_description(row.get('description', 'N/A'), keep_benefits=True,
+                                                  label=f"{row.get('title', 'N/A')} at {row.get('company', 'N/A')}")
             job_description = f"Title: {row.get('title', 'N/A')}\nCompany: {row.get('company', 'N/A')}\nLocation: {row.get('location', 'N/A')}\n" \
-                              f"Description: {row.get('description', 'N/A')}\n"
+                              f"Description: {description}\n"
 
             pay_info = (
                 f"Pays between {row.get('min_amount', 'N/A')} and {row.get('max_amount', 'N/A')} on a(n) {row.get('interval', 'N/A')}'"
@@ -277,6 +363,40 @@ def jobs_app_function(context):
         jobs_df_updated = pd.concat([derived_data, jobs_df], axis=1)
         return jobs_df_updated
 
+    def derived_data_for_job(job_id):
+        """Generate and save short_summary and hard_requirements for a stored job the first time it is viewed."""
+        supabase_url = os.environ.get('SUPABASE_URL', 'Specified environment variable SUPABASE_URL is not set.')
+        supabase_key = os.environ.get('SUPABASE_KEY', 'Specified environment variable SUPABASE_KEY is not set.')
+
+        opts = ClientOptions().replace(schema="jobscraper")
+        supabase: Client = create_client(supabase_url, supabase_key, options=opts)
+
+        job_rows = (supabase.table('jobs')
+                    .select('id, title, company, location, comp_min, comp_max, comp_interval, '
+                            'short_summary, hard_requirements, job_descriptions(description)')
+                    .eq('id', job_id)
+                    .execute())
+        if not job_rows.data:
+            return None
+
+        job = job_rows.data[0]
+        description = job.pop('job_descriptions', None)
+        if isinstance(description, list):
+            description = description[0] if description else None
+        job['description'] = (description or {}).get('description')
+        if job.get('short_summary') and job.get('hard_requirements'):
+            return {'short_summary': job['short_summary'], 'hard_requirements': job['hard_requirements']}
+
+        jobs_df = pd.DataFrame([{**job, 'min_amount': job.get('comp_min'), 'max_amount': job.get('comp_max'),
+                                 'interval': job.get('comp_interval')}])
+        derived_df = add_derived_data(jobs_df, derived_data_questions)
+        derived_data = {'short_summary': derived_df.iloc[0].get('short_summary'),
+                        'hard_requirements': derived_df.iloc[0].get('hard_requirements')}
+        if all(derived_data.values()):
+            supabase.table('jobs').update(derived_data).eq('id', job_id).execute()
+
+        return derived_data
+
     def build_context_for_llm(job_description, user_provided_info, question):
         full_message = ""
         if user_provided_info is not None:
@@ -286,6 +406,93 @@ def jobs_app_function(context):
         full_message += "Now for my question: " + question + " "
         return full_message
 
+    def salvage_job_ratings(content):
+        """Recover the usable rating fields from a response, kept in sync with salvage_job_ratings in llm.py."""
+        if not content:
+            return {}
+
+        candidates = {}
+        try:
+            parsed = json.loads(content)
+            if isinstance(parsed, dict):
+                candidates = parsed
+        except ValueError:
+            embedded = re.search(r'\{.*\}', content, re.DOTALL)
+            if embedded:
+                try:
+                    candidates = json.loads(embedded.group(0))
+                except ValueError:
+                    candidates = {}
+
+        for name, label in LEGACY_RATING_LABELS.items():
+            if name in candidates:
+                continue
+            if name == 'guidance':
+                match = re.search(r'"guidance"\s*:\s*"((?:[^"\\]|\\.)*)"', content) or \
+                        re.search(re.escape(label) + r':\s*(.+)', content, re.DOTALL)
+            else:
+                match = re.search(r'"' + name + r'"\s*:\s*"?(\d+(?:\.\d+)?)"?\s*[,}\n]', content) or \
+                        re.search(re.escape(label) + r':\s*(\d+(?:\.\d+)?)', content)
+            if match:
+                candidates[name] = match.group(1)
+                if name == 'guidance' and match.re.pattern.startswith('"guidance"'):
+                    try:
+                        candidates[name] = json.loads('"' + match.group(1) + '"')
+                    except ValueError:
+                        pass
+
+        salvaged = {}
+        for name in LEGACY_RATING_LABELS:
+            value = candidates.get(name)
+            if name == 'guidance':
+                if isinstance(value, str) and value.strip():
+                    salvaged[name] = value.strip()
+                continue
+            try:
+                score = int(round(float(value)))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= score <= 100:
+                salvaged[name] = score
+        return salvaged
+
+    def rate_job(job_title, job_description, user_info):
+        """Structured rating for one job, salvaging partial answers and asking again only for missing fields."""
+        prompt = consolidate_text(f"<user_info>{user_info}</user_info>\n" +
+                                  f"<job_title>{job_title}</job_title>\n" +
+                                  f"<job_description>{job_description}</job_description>\n" +
+                                  "Given the user provided information (user_info tag), job title (job_title tag) "
+                                  "and job description (job_description tag), " + RATING_INSTRUCTIONS)
+
+        ratings = {}
+        for attempt in range(2):
+            missing = [name for name in LEGACY_RATING_LABELS if name not in ratings]
+            properties = {name: {"type": "string" if name == 'guidance' else "integer"} for name in missing}
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "job_ratings",
+                    "strict": True,
+                    "schema": {"type": "object", "properties": properties, "required": missing,
+                               "additionalProperties": False}
+                }
+            }
+            message = prompt if attempt == 0 else prompt + f" Only answer these fields: {', '.join(missing)}."
+            content = query_llm(model_name=MODEL_FAST,
+                                system="You are a helpful no-nonsense assistant. You listen to directions carefully and follow them to the letter.",
+                                messages=[{"role": "user", "content": message}],
+                                response_format=response_format)
+            if content is None:
+                break
+
+            ratings.update({name: value for name, value in salvage_job_ratings(content).items() if name in missing})
+            if all(name in ratings for name in LEGACY_RATING_LABELS):
+                return ratings
+
+            logging.info(f"Rating response for {job_title} was missing fields, asking for those only")
+
+        return None
+
     def get_job_ratings(original_df, user_provided_info):
         jobs_df = original_df.copy()
         logging.info(f'Getting job ratings for {len(jobs_df)} jobs...')
@@ -295,111 +502,24 @@ def jobs_app_function(context):
         for index, row in jobs_df.iterrows():
             job_title = row.get('title', 'N/A')
             job_description = row.get('description', 'N/A')
-            job_description = consolidate_text(job_description)
-
-            full_message = f"<user_info>{user_info}</user_info>\n" + \
-                           f"<job_title>{job_title}</job_title>\n" + \
-                           f"<job_description>{job_description}</job_description>\n" + \
-                           """
-                           Given the user provided information (user_info tag), job title (job_title tag) and job description 
-                           (job_description tag), make the following ratings:
-                           
-                           1) How the candidate would rate this job on a scale from 1 to 100 in terms of how well it 
-                           matches their experience and the type of job they desire.
-                           2) How the candidate would rate this job on a scale from 1 to 100 as a match for their 
-                           experience level (they aren't underqualified or overqualified).
-                           3) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how 
-                           well the candidate meets the skill requirements for this job.
-                           4) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how 
-                           well the candidate meets the experience requirements for this job.
-                           5) Consider the results from steps 1 through 5 then give a final assessment from 1 to 100,
-                           where 1 is very little chance of this being a good match for the candidate and hiring manager, 
-                           and 100 being a perfect match where the candidate will have a great chance to succeed in 
-                           this role.
-                           
-                           For experience level, look for cues in the jobs description that list years of experience, 
-                           then compare that to the level of experience you believe the candidate to have (make an 
-                           assessment based on year in directly applicable fields of work).
-                           
-                           Start your answer immediately with a bulleted list as shown in the example below. Always include 
-                           the left side prefix from the template below in your answer (including for the explanation). 
-                           Address the candidate directly, closely following the template set in the example. NN should be 
-                           replaced in the template with a 2 digit number each time.
-                           """
-
-            full_message = consolidate_text(full_message)
-            full_message += \
-                """
-                - Candidate desire match: NN
-                - Candidate experience match: NN
-                - Hiring manager skill match: NN
-                - Hiring manager experience match: NN
-                - Final overall match assessment: NN
-                - Explanation of ratings: 
-                You may <like, be lukewarm on, or dislike> this job because of the following reasons: <reasons in one sentence>. The hiring manager may think you would be a <good, reasonable, or bad> fit for this job because of <reasons, in one sentence>. Overall, I think <your overall thoughts about the match between the user and the job in one sentence>.
-                """
-
-            ratings = query_llm(model_name=MODEL_FAST,
-                                system="You are a helpful no-nonsense assistant. You listen to directions carefully and follow them to the letter.",
-                                messages=[{"role": "user", "content": full_message}])
+            job_description = compact_job_description(job_description,
+                                                      label=f"{job_title} at {row.get('company', 'N/A')}")
+
+            ratings = rate_job(job_title, job_description, user_info)
 
             if ratings is None:
                 logging.info("LLM failed to generate ratings.")
                 continue
 
             logging.info(f"Ratings for job {index}: {ratings}")
-            guidance_split = ratings.split("Explanation of ratings:")
-            if len(guidance_split) == 2:
-                guidance = guidance_split[1].strip()
-            else:
-                guidance = ""
-
-            ratings = ratings.split("\n")
-
-            if len(ratings) >= 6:
-                desire_score_split = ratings[0].split(":")
-                if len(desire_score_split) == 2:
-                    desire_score = desire_score_split[1].strip()
-                    jobs_df.at[index, 'desire_score'] = desire_score
-                else:
-                    logging.error("Error: Unable to split desire score.")
-
-                experience_score_split = ratings[1].split(":")
-                if len(experience_score_split) == 2:
-                    experience_score = experience_score_split[1].strip()
-                    jobs_df.at[index, 'experience_score'] = experience_score
-                else:
-                    logging.error("Error: Unable to split experience score.")
-
-                meets_requirements_score_split = ratings[2].split(":")
-                if len(meets_requirements_score_split) == 2:
-                    meets_requirements_score = meets_requirements_score_split[1].strip()
-                    jobs_df.at[index, 'meets_requirements_score'] = meets_requirements_score
-                else:
-                    logging.error("Error: Unable to split meets requirements score.")
-
-                meets_experience_score_split = ratings[3].split(":")
-                if len(meets_experience_score_split) == 2:
-                    meets_experience_score = meets_experience_score_split[1].strip()
-                    jobs_df.at[index, 'meets_experience_score'] = meets_experience_score
-                else:
-                    logging.error("Error: Unable to split meets experience score.")
-
-                overall_job_score_split = ratings[4].split(":")
-                if len(overall_job_score_split) == 2:
-                    overall_job_score = overall_job_score_split[1].strip()
-                    logging.info(
-                        f"{index}: Adding a rating to: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}: {overall_job_score}")
-                    jobs_df.at[index, 'job_score'] = overall_job_score
-                else:
-                    logging.error("Error: Unable to split overall job score.")
-
-                if len(guidance) > 0:
-                    logging.info(
-                        f"{index}: Adding guidance to: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}: {guidance}")
-                    jobs_df.at[index, 'guidance'] = guidance
-            else:
-                logging.error("Error: Ratings list does not have enough elements.")
+            jobs_df.at[index, 'desire_score'] = ratings['desire_score']
+            jobs_df.at[index, 'experience_score'] = ratings['experience_score']
+            jobs_df.at[index, 'meets_requirements_score'] = ratings['meets_requirements_score']
+            jobs_df.at[index, 'meets_experience_score'] = ratings['meets_experience_score']
+            logging.info(
+                f"{index}: Adding a rating to: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}: {ratings['overall_score']}")
+            jobs_df.at[index, 'job_score'] = ratings['overall_score']
+            jobs_df.at[index, 'guidance'] = ratings['guidance']
 
         jobs_over_50 = jobs_df[jobs_df['job_score'].astype(float) > 50]
 
@@ -411,6 +531,107 @@ def jobs_app_function(context):
         consolidated = re.sub(' +', ' ', consolidated)
         return consolidated
 
+    def estimate_tokens(text):
+        return len(text) // 4 + 1 if text else 0
+
+    def compact_description(description, token_budget=DESCRIPTION_TOKEN_BUDGET, keep_benefits=False):
+        """
+        Drops boilerplate sections and repeated paragraphs from a description and caps it at token_budget,
+        keeping requirement and responsibility sections first. Returns (compacted_text, tokens_saved).
+        """
+        if not description:
+            return description, 0
+
+        skipped_headings = BOILERPLATE_HEADINGS if keep_benefits else BOILERPLATE_HEADINGS + BENEFITS_HEADINGS
+
+        def is_heading(line):
+            stripped = line.strip().strip('*#_ ').strip()
+            if not stripped or len(stripped) > 80:
+                return False
+            return (line.strip().startswith(('#', '**')) or stripped.endswith(':') or
+                    (stripped.isupper() and len(stripped.split()) <= 8))
+
+        def matches_any(text, phrases):
+            return any(phrase in text.lower() for phrase in phrases)
+
+        def drop_boilerplate(lines):
+            kept_lines = []
+            for line in lines:
+                sentences = [s for s in re.split(r'(?<=[.!?])\s+', line) if not matches_any(s, BOILERPLATE_PHRASES)]
+                if sentences:
+                    kept_lines.append(' '.join(sentences))
+            return kept_lines
+
+        # Paragraphs are kept as their lines, so boilerplate is dropped per line rather than per paragraph
+        sections = [('', [])]
+        paragraph = []
+        for line in description.replace('\r', '\n').split('\n'):
+            if is_heading(line):
+                if paragraph:
+                    sections[-1][1].append(paragraph)
+                    paragraph = []
+                sections.append((line.strip(), []))
+            elif line.strip():
+                paragraph.append(line.strip())
+            elif paragraph:
+                sections[-1][1].append(paragraph)
+                paragraph = []
+        if paragraph:
+            sections[-1][1].append(paragraph)
+
+        seen = set()
+        blocks = []
+        for heading, paragraphs in sections:
+            keys = [re.sub(r'[\W_]+', ' ', ' '.join(lines).lower()).strip() for lines in paragraphs]
+            if heading and matches_any(heading, skipped_headings) and not matches_any(heading, PRIORITY_HEADINGS):
+                seen.update(keys)
+                continue
+
+            priority = bool(heading) and matches_any(heading, PRIORITY_HEADINGS)
+            kept = []
+            for key, lines in zip(keys, paragraphs):
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                if not priority:
+                    lines = drop_boilerplate(lines)
+                if lines:
+                    kept.append(' '.join(lines))
+
+            if kept:
+                text = consolidate_text(' '.join(([heading.strip('*#_ ')] if heading else []) + kept))
+                blocks.append((len(blocks), priority, text))
+
+        selected = []
+        remaining_chars = token_budget * 4
+        for order, priority, text in sorted(blocks, key=lambda block: (not block[1], block[0])):
+            if remaining_chars <= 0:
+                break
+            text = text[:remaining_chars].rsplit(' ', 1)[0] if len(text) > remaining_chars else text
+            selected.append((order, text))
+            remaining_chars -= len(text)
+
+        compacted = ' '.join(text for order, text in sorted(selected)).strip()
+        if not compacted:
+            compacted = consolidate_text(description)[:token_budget * 4]
+
+        return compacted, max(0, estimate_tokens(description) - estimate_tokens(compacted))
+
+    def compact_job_description(description, label='', keep_benefits=False):
+        compacted, tokens_saved = compact_description(description, keep_benefits=keep_benefits)
+        if tokens_saved > 0:
+            logging.info(f"Compacted description{' for ' + label if label else ''}: saved ~{tokens_saved} tokens")
+        return compacted
+
+    def canonical_url(url):
+        """The URL with a lowercase scheme and host, no fragment, no tracking parameters and no trailing slash."""
+        if not url or not isinstance(url, str):
+            return url
+        parts = urlsplit(url.strip())
+        query = '&'.join(parameter for parameter in parts.query.split('&')
+                         if parameter and not parameter.split('=', 1)[0].lower().startswith(TRACKING_PARAMS))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
     def save_jobs_to_supabase(user_id, df):
         logging.info(f"Saving {len(df)} jobs to Supabase...")
 
@@ -430,7 +651,7 @@ def jobs_app_function(context):
             if job_score < 50:
                 continue
 
-            job_exists = supabase.table('jobs').select('id').eq('url', row.get('job_url', '')).execute()
+            job_exists = supabase.table('jobs').select('id').eq('url', canonical_url(row.get('job_url', ''))).execute()
             if not job_exists.data:
                 logging.info(f"Job with URL {row.get('job_url', 'N/A')} does not exist, creating new job...")
                 result = create_new_job(supabase, row)
@@ -444,7 +665,7 @@ def jobs_app_function(context):
             user_has_recommendation = (supabase.table('recent_high_score_jobs')
                                        .select('id')
                                        .eq('user_id', user_id)
-                                       .eq('url', row.get('job_url', ''))
+                                       .eq('url', canonical_url(row.get('job_url', '')))
                                        .execute())
 
             if user_has_recommendation.data:
@@ -460,7 +681,7 @@ def jobs_app_function(context):
             'short_summary': row.get('short_summary'),
             'hard_requirements': row.get('hard_requirements'),
             'job_site': row.get('site'),
-            'url': row.get('job_url'),
+            'url': canonical_url(row.get('job_url')),
             'location': None if pd.isna(row.get('location')) else row.get('location'),
             'date_posted': convert_to_date(row.get('date_posted')),
             'comp_interval': None if pd.isna(row.get('interval')) else row.get('interval'),
@@ -468,7 +689,6 @@ def jobs_app_function(context):
             'comp_max': convert_to_int(row.get('max_amount')),
             'comp_currency': None if pd.isna(row.get('currency')) else row.get('currency'),
             'emails': None if pd.isna(row.get('emails')) else row.get('emails'),
-            'description': row.get('description'),
             'date_pulled': datetime.now().isoformat(),
             'searched_title': row.get('searched_title')
         }
@@ -477,6 +697,8 @@ def jobs_app_function(context):
             result = supabase.table('jobs').insert(new_job).execute()
             if result.data:
                 print(f"Inserted job!")  # {result.data}")
+                supabase.table('job_descriptions').insert({'job_id': result.data[0]['id'],
+                                                           'description': row.get('description')}).execute()
             else:
                 print(f"Error inserting job: {result.error}")
         except Exception as e:
@@ -490,11 +712,11 @@ def jobs_app_function(context):
         users_jobs_row = {
             'user_id': user_id,
             'job_id': job_id,
-            'desire_score': row.get('desire_score'),
-            'experience_score': row.get('experience_score'),
-            'meets_requirements_score': row.get('meets_requirements_score'),
-            'meets_experience_score': row.get('meets_experience_score'),
-            'score': row.get('job_score'),
+            'desire_score': convert_to_int(row.get('desire_score')),
+            'experience_score': convert_to_int(row.get('experience_score')),
+            'meets_requirements_score': convert_to_int(row.get('meets_requirements_score')),
+            'meets_experience_score': convert_to_int(row.get('meets_experience_score')),
+            'score': convert_to_int(row.get('job_score')),
             'guidance': row.get('guidance')
         }
         try:
@@ -530,6 +752,13 @@ def jobs_app_function(context):
 
     data = context.get_json()
 
+    # The frontend asks for a job's summary and hard requirements the first time it shows the job
+    if data.get('job_id'):
+        derived_data = derived_data_for_job(data.get('job_id'))
+        if derived_data is None:
+            return Response(response="Job not found", status=404)
+        return Response(response=json.dumps(derived_data), status=200, mimetype='application/json')
+
     user_provided_info = data.get('resume')
     user_id = data.get('user_id')
 
@@ -555,19 +784,21 @@ def jobs_app_function(context):
     if len(cleaned_jobs) == 0:
         return Response(response="No jobs found after cleaning and deduplicating", status=200)
 
-    # Just keep the top 10 jobs
-    cleaned_jobs_subset = cleaned_jobs.head(10)
-    # have a second df for the second 10 jobs
-    cleaned_jobs_second = cleaned_jobs[~cleaned_jobs['job_url'].isin(cleaned_jobs_subset['job_url'])].head(10)
+    # Evaluate a chunk at a time, stopping once there are enough jobs over 70 or the budget is used
+    good_jobs = 0
+    evaluated = 0
+    while evaluated < min(len(cleaned_jobs), EARLY_STOP_MAX_EVALUATIONS):
+        if good_jobs >= EARLY_STOP_TARGET_JOBS:
+            logging.info(f"Found {good_jobs} jobs over 70, stopping early")
+            break
 
-    jobs_with_derived = get_jobs_with_derived(cleaned_jobs_subset, user_provided_info)
-    save_jobs_to_supabase(user_id, jobs_with_derived)
+        chunk = cleaned_jobs.iloc[evaluated:min(evaluated + EARLY_STOP_CHUNK_JOBS, EARLY_STOP_MAX_EVALUATIONS)]
+        evaluated += len(chunk)
+        jobs_with_derived = get_jobs_with_derived(chunk, user_provided_info)
+        save_jobs_to_supabase(user_id, jobs_with_derived)
+        good_jobs += len(jobs_with_derived[jobs_with_derived['job_score'].astype(float) > 70])
 
-    # If jobs_with_derived doesn't have a job over 70, get the next 10 jobs
-    if len(jobs_with_derived[jobs_with_derived['job_score'].astype(float) > 70]) == 0:
-        logging.info("No jobs over 70 found, getting the next 10 jobs...")
-        jobs_with_derived_second = get_jobs_with_derived(cleaned_jobs_second, user_provided_info)
-        save_jobs_to_supabase(user_id, jobs_with_derived_second)
+    logging.info(f"Evaluated {evaluated} of {len(cleaned_jobs)} jobs, {good_jobs} over 70")
 
     return Response(response="Jobs pulled, cleaned, and saved to Supabase", status=200)
 
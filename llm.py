@@ -1,41 +1,37 @@
-import time
-
-from typing import List
-from models import JobAssessment
-from llm_config import get_openrouter_client, MODEL_FAST, MODEL_STRUCTURED
+import json
+import re
+from typing import List, Optional
+
+from compact_evaluation import create_compact_evaluation_prompt, compact_evaluation_response_format, \
+    decode_compact_assessment
+from llm_client import create_completion
+from llm_metering import BudgetExceeded
+from helpers import count_tokens
+from text_compaction import compact_job_description
+from models import JobAssessment, JobRatings, JobRatingsForUsers
+from llm_config import MODEL_FAST, MODEL_STRUCTURED, EVAL_BATCH_TOKEN_BUDGET, \
+    EVAL_BATCH_MAX_JOBS, EVAL_OUTPUT_TOKENS_PER_JOB, EVAL_COMPACT_OUTPUT, EVAL_OUTPUT_TOKENS_PER_USER
 
 system_message = ("You are a helpful assistant, highly skilled in ruthlessly distilling down information from job "
                   "descriptions, and answering questions about job descriptions in a concise and targeted manner.")
 
 
 def query_llm(model_name, system, messages=[], **kwargs):
-    max_retries = 3
-    wait_time = 3
-
     # Build messages list without mutating the caller's list
     messages_with_system = [{"role": "system", "content": system}] + messages
 
-    for attempt in range(max_retries):
-        try:
-            client = get_openrouter_client()
-            completion = client.chat.completions.create(
-                messages=messages_with_system,
-                max_tokens=256,
-                model=model_name,
-                temperature=1.0
-            )
-            return completion.choices[0].message.content
-
-        except Exception as e:
-            print(
-                f"An unexpected error occurred: {e}. Attempt {attempt + 1} of {max_retries}. Retrying in {wait_time} seconds...")
-            time.sleep(wait_time)
-            wait_time *= 2  # Exponential backoff
-            if attempt == max_retries - 1:
-                print(f"Failed after {max_retries} attempts.")
-                return None
+    try:
+        completion = create_completion({
+            "messages": messages_with_system,
+            "max_tokens": 256,
+            "model": model_name,
+            "temperature": 1.0
+        })
+        return completion.choices[0].message.content
 
-    return None
+    except Exception as e:
+        print(f"Failed to get a response from {model_name}: {e}")
+        return None
 
 
 def build_context_for_llm(job_description, resume, question):
@@ -45,47 +41,42 @@ def build_context_for_llm(job_description, resume, question):
         full_message += "Here is the candidate's resume, below\n"
         full_message += resume + "\n\n"
     if job_description:
+        job_description = compact_job_description(job_description, keep_benefits=True)
         full_message += ("Here is some information about a job.  I'll mark the job start and end with 3 equals signs ("
                          "===) \n===\n") + job_description + "\n===\n"
     full_message += "Now for my question: \n" + question
     return full_message
 
 
-def ask_chatgpt_about_job(question, job_description, resume=None):
-    client = get_openrouter_client()
-
+def build_derived_data_request(question, job_description, resume=None) -> dict:
     full_message = build_context_for_llm(job_description, resume, question)
+    return {
+        "model": MODEL_FAST,
+        "messages": [
+            {"role": "system", "content": system_message + "\nOnly return text, not markdown or HTML."},
+            {"role": "user", "content": full_message}
+        ]
+    }
 
-    max_retries = 5
-    wait_time = 5
-
-    for attempt in range(max_retries):
-        try:
-            completion = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_message + "\nOnly return text, not markdown or HTML."},
-                    {"role": "user", "content": full_message}
-                ],
-                model=MODEL_FAST,
-            )
 
-            return completion.choices[0].message.content
+def ask_chatgpt_about_job(question, job_description, resume=None):
+    request = build_derived_data_request(question, job_description, resume)
 
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            time.sleep(wait_time)
-            wait_time *= 2
+    try:
+        completion = create_completion(request)
+        return completion.choices[0].message.content
 
-    print("Failed to get a response after multiple retries.")
-    return None
+    except Exception as e:
+        print(f"Failed to get a response: {e}")
+        return None
 
 
-def create_evaluation_prompt(job_title: str, job_description: str, resume: str,
-                             job_titles: List[str], skill_words: List[str],
-                             stop_words: List[str]) -> str:
-    questions = {
+def create_evaluation_questions(job_titles: List[str], skill_words: List[str], stop_words: List[str],
+                                job_title: str = None) -> dict:
+    title_question = f"Is the job title '{job_title}'" if job_title else "Is the job title"
+    return {
         # Desire assessment questions
-        "title_matches_preferred": f"Is the job title '{job_title}' similar to any of these preferred titles: {', '.join(job_titles)}?",
+        "title_matches_preferred": f"{title_question} similar to any of these preferred titles: {', '.join(job_titles)}?",
         "has_desired_skills": f"Does the job description prominently mention multiple of these desired skills: {', '.join(skill_words)}?",
         "free_from_stop_words": f"Is the job description free from these unwanted terms: {', '.join(stop_words)}?",
         "logical_career_step": "Based on the resume, does this job represent a logical next step in the candidate's career progression?",
@@ -109,6 +100,33 @@ def create_evaluation_prompt(job_title: str, job_description: str, resume: str,
         "has_similar_environment": "Does the candidate's work history demonstrate success in similar company environments?"
     }
 
+
+GUIDANCE_INSTRUCTIONS = """Also provide guidance text for the candidate with these components:
+       1. desire_reason: A single sentence explaining why they would like or dislike this job based on their preferences
+       2. requirements_reason: A single sentence explaining why they would be a good or poor fit based on requirements
+       3. guidance_text: A complete guidance message following this EXACT format:
+          'You may <like, be lukewarm on, or dislike> this job because of the following reasons: <desire_reason>. The hiring manager may think you would be a <good, reasonable, or bad> fit for this job because of <requirements_reason>. Overall, I think <synthesis of the match assessment>.'"""
+
+EVALUATION_SYSTEM_MESSAGE = """You are a job evaluation assistant.
+                    Analyze jobs and resumes carefully, providing YES/NO answers to each question.
+                    Be decisive and clear in your assessments."""
+
+
+def format_known_answers(known_answers: dict) -> str:
+    if not known_answers:
+        return ""
+    return "Already determined (use these when writing the guidance): " + \
+        ", ".join(f"{name}: {'YES' if answer else 'NO'}" for name, answer in known_answers.items())
+
+
+def create_evaluation_prompt(job_title: str, job_description: str, resume: str,
+                             job_titles: List[str], skill_words: List[str],
+                             stop_words: List[str], known_answers: dict = None) -> str:
+    known_answers = known_answers or {}
+    questions = {name: question for name, question in
+                 create_evaluation_questions(job_titles, skill_words, stop_words, job_title=job_title).items()
+                 if name not in known_answers}
+
     prompt = f"""Evaluate this job opportunity for the candidate by answering YES or NO to each question.
        Be direct and definitive in your assessment.
 
@@ -123,11 +141,9 @@ def create_evaluation_prompt(job_title: str, job_description: str, resume: str,
 
        {chr(10).join(f"{key}: {question}" for key, question in questions.items())}
 
-       Also provide guidance text for the candidate with these components:
-       1. desire_reason: A single sentence explaining why they would like or dislike this job based on their preferences
-       2. requirements_reason: A single sentence explaining why they would be a good or poor fit based on requirements
-       3. guidance_text: A complete guidance message following this EXACT format:
-          'You may <like, be lukewarm on, or dislike> this job because of the following reasons: <desire_reason>. The hiring manager may think you would be a <good, reasonable, or bad> fit for this job because of <requirements_reason>. Overall, I think <synthesis of the match assessment>.'
+       {format_known_answers(known_answers)}
+
+       {GUIDANCE_INSTRUCTIONS}
 
        Answer with structured output matching EXACTLY the expected format.
        Each assessment answer must be YES or NO only.
@@ -137,117 +153,589 @@ def create_evaluation_prompt(job_title: str, job_description: str, resume: str,
     return prompt
 
 
+def common_known_fields(jobs: List[dict]) -> List[str]:
+    """Fields answered locally for every job in a batch, which the batch schema can leave out."""
+    if not jobs:
+        return []
+    return [name for name in (jobs[0].get('known_answers') or {})
+            if all(name in (job.get('known_answers') or {}) for job in jobs)]
+
+
+def create_batch_evaluation_prompt(jobs: List[dict], resume: str, job_titles: List[str],
+                                   skill_words: List[str], stop_words: List[str]) -> str:
+    skipped = common_known_fields(jobs)
+    questions = {name: question for name, question in
+                 create_evaluation_questions(job_titles, skill_words, stop_words).items() if name not in skipped}
+    job_blocks = "\n".join(
+        f"=== job_id: {job['job_id']} ===\nTitle: {job['title']}\nDescription: {job['description']}\n"
+        f"{format_known_answers(job.get('known_answers'))}\n"
+        for job in jobs
+    )
+
+    prompt = f"""Evaluate each of the job opportunities below for the candidate by answering YES or NO to each
+       question for every job. Be direct and definitive, and assess each job independently of the others.
+
+       Candidate Information:
+       Resume: {resume}
+
+       Jobs (each job starts with a line containing its job_id):
+{job_blocks}
+       For every job, answer each of the following questions with YES or NO, and then provide guidance text:
+
+       {chr(10).join(f"{key}: {question}" for key, question in questions.items())}
+
+       {GUIDANCE_INSTRUCTIONS}
+
+       Return exactly one entry per job in the "assessments" array, with job_id copied exactly as given.
+       Each assessment answer must be YES or NO only.
+       Guidance fields must be complete sentences.
+       """
+
+    return prompt
+
+
+def job_assessment_schema_properties(skip_fields=()) -> dict:
+    return {name: {"type": "boolean" if field.annotation is bool else "string"}
+            for name, field in JobAssessment.model_fields.items() if name not in skip_fields}
+
+
+def build_json_schema_format(name: str, properties: dict) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties.keys()),
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def strict_json_schema(schema: dict) -> dict:
+    """Inline $defs and mark every object strict, as structured outputs require."""
+    definitions = schema.get('$defs', {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if '$ref' in node:
+                return resolve(definitions[node['$ref'].split('/')[-1]])
+            resolved = {key: resolve(value) for key, value in node.items() if key not in ('$defs', 'title')}
+            if resolved.get('type') == 'object':
+                resolved['required'] = list(resolved.get('properties', {}).keys())
+                resolved['additionalProperties'] = False
+            return resolved
+        if isinstance(node, list):
+            return [resolve(item) for item in node]
+        return node
+
+    return resolve(schema)
+
+
+def build_model_schema_format(name: str, model) -> dict:
+    """Structured output format for a Pydantic model, including nested models."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": strict_json_schema(model.model_json_schema())}
+    }
+
+
+class EvaluationFailed(Exception):
+    """A job could not be evaluated, so it has no assessment. It must not be scored as if the model said no."""
+
+
+def build_evaluation_request(job_title: str, job_description: str, resume: str,
+                             job_titles: List[str], skill_words: List[str],
+                             stop_words: List[str], compact: bool = EVAL_COMPACT_OUTPUT,
+                             known_answers: dict = None) -> dict:
+    """Questions already answered locally (known_answers) are left out of the prompt and the schema."""
+    known_answers = known_answers or {}
+    if compact:
+        questions = create_evaluation_questions(job_titles, skill_words, stop_words, job_title=job_title)
+        return {
+            "model": MODEL_STRUCTURED,
+            "messages": [
+                {"role": "system", "content": EVALUATION_SYSTEM_MESSAGE},
+                {"role": "user", "content": create_compact_evaluation_prompt(job_title, job_description, resume,
+                                                                             questions, known_answers)}
+            ],
+            "response_format": compact_evaluation_response_format()
+        }
+
+    prompt = create_evaluation_prompt(
+        job_title=job_title,
+        job_description=job_description,
+        resume=resume,
+        job_titles=job_titles,
+        skill_words=skill_words,
+        stop_words=stop_words,
+        known_answers=known_answers
+    )
+
+    return {
+        "model": MODEL_STRUCTURED,
+        "messages": [
+            {"role": "system", "content": EVALUATION_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": build_json_schema_format("job_assessment", job_assessment_schema_properties(known_answers))
+    }
+
+
+def parse_evaluation_response(response_json: str, compact: bool = EVAL_COMPACT_OUTPUT,
+                              known_answers: dict = None) -> JobAssessment:
+    """Parse a single-job evaluation response in either format, merging in the locally known answers."""
+    if compact:
+        return decode_compact_assessment(response_json, known_answers)
+    answers = json.loads(response_json)
+    if not isinstance(answers, dict):
+        raise ValueError("Evaluation response is not a JSON object")
+    return JobAssessment(**{**answers, **(known_answers or {})})
+
+
 def evaluate_job_match(job_title: str, job_description: str, resume: str,
                        job_titles: list[str], skill_words: list[str],
-                       stop_words: list[str]) -> JobAssessment:
+                       stop_words: list[str], known_answers: dict = None) -> JobAssessment:
     """
-    Evaluates job match using structured outputs via OpenRouter.
-    Returns a JobAssessment object with yes/no answers.
+    Evaluates job match using structured outputs via OpenRouter. Questions in known_answers were answered
+    locally and are only asked about what remains.
+    Returns a JobAssessment object with yes/no answers, raises EvaluationFailed when there isn't one.
     """
 
+    request = build_evaluation_request(job_title, job_description, resume, job_titles, skill_words, stop_words,
+                                       known_answers=known_answers)
+
+    # Transport errors are retried by create_completion, a response that doesn't parse is asked for once more
+    for attempt in range(2):
+        try:
+            completion = create_completion(request)
+
+            # Parse the JSON response into our Pydantic model
+            response_json = completion.choices[0].message.content
+            return parse_evaluation_response(response_json, known_answers=known_answers)
+
+        except ValueError as e:
+            print(f"Unparseable job evaluation for {job_title}, attempt {attempt + 1} of 2: {str(e)}")
+
+        except BudgetExceeded:
+            # Not a failed evaluation, the job wasn't evaluated at all
+            raise
+
+        except Exception as e:
+            print(f"Error evaluating job match for {job_title}: {str(e)}")
+            break
+
+    raise EvaluationFailed(f"Unable to evaluate {job_title}")
+
+
+def estimate_job_tokens(job: dict) -> int:
+    return count_tokens(job['title']) + count_tokens(job['description']) + EVAL_OUTPUT_TOKENS_PER_JOB
+
+
+def plan_evaluation_batches(items: List[dict], fixed_tokens: int,
+                            token_budget: int = EVAL_BATCH_TOKEN_BUDGET,
+                            max_jobs: int = EVAL_BATCH_MAX_JOBS,
+                            item_tokens=estimate_job_tokens) -> List[List[dict]]:
+    """Greedily pack items into batches that fit the token budget (prompt plus expected output)."""
+    batches = []
+    current = []
+    current_tokens = fixed_tokens
+
+    for item in items:
+        tokens = item_tokens(item)
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_jobs):
+            batches.append(current)
+            current = []
+            current_tokens = fixed_tokens
+        current.append(item)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def build_batch_evaluation_request(jobs: List[dict], resume: str, job_titles: List[str],
+                                   skill_words: List[str], stop_words: List[str]) -> dict:
+    prompt = create_batch_evaluation_prompt(jobs, resume, job_titles, skill_words, stop_words)
+    item_properties = {"job_id": {"type": "string"},
+                       **job_assessment_schema_properties(common_known_fields(jobs))}
+    properties = {
+        "assessments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": item_properties,
+                "required": list(item_properties.keys()),
+                "additionalProperties": False
+            }
+        }
+    }
+
+    return {
+        "model": MODEL_STRUCTURED,
+        "messages": [
+            {"role": "system", "content": EVALUATION_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": build_json_schema_format("job_assessment_batch", properties)
+    }
+
+
+def parse_batch_evaluation(response_json: str, jobs: List[dict]) -> dict:
+    """
+    Parse a batch response, merging each job's locally known answers over the model's. Raises ValueError (which
+    JSONDecodeError and pydantic's ValidationError are) when the response doesn't parse.
+    """
+    batch = json.loads(response_json or '')
+    if not isinstance(batch, dict) or not isinstance(batch.get('assessments'), list) or \
+            not all(isinstance(item, dict) for item in batch['assessments']):
+        raise ValueError("Batch evaluation response doesn't have a list of assessments")
+    known_by_job = {job['job_id']: job.get('known_answers') or {} for job in jobs}
+    return {item['job_id']: JobAssessment(**{**{name: value for name, value in item.items() if name != 'job_id'},
+                                             **known_by_job[item['job_id']]})
+            for item in batch['assessments'] if item.get('job_id') in known_by_job}
+
+
+def request_batch_evaluation(jobs: List[dict], resume: str, job_titles: List[str],
+                             skill_words: List[str], stop_words: List[str]) -> dict:
+    """Send one structured request for several jobs. Raises if the response can't be parsed."""
+    request = build_batch_evaluation_request(jobs, resume, job_titles, skill_words, stop_words)
+    completion = create_completion(request)
+
+    return parse_batch_evaluation(completion.choices[0].message.content, jobs)
+
+
+def evaluate_job_batch(jobs: List[dict], resume: str, job_titles: List[str],
+                       skill_words: List[str], stop_words: List[str]) -> dict:
+    """
+    Evaluates a batch of jobs, splitting the batch in half and retrying when the response fails to parse.
+    Jobs the model left out of an otherwise good response are retried on their own, and a job that can't be
+    evaluated on its own maps to None. Any other error (auth, transport after its retries) fails the whole batch
+    without splitting it, and BudgetExceeded is raised.
+    """
+    if len(jobs) == 1:
+        job = jobs[0]
+        try:
+            return {job['job_id']: evaluate_job_match(job['title'], job['description'], resume, job_titles,
+                                                      skill_words, stop_words, job.get('known_answers'))}
+        except EvaluationFailed as e:
+            print(str(e))
+            return {job['job_id']: None}
+
     try:
-        client = get_openrouter_client()
-
-        prompt = create_evaluation_prompt(
-            job_title=job_title,
-            job_description=job_description,
-            resume=resume,
-            job_titles=job_titles,
-            skill_words=skill_words,
-            stop_words=stop_words
-        )
-
-        completion = client.chat.completions.create(
-            model=MODEL_STRUCTURED,
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You are a job evaluation assistant.
-                    Analyze jobs and resumes carefully, providing YES/NO answers to each question.
-                    Be decisive and clear in your assessments."""
-                },
-                {"role": "user", "content": prompt}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "job_assessment",
-                    "strict": True,
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "title_matches_preferred": {"type": "boolean"},
-                            "has_desired_skills": {"type": "boolean"},
-                            "free_from_stop_words": {"type": "boolean"},
-                            "logical_career_step": {"type": "boolean"},
-                            "within_experience_range": {"type": "boolean"},
-                            "seniority_matches": {"type": "boolean"},
-                            "responsibilities_align": {"type": "boolean"},
-                            "level_appropriate": {"type": "boolean"},
-                            "has_required_technical_skills": {"type": "boolean"},
-                            "has_required_domain_skills": {"type": "boolean"},
-                            "meets_education_requirements": {"type": "boolean"},
-                            "has_industry_experience": {"type": "boolean"},
-                            "meets_years_required": {"type": "boolean"},
-                            "has_similar_role_history": {"type": "boolean"},
-                            "shows_skill_growth": {"type": "boolean"},
-                            "has_similar_environment": {"type": "boolean"},
-                            "desire_reason": {"type": "string"},
-                            "requirements_reason": {"type": "string"},
-                            "guidance_text": {"type": "string"}
-                        },
-                        "required": [
-                            "title_matches_preferred",
-                            "has_desired_skills",
-                            "free_from_stop_words",
-                            "logical_career_step",
-                            "within_experience_range",
-                            "seniority_matches",
-                            "responsibilities_align",
-                            "level_appropriate",
-                            "has_required_technical_skills",
-                            "has_required_domain_skills",
-                            "meets_education_requirements",
-                            "has_industry_experience",
-                            "meets_years_required",
-                            "has_similar_role_history",
-                            "shows_skill_growth",
-                            "has_similar_environment",
-                            "desire_reason",
-                            "requirements_reason",
-                            "guidance_text"
-                        ],
-                        "additionalProperties": False
-                    }
-                }
+        assessments = request_batch_evaluation(jobs, resume, job_titles, skill_words, stop_words)
+    except BudgetExceeded:
+        raise
+    except ValueError as e:
+        print(f"Unparseable evaluation of a batch of {len(jobs)} jobs: {str(e)}")
+        assessments = {}
+    except Exception as e:
+        print(f"Error evaluating batch of {len(jobs)} jobs, leaving them unevaluated: {str(e)}")
+        return {job['job_id']: None for job in jobs}
+
+    missing = [job for job in jobs if job['job_id'] not in assessments]
+    if len(missing) == len(jobs):
+        print(f"Splitting batch of {len(jobs)} jobs in half and retrying...")
+        middle = len(jobs) // 2
+        assessments.update(evaluate_job_batch(jobs[:middle], resume, job_titles, skill_words, stop_words))
+        assessments.update(evaluate_job_batch(jobs[middle:], resume, job_titles, skill_words, stop_words))
+    elif missing:
+        print(f"Batch response was missing {len(missing)} of {len(jobs)} jobs, retrying those...")
+        assessments.update(evaluate_job_batch(missing, resume, job_titles, skill_words, stop_words))
+
+    return assessments
+
+
+def evaluate_jobs_batch(jobs: List[dict], resume: str, job_titles: List[str],
+                        skill_words: List[str], stop_words: List[str]) -> dict:
+    """
+    Evaluates several jobs for one candidate, sending the resume once per batch instead of once per job.
+    `jobs` is a list of dicts with job_id, title and description keys.
+    Returns a dict of job_id -> JobAssessment.
+    """
+    fixed_tokens = count_tokens(create_batch_evaluation_prompt([], resume, job_titles, skill_words, stop_words))
+    batches = plan_evaluation_batches(jobs, fixed_tokens)
+    print(f"Evaluating {len(jobs)} jobs in {len(batches)} batches")
+
+    assessments = {}
+    for batch in batches:
+        assessments.update(evaluate_job_batch(batch, resume, job_titles, skill_words, stop_words))
+
+    return assessments
+
+
+RATING_INSTRUCTIONS = """make the following ratings:
+
+       1) How the candidate would rate this job on a scale from 1 to 100 in terms of how well it
+       matches their experience and the type of job they desire (desire_score).
+       2) How the candidate would rate this job on a scale from 1 to 100 as a match for their
+       experience level, they aren't underqualified or overqualified (experience_score).
+       3) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how
+       well the candidate meets the skill requirements for this job (meets_requirements_score).
+       4) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how
+       well the candidate meets the experience requirements for this job (meets_experience_score).
+       5) Consider the results from steps 1 through 4 then give a final assessment from 1 to 100,
+       where 1 is very little chance of this being a good match for the candidate and hiring manager,
+       and 100 being a perfect match where the candidate will have a great chance to succeed in
+       this role (overall_score).
+
+       For experience level, look for cues in the jobs description that list years of experience,
+       then compare that to the level of experience you believe the candidate to have (make an
+       assessment based on year in directly applicable fields of work).
+
+       Address the candidate directly in the guidance, closely following this template:
+       You may <like, be lukewarm on, or dislike> this job because of the following reasons: <reasons in one sentence>. The hiring manager may think you would be a <good, reasonable, or bad> fit for this job because of <reasons, in one sentence>. Overall, I think <your overall thoughts about the match between the user and the job in one sentence>."""
+
+RATINGS_SYSTEM_MESSAGE = ("You are a helpful no-nonsense assistant. You listen to directions carefully and follow "
+                          "them to the letter.")
+
+
+def job_ratings_schema_properties() -> dict:
+    return {name: {"type": "integer" if field.annotation is int else "string"}
+            for name, field in JobRatings.model_fields.items()}
+
+
+# Labels from the old free-text template, so replies in that format can still be salvaged
+LEGACY_RATING_LABELS = {
+    'desire_score': 'Candidate desire match',
+    'experience_score': 'Candidate experience match',
+    'meets_requirements_score': 'Hiring manager skill match',
+    'meets_experience_score': 'Hiring manager experience match',
+    'overall_score': 'Final overall match assessment',
+    'guidance': 'Explanation of ratings'
+}
+
+
+def valid_rating_value(name: str, value):
+    """Coerce a salvaged value to the field's type, or return None if it isn't usable."""
+    if name == 'guidance':
+        return value.strip() if isinstance(value, str) and value.strip() else None
+    try:
+        score = int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+    return score if 0 <= score <= 100 else None
+
+
+def salvage_job_ratings(content: str) -> dict:
+    """
+    Recover whatever rating fields can be read from a response: valid JSON, JSON embedded in other text, a
+    truncated JSON object, or the old free-text template. Returns a dict of only the fields that were usable.
+    """
+    if not content:
+        return {}
+
+    candidates = {}
+    try:
+        parsed = json.loads(content)
+        if isinstance(parsed, dict):
+            candidates = parsed
+    except ValueError:
+        embedded = re.search(r'\{.*\}', content, re.DOTALL)
+        if embedded:
+            try:
+                candidates = json.loads(embedded.group(0))
+            except ValueError:
+                candidates = {}
+
+    for name, label in LEGACY_RATING_LABELS.items():
+        if name in candidates:
+            continue
+        if name == 'guidance':
+            match = re.search(r'"guidance"\s*:\s*"((?:[^"\\]|\\.)*)"', content) or \
+                    re.search(re.escape(label) + r':\s*(.+)', content, re.DOTALL)
+        else:
+            match = re.search(r'"' + name + r'"\s*:\s*"?(\d+(?:\.\d+)?)"?\s*[,}\n]', content) or \
+                    re.search(re.escape(label) + r':\s*(\d+(?:\.\d+)?)', content)
+        if match:
+            candidates[name] = match.group(1)
+            if name == 'guidance' and match.re.pattern.startswith('"guidance"'):
+                try:
+                    candidates[name] = json.loads('"' + match.group(1) + '"')
+                except ValueError:
+                    pass
+
+    salvaged = {}
+    for name in JobRatings.model_fields:
+        value = valid_rating_value(name, candidates.get(name))
+        if value is not None:
+            salvaged[name] = value
+    return salvaged
+
+
+def create_job_rating_prompt(job_title: str, job_description: str, resume: str,
+                             job_titles: List[str], skill_words: List[str], stop_words: List[str]) -> str:
+    return f"""<job_titles>{', '.join(job_titles)}</job_titles>
+       <desired_words>{', '.join(skill_words)}</desired_words>
+       <undesirable_words>{', '.join(stop_words)}</undesirable_words>
+       <resume>{resume}</resume>
+       <job_title>{job_title}</job_title>
+       <job_description>{job_description}</job_description>
+
+       Given the job titles (job_titles tag), desired words (desired_words tag), undesired words
+       (undesirable_words tag), resume (resume tag), job title (job_title tag) and job description
+       (job_description tag), {RATING_INSTRUCTIONS}
+       """
+
+
+def build_job_rating_request(prompt: str, fields: List[str]) -> dict:
+    """A structured rating request for the given JobRatings fields, so a retry only asks for what is missing."""
+    properties = {name: schema for name, schema in job_ratings_schema_properties().items() if name in fields}
+    if len(fields) < len(JobRatings.model_fields):
+        prompt += f"\n       Only answer these fields: {', '.join(fields)}."
+
+    return {
+        "model": MODEL_FAST,
+        "messages": [
+            {"role": "system", "content": RATINGS_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": build_json_schema_format("job_ratings", properties)
+    }
+
+
+def rate_job(job_title: str, job_description: str, resume: str,
+             job_titles: List[str], skill_words: List[str], stop_words: List[str]) -> Optional[JobRatings]:
+    """
+    Rates one job for one candidate with structured outputs. Usable fields are salvaged from a malformed or
+    partial response, and only the fields still missing are asked for again. Returns None if the job can't be rated.
+    """
+    prompt = create_job_rating_prompt(job_title, job_description, resume, job_titles, skill_words, stop_words)
+
+    ratings = {}
+    for attempt in range(2):
+        missing = [name for name in JobRatings.model_fields if name not in ratings]
+        try:
+            completion = create_completion(build_job_rating_request(prompt, missing))
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error rating {job_title}: {str(e)}")
+            break
+
+        salvaged = salvage_job_ratings(completion.choices[0].message.content)
+        ratings.update({name: value for name, value in salvaged.items() if name in missing})
+        still_missing = [name for name in JobRatings.model_fields if name not in ratings]
+        if not still_missing:
+            return JobRatings(**ratings)
+
+        print(f"Rating response for {job_title} was missing {', '.join(still_missing)}, asking for those only")
+
+    print(f"Unable to rate {job_title}")
+    return None
+
+
+def create_multi_user_rating_prompt(job_title: str, job_description: str, profiles: List[dict]) -> str:
+    profile_blocks = "\n".join(
+        f"=== candidate_id: {profile['user_id']} ===\n"
+        f"Preferred job titles: {', '.join(profile['job_titles'])}\n"
+        f"Desired words: {', '.join(profile['skill_words'])}\n"
+        f"Undesirable words: {', '.join(profile['stop_words'])}\n"
+        f"Resume: {profile['resume']}\n"
+        for profile in profiles
+    )
+
+    return f"""Here is a single job, followed by several candidates.
+
+       Job Details:
+       Title: {job_title}
+       Description: {job_description}
+
+       Candidates (each candidate starts with a line containing its candidate_id):
+{profile_blocks}
+       Separately for each candidate, using their preferred titles, desired words, undesirable words and resume,
+       {RATING_INSTRUCTIONS}
+
+       Return exactly one entry per candidate in the "ratings" array, with user_id set to the candidate_id
+       exactly as given.
+       """
+
+
+def estimate_profile_tokens(profile: dict) -> int:
+    return (count_tokens(profile['resume']) + count_tokens(' '.join(profile['job_titles'])) +
+            count_tokens(' '.join(profile['skill_words'])) + count_tokens(' '.join(profile['stop_words'])) +
+            EVAL_OUTPUT_TOKENS_PER_USER)
+
+
+def request_multi_user_ratings(job_title: str, job_description: str, profiles: List[dict]) -> dict:
+    """Send one structured request rating a job for several users. Raises if the response can't be parsed."""
+    prompt = create_multi_user_rating_prompt(job_title, job_description, profiles)
+    item_properties = {"user_id": {"type": "string"}, **job_ratings_schema_properties()}
+    properties = {
+        "ratings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": item_properties,
+                "required": list(item_properties.keys()),
+                "additionalProperties": False
             }
-        )
+        }
+    }
+
+    completion = create_completion({
+        "model": MODEL_FAST,
+        "messages": [
+            {"role": "system", "content": RATINGS_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": build_json_schema_format("job_ratings_for_users", properties)
+    })
 
-        # Parse the JSON response into our Pydantic model
-        response_json = completion.choices[0].message.content
-        return JobAssessment.model_validate_json(response_json)
+    result = JobRatingsForUsers.model_validate_json(completion.choices[0].message.content)
+    user_ids = {profile['user_id'] for profile in profiles}
+    return {item.user_id: JobRatings(**item.model_dump(exclude={'user_id'}))
+            for item in result.ratings if item.user_id in user_ids}
 
+
+def rate_job_for_user_group(job_title: str, job_description: str, profiles: List[dict]) -> dict:
+    """
+    Rates one job for a group of users, splitting the group in half and retrying when the response fails to
+    parse. Any other error fails the whole group without splitting it, and BudgetExceeded is raised. Users that
+    can't be rated as part of a group are left out of the result.
+    """
+    try:
+        ratings = request_multi_user_ratings(job_title, job_description, profiles)
+    except BudgetExceeded:
+        raise
+    except ValueError as e:
+        # Includes json.JSONDecodeError and pydantic's ValidationError
+        print(f"Unable to parse ratings for {len(profiles)} users: {str(e)}")
+        ratings = {}
     except Exception as e:
-        print(f"Error evaluating job match: {str(e)}")
-        # Return an assessment with all False values in case of error
-        return JobAssessment(
-            title_matches_preferred=False,
-            has_desired_skills=False,
-            free_from_stop_words=False,
-            logical_career_step=False,
-            within_experience_range=False,
-            seniority_matches=False,
-            responsibilities_align=False,
-            level_appropriate=False,
-            has_required_technical_skills=False,
-            has_required_domain_skills=False,
-            meets_education_requirements=False,
-            has_industry_experience=False,
-            meets_years_required=False,
-            has_similar_role_history=False,
-            shows_skill_growth=False,
-            has_similar_environment=False,
-            desire_reason="Unable to evaluate due to an error",
-            requirements_reason="Unable to evaluate due to an error",
-            guidance_text="Unable to generate guidance due to an error in processing this job."
-        )
+        print(f"Error rating job for {len(profiles)} users: {str(e)}")
+        return {}
+
+    missing = [profile for profile in profiles if profile['user_id'] not in ratings]
+    if len(missing) > 1 and len(missing) == len(profiles):
+        print(f"Splitting group of {len(profiles)} users in half and retrying...")
+        middle = len(profiles) // 2
+        ratings.update(rate_job_for_user_group(job_title, job_description, profiles[:middle]))
+        ratings.update(rate_job_for_user_group(job_title, job_description, profiles[middle:]))
+    elif len(missing) > 0 and len(missing) < len(profiles):
+        print(f"Group response was missing {len(missing)} of {len(profiles)} users, retrying those...")
+        ratings.update(rate_job_for_user_group(job_title, job_description, missing))
+
+    return ratings
+
+
+def rate_job_for_users(job_title: str, job_description: str, profiles: List[dict]) -> dict:
+    """
+    Rates one job for several users, sending the job description once per group of users.
+    `profiles` is a list of dicts with user_id, job_titles, skill_words, stop_words and resume keys.
+    Returns a dict of user_id -> JobRatings.
+    """
+    fixed_tokens = count_tokens(create_multi_user_rating_prompt(job_title, job_description, []))
+    groups = plan_evaluation_batches(profiles, fixed_tokens, item_tokens=estimate_profile_tokens)
+    print(f"Rating job '{job_title}' for {len(profiles)} users in {len(groups)} requests")
+
+    ratings = {}
+    for group in groups:
+        ratings.update(rate_job_for_user_group(job_title, job_description, group))
+
+    return ratings
@@ -0,0 +1,94 @@
+import io
+import json
+import time
+
+from llm_config import get_batch_client, BATCH_POLL_SECONDS, BATCH_TIMEOUT_SECONDS
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def to_batch_model_name(model_name):
+    # OpenRouter model IDs are prefixed with the provider ("openai/gpt-5-mini"), batch endpoints are not
+    return model_name.split('/', 1)[-1]
+
+
+def build_batch_file(requests):
+    """Build the JSONL batch input from a dict of custom_id -> chat completion request."""
+    lines = []
+    for custom_id, request in requests.items():
+        body = dict(request)
+        body['model'] = to_batch_model_name(body['model'])
+        lines.append(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}))
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+def submit_batch(client, requests, description):
+    batch_file = client.files.create(file=("batch_input.jsonl", io.BytesIO(build_batch_file(requests))),
+                                     purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h",
+                                  metadata={"description": description})
+    print(f"Submitted batch {batch.id} with {len(requests)} requests ({description})")
+    return batch
+
+
+def wait_for_batch(client, batch_id, poll_seconds=BATCH_POLL_SECONDS, timeout_seconds=BATCH_TIMEOUT_SECONDS):
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"Batch {batch_id} is {batch.status}: {counts.completed} of {counts.total} done, "
+                  f"{counts.failed} failed")
+        else:
+            print(f"Batch {batch_id} is {batch.status}")
+
+        if batch.status in FINISHED_STATUSES:
+            return batch
+
+        if time.monotonic() > deadline:
+            print(f"Batch {batch_id} did not finish in {timeout_seconds} seconds, cancelling...")
+            client.batches.cancel(batch_id)
+            return client.batches.retrieve(batch_id)
+
+        time.sleep(poll_seconds)
+
+
+def iter_batch_results(client, batch):
+    """Stream (custom_id, content) pairs out of a finished batch's output file."""
+    if not batch.output_file_id:
+        return
+
+    output = client.files.content(batch.output_file_id)
+    for line in output.iter_lines():
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            print(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response.get('body')}")
+            continue
+
+        yield result['custom_id'], response['body']['choices'][0]['message']['content']
+
+
+def run_batch(requests, description):
+    """
+    Submits the requests as one batch, waits for it to finish and returns a dict of custom_id -> content.
+    Requests that failed or never finished are left out, so callers can fall back to synchronous calls.
+    """
+    if len(requests) == 0:
+        return {}
+
+    try:
+        client = get_batch_client()
+        batch = submit_batch(client, requests, description)
+        batch = wait_for_batch(client, batch.id)
+        results = dict(iter_batch_results(client, batch))
+    except Exception as e:
+        print(f"Error running batch ({description}): {e}")
+        return {}
+
+    print(f"Batch {batch.id} returned {len(results)} of {len(requests)} results")
+    return results
@@ -0,0 +1,199 @@
+"""
+One retry and timeout policy for every synchronous chat completion. Errors are classified as retryable (rate
+limits, timeouts, connection problems, 5xx) or fatal (bad requests, auth, missing configuration). Retryable
+errors back off with full jitter, honoring Retry-After, until the attempts or the per-call deadline run out.
+With LLM_HEDGE_REQUESTS on, a call that runs past the model's recent p95 latency gets a duplicate request and
+the first answer wins. Which model in a pool serves each attempt is decided by llm_routing, and the token usage
+and budgets of every call are handled by llm_metering.
+"""
+import contextvars
+import functools
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from llm_metering import apply_budget, record_usage
+from llm_routing import choose_model, get_model_pool, record_success, record_failure
+from llm_config import get_openrouter_client, LLM_MAX_ATTEMPTS, LLM_CALL_DEADLINE_SECONDS, \
+    LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS, LLM_HEDGE_REQUESTS, LLM_HEDGE_MIN_SAMPLES
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError, openai.ConflictError)
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+LATENCY_SAMPLES = 200
+
+# Recent successful call latencies per model, for the hedging threshold
+_latencies = {}
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+retry_stats = {
+    'calls': 0,
+    'retries': 0,
+    'fatal_errors': 0,
+    'exhausted': 0,  # calls that ran out of attempts or deadline
+    'hedged': 0,
+    'hedge_wins': 0,  # hedged calls answered by the duplicate request
+}
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def retry_after_seconds(error):
+    """The server's requested wait from Retry-After or retry-after-ms, if the error has one."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        retry_after = headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+    return None
+
+
+def backoff_seconds(attempt, retry_after=None):
+    """Full jitter exponential backoff, never shorter than the server's Retry-After."""
+    wait_time = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    if retry_after is not None:
+        wait_time = max(wait_time, retry_after)
+    return wait_time
+
+
+def record_latency(model, seconds):
+    _latencies.setdefault(model, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+
+def latency_p95(model):
+    samples = _latencies.get(model)
+    if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(len(ordered) * 0.95) - 1]
+
+
+def send_request(client, request, timeout):
+    started = time.monotonic()
+    completion = client.chat.completions.create(**request, timeout=timeout)
+    record_latency(request.get('model'), time.monotonic() - started)
+    return completion
+
+
+def record_losing_usage(future, model, context):
+    """Done callback for the request a hedge didn't use. It is billed too, so its usage is recorded when it answers."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    context.run(record_usage, model, getattr(future.result(), 'usage', None))
+
+
+def send_hedged_request(client, request, timeout):
+    """
+    Send the request, and if it hasn't answered by the model's p95 latency, send a duplicate and take whichever
+    answers first. The slower request is left to finish in the background, and its usage is recorded under the
+    caller's metering tags when it does.
+    """
+    hedge_after = latency_p95(request.get('model'))
+    if not LLM_HEDGE_REQUESTS or hedge_after is None or hedge_after >= timeout:
+        return send_request(client, request, timeout)
+
+    primary = _hedge_executor.submit(send_request, client, request, timeout)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    retry_stats['hedged'] += 1
+    print(f"LLM call to {request.get('model')} passed p95 latency ({hedge_after:.1f}s), sending a hedge request")
+    hedge = _hedge_executor.submit(send_request, client, request, timeout - hedge_after)
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                completion = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is hedge:
+                retry_stats['hedge_wins'] += 1
+            # The caller records the winner's usage, the loser records its own once it answers
+            for loser in {primary, hedge} - {future}:
+                loser.add_done_callback(functools.partial(record_losing_usage, model=request.get('model'),
+                                                          context=contextvars.copy_context()))
+            return completion
+
+    raise error
+
+
+def create_completion(request, deadline_seconds=LLM_CALL_DEADLINE_SECONDS):
+    """
+    Send a chat completion request (the keyword arguments for chat.completions.create) under the shared retry
+    policy. The request's model is routed within its pool, and each retry fails over to another pool model when
+    there is one. Raises the last error when the call fails fatally, runs out of attempts or would pass its deadline.
+    """
+    retry_stats['calls'] += 1
+    request = apply_budget(request)
+    client = get_openrouter_client().with_options(max_retries=0)
+    deadline = time.monotonic() + deadline_seconds
+    requested_model = request.get('model')
+    tried = []
+
+    for attempt in range(1, LLM_MAX_ATTEMPTS + 1):
+        model = choose_model(requested_model, tried)
+        tried.append(model)
+        started = time.monotonic()
+        try:
+            completion = send_hedged_request(client, {**request, 'model': model},
+                                             max(1.0, deadline - time.monotonic()))
+            record_success(model, time.monotonic() - started)
+            record_usage(model, getattr(completion, 'usage', None))
+            return completion
+
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            record_failure(model, rate_limited=isinstance(e, openai.RateLimitError), retry_after=retry_after)
+
+            # A model the provider doesn't serve is only fatal when there is no other model to fail over to
+            model_unavailable = isinstance(e, openai.NotFoundError) and \
+                any(other not in tried for other in get_model_pool(requested_model))
+            if not is_retryable(e) and not model_unavailable:
+                retry_stats['fatal_errors'] += 1
+                print(f"LLM call to {model} failed and won't be retried: {e}")
+                raise
+
+            # Failing over to a different model doesn't need to wait out this model's backoff
+            failing_over = any(other not in tried for other in get_model_pool(requested_model))
+            wait_time = 0 if failing_over else backoff_seconds(attempt, retry_after)
+            if attempt == LLM_MAX_ATTEMPTS or time.monotonic() + wait_time >= deadline:
+                retry_stats['exhausted'] += 1
+                print(f"LLM call to {model} failed after {attempt} attempts: {e}")
+                raise
+
+            retry_stats['retries'] += 1
+            print(f"LLM call to {model} failed: {e}. Attempt {attempt} of {LLM_MAX_ATTEMPTS}. "
+                  f"Retrying in {wait_time:.1f} seconds...")
+            time.sleep(wait_time)
+
+
+def print_retry_report():
+    stats = retry_stats
+    print(f"LLM calls: {stats['calls']}, retries {stats['retries']}, fatal errors {stats['fatal_errors']}, "
+          f"gave up {stats['exhausted']}, hedged {stats['hedged']} ({stats['hedge_wins']} won by the hedge)")
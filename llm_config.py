@@ -1,3 +1,4 @@
+import json
 import os
 
 from openai import OpenAI
@@ -5,6 +6,82 @@ from openai import OpenAI
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 MODEL_FAST = os.environ.get("LLM_MODEL_FAST", "openai/gpt-4.1-nano")
 MODEL_STRUCTURED = os.environ.get("LLM_MODEL_STRUCTURED", "openai/gpt-5-mini")
+# Each role can spread over an ordered pool of equivalent models, comma separated, primary model first.
+# Structured pool members must all support json_schema response formats.
+MODEL_POOLS = {
+    MODEL_FAST: [MODEL_FAST] + [model.strip() for model in os.environ.get("LLM_MODEL_FAST_POOL", "").split(",")
+                                if model.strip() and model.strip() != MODEL_FAST],
+    MODEL_STRUCTURED: [MODEL_STRUCTURED] + [model.strip() for model in
+                                            os.environ.get("LLM_MODEL_STRUCTURED_POOL", "").split(",")
+                                            if model.strip() and model.strip() != MODEL_STRUCTURED],
+}
+# Routing decisions are appended to this JSON lines file when set
+LLM_ROUTING_LOG_FILE = os.environ.get("LLM_ROUTING_LOG_FILE")
+# Batch evaluation packs several jobs for one user into a single structured request
+EVAL_BATCH_MODE = os.environ.get("LLM_EVAL_BATCH_MODE", "true").lower() == "true"
+EVAL_BATCH_TOKEN_BUDGET = int(os.environ.get("LLM_EVAL_BATCH_TOKEN_BUDGET", "24000"))
+EVAL_BATCH_MAX_JOBS = int(os.environ.get("LLM_EVAL_BATCH_MAX_JOBS", "6"))
+EVAL_OUTPUT_TOKENS_PER_JOB = 350
+# Answer the questions that can be settled locally (title, stop words, years, education) before asking the model
+EVAL_LOCAL_ANSWERS = os.environ.get("LLM_EVAL_LOCAL_ANSWERS", "true").lower() == "true"
+# Compact output asks single-job evaluations for an answer string and reason codes, decoded locally
+EVAL_COMPACT_OUTPUT = os.environ.get("LLM_EVAL_COMPACT_OUTPUT", "false").lower() == "true"
+# Reposted jobs reuse a stored evaluation when their simhash is within EVAL_REUSE_MAX_DISTANCE bits
+EVAL_REUSE_MODE = os.environ.get("LLM_EVAL_REUSE_MODE", "true").lower() == "true"
+EVAL_REUSE_MAX_DISTANCE = int(os.environ.get("LLM_EVAL_REUSE_MAX_DISTANCE", "6"))
+EVAL_REUSE_MAX_AGE_DAYS = int(os.environ.get("LLM_EVAL_REUSE_MAX_AGE_DAYS", "60"))
+# Early stop rates a user's candidates in similarity order and stops at the target or the evaluation budget
+EARLY_STOP_MODE = os.environ.get("LLM_EARLY_STOP_MODE", "true").lower() == "true"
+EARLY_STOP_TARGET_JOBS = int(os.environ.get("LLM_EARLY_STOP_TARGET_JOBS", "3"))
+EARLY_STOP_MAX_EVALUATIONS = int(os.environ.get("LLM_EARLY_STOP_MAX_EVALUATIONS", "10"))
+EARLY_STOP_CANDIDATES = int(os.environ.get("LLM_EARLY_STOP_CANDIDATES", "30"))
+EARLY_STOP_CURSOR_DAYS = int(os.environ.get("LLM_EARLY_STOP_CURSOR_DAYS", "7"))
+EARLY_STOP_CURSOR_MAX_URLS = 1000
+# Multi-user evaluation sends one job description with several user profiles
+EVAL_MULTI_USER_MODE = os.environ.get("LLM_EVAL_MULTI_USER_MODE", "true").lower() == "true"
+EVAL_OUTPUT_TOKENS_PER_USER = 250
+# short_summary and hard_requirements are generated when a job is first shown ("lazy") or for every rated job ("eager")
+DERIVED_DATA_MODE = os.environ.get("LLM_DERIVED_DATA_MODE", "lazy").lower()
+DERIVED_DATA_MAX_WORKERS = int(os.environ.get("LLM_DERIVED_DATA_MAX_WORKERS", "4"))
+DERIVED_DATA_FILL_LIMIT = int(os.environ.get("LLM_DERIVED_DATA_FILL_LIMIT", "25"))
+# Retry policy shared by every synchronous LLM call
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "4"))
+LLM_CALL_DEADLINE_SECONDS = float(os.environ.get("LLM_CALL_DEADLINE_SECONDS", "120"))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", "2"))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", "30"))
+# Hedging sends a duplicate request when a call runs past the model's recent p95 latency
+LLM_HEDGE_REQUESTS = os.environ.get("LLM_HEDGE_REQUESTS", "false").lower() == "true"
+LLM_HEDGE_MIN_SAMPLES = 20
+# USD per million tokens as (input, cached input, output), LLM_MODEL_PRICES adds or overrides models as JSON
+MODEL_PRICES = {
+    'openai/gpt-4.1-nano': (0.10, 0.025, 0.40),
+    'openai/gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'openai/gpt-5-nano': (0.05, 0.005, 0.40),
+    'openai/gpt-5-mini': (0.25, 0.025, 2.00),
+    **{model: tuple(prices) for model, prices in json.loads(os.environ.get("LLM_MODEL_PRICES", "{}")).items()},
+}
+# Spend limits in USD, 0 for no limit. Past LLM_BUDGET_DEGRADE_AT of a budget, calls degrade to cheaper options
+LLM_RUN_BUDGET_USD = float(os.environ.get("LLM_RUN_BUDGET_USD", "0"))
+LLM_USER_BUDGET_USD = float(os.environ.get("LLM_USER_BUDGET_USD", "0"))
+LLM_BUDGET_DEGRADE_AT = float(os.environ.get("LLM_BUDGET_DEGRADE_AT", "0.8"))
+# Per-call token usage is appended to this JSON lines file when set
+LLM_USAGE_LOG_FILE = os.environ.get("LLM_USAGE_LOG_FILE")
+# Pre-score: a locally trained model (python prescore_model.py train) skips jobs very unlikely to score over 50
+PRESCORE_MODE = os.environ.get("LLM_PRESCORE_MODE", "on").lower()
+PRESCORE_MODEL_DIR = os.environ.get("LLM_PRESCORE_MODEL_DIR", "prescore_artifacts")
+PRESCORE_MAX_MISS_RATE = float(os.environ.get("LLM_PRESCORE_MAX_MISS_RATE", "0.05"))
+# Cascade: a cheap screening pass ("llm" on MODEL_FAST, "heuristic" locally, or "off") gates the full evaluation
+SCREEN_MODE = os.environ.get("LLM_SCREEN_MODE", "llm").lower()
+SCREEN_CUTOFF = int(os.environ.get("LLM_SCREEN_CUTOFF", "35"))
+SCREEN_AUDIT_RATE = float(os.environ.get("LLM_SCREEN_AUDIT_RATE", "0.1"))
+SCREEN_DESCRIPTION_TOKENS = 300
+# Scraped descriptions are compacted to this many tokens before they go into a prompt
+DESCRIPTION_TOKEN_BUDGET = int(os.environ.get("LLM_DESCRIPTION_TOKEN_BUDGET", "1500"))
+# Offline batch mode submits the nightly run's requests to an OpenAI-compatible batch endpoint
+OFFLINE_BATCH_MODE = os.environ.get("LLM_OFFLINE_BATCH_MODE", "false").lower() == "true"
+BATCH_BASE_URL = os.environ.get("LLM_BATCH_BASE_URL", "https://api.openai.com/v1")
+BATCH_POLL_SECONDS = int(os.environ.get("LLM_BATCH_POLL_SECONDS", "60"))
+BATCH_TIMEOUT_SECONDS = int(os.environ.get("LLM_BATCH_TIMEOUT_SECONDS", str(6 * 60 * 60)))
 APP_SITE_URL = "https://jobs.timetovalue.org"
 APP_TITLE = "Job Scraper"
 
@@ -21,3 +98,10 @@ def get_openrouter_client() -> OpenAI:
             "X-Title": APP_TITLE,
         },
     )
+
+
+def get_batch_client() -> OpenAI:
+    api_key = os.environ.get("LLM_BATCH_API_KEY") or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Environment variable LLM_BATCH_API_KEY or OPENAI_API_KEY is not set.")
+    return OpenAI(base_url=BATCH_BASE_URL, api_key=api_key)
@@ -0,0 +1,258 @@
+"""
+Token and cost metering for every synchronous LLM call. create_completion records each completion's prompt,
+completion and cached tokens, tagged with the model and with whatever metering_context the caller set (pipeline
+stage, user, job). Spend is checked against LLM_RUN_BUDGET_USD and LLM_USER_BUDGET_USD: past
+LLM_BUDGET_DEGRADE_AT of a budget, structured calls drop to MODEL_FAST and optional work (the derived data fill)
+is skipped; past the budget itself, calls are refused with BudgetExceeded.
+
+python llm_metering.py estimate [--users N]   # dry run: predict the nightly run's cost from the planned workload
+"""
+import argparse
+import contextvars
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from llm_config import MODEL_FAST, MODEL_STRUCTURED, MODEL_PRICES, LLM_RUN_BUDGET_USD, LLM_USER_BUDGET_USD, \
+    LLM_BUDGET_DEGRADE_AT, LLM_USAGE_LOG_FILE, DESCRIPTION_TOKEN_BUDGET, EVAL_BATCH_MAX_JOBS, \
+    EVAL_OUTPUT_TOKENS_PER_JOB, EARLY_STOP_MODE, EARLY_STOP_MAX_EVALUATIONS, DERIVED_DATA_FILL_LIMIT, \
+    SCREEN_MODE, SCREEN_DESCRIPTION_TOKENS
+from persistent_storage import get_active_users_with_resume
+
+# Prompt tokens around the job description in an evaluation: instructions, resume profile, titles and skills
+EVALUATION_OVERHEAD_TOKENS = 900
+DERIVED_DATA_OUTPUT_TOKENS = 250
+
+_tags = contextvars.ContextVar('llm_metering_tags', default={})
+_lock = threading.Lock()
+_unpriced_models = set()
+
+usage_records = []
+spend = {
+    'run': 0.0,
+    'by_user': {},
+}
+budget_stats = {
+    'downgraded': 0,  # calls moved from MODEL_STRUCTURED to MODEL_FAST
+    'refused': 0,  # calls refused because a budget was used up
+    'skipped_optional': 0,  # optional work skipped, e.g. derived data fill
+}
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+@contextmanager
+def metering_context(**tags):
+    """Tag the LLM calls made inside the block, e.g. metering_context(stage='screen', user_id=...)."""
+    token = _tags.set({**_tags.get(), **{key: value for key, value in tags.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def current_tags():
+    return _tags.get()
+
+
+def call_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """USD cost of one call from the per-million-token MODEL_PRICES (input, cached input, output)."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        if model not in _unpriced_models:
+            _unpriced_models.add(model)
+            print(f"No price for model {model}, its calls are metered at $0")
+        return 0.0
+
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price +
+            completion_tokens * output_price) / 1_000_000
+
+
+def record_usage(model, usage):
+    """Record a completion's usage under the current tags. Calls without usage data are counted with zeros."""
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+    cost = call_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+
+    tags = current_tags()
+    record = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'model': model,
+        'stage': tags.get('stage', 'other'),
+        'user_id': tags.get('user_id'),
+        'job_id': tags.get('job_id'),
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'cached_tokens': cached_tokens,
+        'cost': cost,
+    }
+
+    with _lock:
+        usage_records.append(record)
+        spend['run'] += cost
+        if record['user_id'] is not None:
+            spend['by_user'][record['user_id']] = spend['by_user'].get(record['user_id'], 0.0) + cost
+
+    if LLM_USAGE_LOG_FILE:
+        try:
+            with _lock, open(LLM_USAGE_LOG_FILE, 'a') as log_file:
+                log_file.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"Unable to write usage log {LLM_USAGE_LOG_FILE}: {e}")
+
+    return record
+
+
+def budget_state(user_id=None):
+    """'exhausted' when the run or user budget is used up, 'degrade' past LLM_BUDGET_DEGRADE_AT of one, else 'ok'."""
+    used_shares = []
+    if LLM_RUN_BUDGET_USD > 0:
+        used_shares.append(spend['run'] / LLM_RUN_BUDGET_USD)
+    if LLM_USER_BUDGET_USD > 0 and user_id is not None:
+        used_shares.append(spend['by_user'].get(user_id, 0.0) / LLM_USER_BUDGET_USD)
+
+    used = max(used_shares, default=0.0)
+    if used >= 1:
+        return 'exhausted'
+    if used >= LLM_BUDGET_DEGRADE_AT:
+        return 'degrade'
+    return 'ok'
+
+
+def user_budget_exhausted(user_id):
+    return budget_state(user_id) == 'exhausted'
+
+
+def apply_budget(request):
+    """
+    The request to send under the current budgets: unchanged, or moved to MODEL_FAST when degrading.
+    Raises BudgetExceeded when the run or the current user has no budget left.
+    """
+    user_id = current_tags().get('user_id')
+    state = budget_state(user_id)
+    if state == 'exhausted':
+        budget_stats['refused'] += 1
+        scope = f"user {user_id}" if user_id is not None and budget_state() != 'exhausted' else "this run"
+        raise BudgetExceeded(f"LLM budget for {scope} is used up")
+
+    if state == 'degrade' and request.get('model') == MODEL_STRUCTURED and MODEL_FAST != MODEL_STRUCTURED:
+        budget_stats['downgraded'] += 1
+        return {**request, 'model': MODEL_FAST}
+
+    return request
+
+
+def allows_optional_work(user_id=None):
+    """Optional calls (backfills, nice-to-have text) only run while the budgets aren't close to used up."""
+    if budget_state(user_id) == 'ok':
+        return True
+    budget_stats['skipped_optional'] += 1
+    return False
+
+
+def summarize(records, key):
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record[key], {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                                'cached_tokens': 0, 'cost': 0.0})
+        total['calls'] += 1
+        for field in ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost'):
+            total[field] += record[field]
+    return totals
+
+
+def print_usage_report(top_users=5):
+    if not usage_records:
+        return
+
+    print(f"LLM usage: {len(usage_records)} calls, ${spend['run']:.4f}"
+          f"{f' of a ${LLM_RUN_BUDGET_USD:g} budget' if LLM_RUN_BUDGET_USD > 0 else ''}")
+    for key in ('model', 'stage'):
+        for name, total in sorted(summarize(usage_records, key).items(), key=lambda item: -item[1]['cost']):
+            print(f"  {key} {name}: {total['calls']} calls, {total['prompt_tokens']} prompt "
+                  f"({total['cached_tokens']} cached) + {total['completion_tokens']} completion tokens, "
+                  f"${total['cost']:.4f}")
+
+    for user_id, cost in sorted(spend['by_user'].items(), key=lambda item: -item[1])[:top_users]:
+        print(f"  user {user_id}: ${cost:.4f}")
+
+    if any(budget_stats.values()):
+        print(f"  budgets: {budget_stats['downgraded']} calls downgraded, {budget_stats['refused']} refused, "
+              f"{budget_stats['skipped_optional']} optional steps skipped")
+
+
+def logged_stage_averages():
+    """Average tokens per call for each stage in LLM_USAGE_LOG_FILE, from earlier runs."""
+    if not LLM_USAGE_LOG_FILE:
+        return {}
+    try:
+        with open(LLM_USAGE_LOG_FILE) as log_file:
+            records = [json.loads(line) for line in log_file if line.strip()]
+    except (OSError, ValueError):
+        return {}
+
+    return {stage: {'prompt_tokens': total['prompt_tokens'] / total['calls'],
+                    'completion_tokens': total['completion_tokens'] / total['calls'],
+                    'cached_tokens': total['cached_tokens'] / total['calls']}
+            for stage, total in summarize(records, 'stage').items()}
+
+
+def estimate_run_cost(user_count, evaluations_per_user=None, derived_data_jobs=DERIVED_DATA_FILL_LIMIT):
+    """
+    Predicted cost of a nightly run for user_count users, as a dict of stage -> (calls, cost). Token counts per
+    call come from the usage log when there is one and from the prompt budgets otherwise, so this is an upper
+    end estimate: it assumes every evaluation slot is used.
+    """
+    evaluations_per_user = evaluations_per_user or (EARLY_STOP_MAX_EVALUATIONS if EARLY_STOP_MODE else 10)
+    batches_per_user = -(-evaluations_per_user // EVAL_BATCH_MAX_JOBS)
+    averages = logged_stage_averages()
+
+    planned = {
+        # stage: (calls, model, prompt tokens per call, completion tokens per call)
+        'evaluation': (user_count * batches_per_user, MODEL_STRUCTURED,
+                       EVALUATION_OVERHEAD_TOKENS + DESCRIPTION_TOKEN_BUDGET * EVAL_BATCH_MAX_JOBS,
+                       EVAL_OUTPUT_TOKENS_PER_JOB * EVAL_BATCH_MAX_JOBS),
+        'derived_data': (derived_data_jobs * 2, MODEL_FAST, DESCRIPTION_TOKEN_BUDGET + 200,
+                         DERIVED_DATA_OUTPUT_TOKENS),
+    }
+    if SCREEN_MODE == 'llm':
+        planned['screen'] = (user_count * batches_per_user, MODEL_FAST,
+                             EVALUATION_OVERHEAD_TOKENS + SCREEN_DESCRIPTION_TOKENS * EVAL_BATCH_MAX_JOBS,
+                             20 * EVAL_BATCH_MAX_JOBS)
+
+    estimate = {}
+    for stage, (calls, model, prompt_tokens, completion_tokens) in planned.items():
+        cached_tokens = 0
+        if stage in averages:
+            prompt_tokens = averages[stage]['prompt_tokens']
+            completion_tokens = averages[stage]['completion_tokens']
+            cached_tokens = averages[stage]['cached_tokens']
+        estimate[stage] = (calls, calls * call_cost(model, prompt_tokens, completion_tokens, cached_tokens))
+
+    return estimate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="LLM cost estimates")
+    parser.add_argument('command', choices=['estimate'])
+    parser.add_argument('--users', type=int, help="number of users, defaults to the active users with a resume")
+    parser.add_argument('--evaluations', type=int, help="full evaluations per user")
+    args = parser.parse_args()
+
+    users = args.users
+    if users is None:
+        users = len(get_active_users_with_resume())
+
+    run_estimate = estimate_run_cost(users, args.evaluations)
+    print(f"Estimated nightly run for {users} users:")
+    for stage, (calls, cost) in run_estimate.items():
+        print(f"  {stage}: {calls} calls, ${cost:.4f}")
+    print(f"  total: ${sum(cost for calls, cost in run_estimate.values()):.4f}")
+    if LLM_RUN_BUDGET_USD > 0:
+        print(f"  run budget: ${LLM_RUN_BUDGET_USD:g}")
@@ -0,0 +1,112 @@
+"""
+Routes each call for a logical model (MODEL_FAST, MODEL_STRUCTURED) to one model in its pool. Traffic is spread
+by weighted random choice, favoring models with a low recent 429 rate and low latency. A rate-limited model
+cools down for its Retry-After before it is picked again, and a failed attempt fails over to another model.
+Every decision is kept in routing_log, and appended to LLM_ROUTING_LOG_FILE when that is set.
+"""
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+from llm_config import MODEL_POOLS, LLM_ROUTING_LOG_FILE
+
+EWMA_ALPHA = 0.2
+DEFAULT_COOLDOWN_SECONDS = 10
+
+# model -> {'calls', 'rate_limited', 'errors', 'rate_429', 'latency', 'cooldown_until'}
+model_health = {}
+routing_log = []
+
+
+def get_model_pool(model):
+    return MODEL_POOLS.get(model, [model])
+
+
+def health_for(model):
+    return model_health.setdefault(model, {'calls': 0, 'rate_limited': 0, 'errors': 0, 'rate_429': 0.0,
+                                           'latency': None, 'cooldown_until': 0.0})
+
+
+def model_weight(model, typical_latency):
+    health = health_for(model)
+    latency = health['latency'] if health['latency'] is not None else typical_latency
+    return max(0.01, 1 - health['rate_429']) / max(latency, 0.1)
+
+
+def choose_model(requested_model, tried=()):
+    """Pick a model from the requested model's pool, skipping models already tried for this call when possible."""
+    pool = get_model_pool(requested_model)
+    if len(pool) == 1:
+        return requested_model
+
+    now = time.monotonic()
+    candidates = [model for model in pool if model not in tried] or pool
+    available = [model for model in candidates if health_for(model)['cooldown_until'] <= now]
+    if not available:
+        # Everything is cooling down, take the model that comes back first
+        chosen = min(candidates, key=lambda model: health_for(model)['cooldown_until'])
+        log_decision(requested_model, chosen, 'all models cooling down', {})
+        return chosen
+
+    known_latencies = [health_for(model)['latency'] for model in pool if health_for(model)['latency'] is not None]
+    typical_latency = sum(known_latencies) / len(known_latencies) if known_latencies else 1.0
+    weights = {model: model_weight(model, typical_latency) for model in available}
+    chosen = random.choices(available, weights=[weights[model] for model in available])[0]
+
+    reason = 'failover' if tried else 'weighted'
+    log_decision(requested_model, chosen, reason, {model: round(weight, 3) for model, weight in weights.items()})
+    return chosen
+
+
+def record_success(model, latency):
+    health = health_for(model)
+    health['calls'] += 1
+    health['rate_429'] = (1 - EWMA_ALPHA) * health['rate_429']
+    health['latency'] = latency if health['latency'] is None else \
+        (1 - EWMA_ALPHA) * health['latency'] + EWMA_ALPHA * latency
+
+
+def record_failure(model, rate_limited=False, retry_after=None):
+    health = health_for(model)
+    health['calls'] += 1
+    health['errors'] += 1
+    if rate_limited:
+        health['rate_limited'] += 1
+        health['rate_429'] = (1 - EWMA_ALPHA) * health['rate_429'] + EWMA_ALPHA
+        health['cooldown_until'] = time.monotonic() + (retry_after or DEFAULT_COOLDOWN_SECONDS)
+    else:
+        health['rate_429'] = (1 - EWMA_ALPHA) * health['rate_429']
+
+
+def log_decision(requested_model, chosen_model, reason, weights):
+    entry = {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'requested': requested_model,
+        'chosen': chosen_model,
+        'reason': reason,
+        'weights': weights
+    }
+    routing_log.append(entry)
+    if LLM_ROUTING_LOG_FILE:
+        try:
+            with open(LLM_ROUTING_LOG_FILE, 'a') as log_file:
+                log_file.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"Unable to write routing log: {e}")
+
+
+def print_routing_report():
+    pooled_models = [model for pool in MODEL_POOLS.values() if len(pool) > 1 for model in pool]
+    if not pooled_models:
+        return
+
+    chosen_counts = {}
+    for entry in routing_log:
+        chosen_counts[entry['chosen']] = chosen_counts.get(entry['chosen'], 0) + 1
+
+    for model in pooled_models:
+        health = health_for(model)
+        latency = f"{health['latency']:.1f}s" if health['latency'] is not None else "n/a"
+        print(f"Routing: {model} picked {chosen_counts.get(model, 0)} times, {health['calls']} calls, "
+              f"{health['rate_limited']} rate limited, {health['errors']} errors, latency {latency}")
@@ -0,0 +1,120 @@
+"""
+Answers the JobAssessment questions that can be settled without an LLM: preferred title match, stop words in the
+description, years of experience and education. A question is only answered when the local check is confident,
+everything else is left for the model.
+"""
+import re
+
+# Words that don't say anything about which job a title is for
+GENERIC_TITLE_WORDS = {'senior', 'sr', 'junior', 'jr', 'lead', 'principal', 'staff', 'head', 'chief', 'associate',
+                       'i', 'ii', 'iii', 'iv', 'of', 'and', 'the', 'a', 'remote', 'hybrid', 'contract', 'to', 'for'}
+
+YEARS_PATTERN = re.compile(r'(?:at least|minimum of|min\.?|over)?\s*(\d{1,2})\s*(?:\+|-\s*\d{1,2}|to\s+\d{1,2})?\s*'
+                           r'\+?\s*(?:years?|yrs?)(?:\'s?)?\s+(?:of\s+)?(?:[\w/&,-]+\s+){0,4}?experience',
+                           re.IGNORECASE)
+
+# Degree levels, highest first. Each pattern needs degree context, so "Scrum Master", "Master Data Management"
+# and "mastery" aren't read as a master's degree.
+DEGREE_LEVELS = [
+    (3, [re.compile(pattern, re.IGNORECASE) for pattern in [
+        r"\bph\.?\s?d\b", r"\bdoctorate\b", r"\bdoctoral\s+degree\b"]]),
+    (2, [re.compile(pattern, re.IGNORECASE) for pattern in [
+        r"\bmaster['’]s\b", r"\bmasters?\s+(?:degree|in)\b",
+        r"\bmaster\s+of\s+(?:science|arts|business|engineering|computer|information|public|fine|applied)\b",
+        r"\bm\.?b\.?a\b", r"(?<![\w.])m\.s\.(?!\w)", r"(?<![\w.])(?:m\.?sc?)\.?\s+(?:degree|in)\b", r"\bm\.?sc\b"]]),
+    (1, [re.compile(pattern, re.IGNORECASE) for pattern in [
+        r"\bbachelor(?:['’]?s)?\b", r"(?<![\w.])b\.[sa]\.(?!\w)", r"(?<![\w.])(?:b\.?[sa]c?)\.?\s+(?:degree|in)\b",
+        r"\bb\.?sc\b", r"\bb[sa]\s*/\s*b[sa]\b", r"\b(?:undergraduate|college|university|four-year|4-year)\s+degree\b"]]),
+]
+# Degree-like words that didn't match a level above, their meaning is left to the model
+AMBIGUOUS_DEGREE_PATTERN = re.compile(r"\bmasters?\b|(?<![\w.])[mb]\.\s?[sa]\b|\bdegree\b(?!\s+of\b)", re.IGNORECASE)
+# In the candidate's education entries, bare abbreviations such as "BS Computer Science" may be a degree too
+EDUCATION_AMBIGUOUS_PATTERN = re.compile(AMBIGUOUS_DEGREE_PATTERN.pattern + r"|\b(?:bs|ba|ms|ma)\b", re.IGNORECASE)
+DEGREE_OPTIONAL_WORDS = ['preferred', 'a plus', 'nice to have', 'bonus', 'or equivalent', 'equivalent experience',
+                         'or related experience', 'desired', 'not required']
+
+
+def title_words(title):
+    return set(re.findall(r'[a-z0-9+#]+', (title or '').lower())) - GENERIC_TITLE_WORDS
+
+
+def answer_title_matches_preferred(job_title, job_titles):
+    """True when a preferred title is contained in the job title, False when they share no meaningful words."""
+    job_words = title_words(job_title)
+    preferred = [title_words(title) for title in job_titles if title_words(title)]
+    if not job_words or not preferred:
+        return None
+    if any(words <= job_words for words in preferred):
+        return True
+    if not any(words & job_words for words in preferred):
+        return False
+    return None
+
+
+def answer_free_from_stop_words(job_description, stop_words):
+    description = (job_description or '').lower()
+    return not any(re.search(r'\b' + re.escape(stop_word.lower()) + r'\b', description)
+                   for stop_word in stop_words if stop_word.strip())
+
+
+def required_years(job_description):
+    """The years of experience numbers the description asks for, smallest first."""
+    return sorted({int(match.group(1)) for match in YEARS_PATTERN.finditer(job_description or '')
+                   if 0 < int(match.group(1)) <= 30})
+
+
+def answer_meets_years_required(job_description, profile):
+    """True when the candidate has at least the largest number asked for, False when below the smallest."""
+    years = required_years(job_description)
+    if profile is None or not years:
+        return None
+    if profile.total_years_experience >= years[-1]:
+        return True
+    if profile.total_years_experience < years[0] - 1:
+        return False
+    return None
+
+
+def degree_level(text, ambiguous_pattern=AMBIGUOUS_DEGREE_PATTERN):
+    """The highest degree level the text names, 0 for none, or None when it may name one but it isn't clear."""
+    for level, patterns in DEGREE_LEVELS:
+        if any(pattern.search(text) for pattern in patterns):
+            return level
+    return None if ambiguous_pattern.search(text) else 0
+
+
+def answer_meets_education_requirements(job_description, profile):
+    """True when no degree is required or the candidate holds the level asked for, False when they clearly don't."""
+    required_level = 0
+    for sentence in re.split(r'(?<=[.!?;\n])\s+', job_description or ''):
+        if any(word in sentence.lower() for word in DEGREE_OPTIONAL_WORDS):
+            continue
+        level = degree_level(sentence)
+        if level is None:
+            return None
+        required_level = max(required_level, level)
+
+    if required_level == 0:
+        return True
+    if profile is None or not profile.education:
+        return None
+
+    levels = [degree_level(item, EDUCATION_AMBIGUOUS_PATTERN) for item in profile.education]
+    candidate_level = max(level or 0 for level in levels)
+    if candidate_level >= required_level:
+        return True
+    if None in levels:
+        return None
+    # A candidate with some degree may still be judged by the model, one without any listed degree is a clear no
+    return False if candidate_level == 0 or required_level - candidate_level >= 2 else None
+
+
+def local_answers(job_title, job_description, job_titles, stop_words, profile=None):
+    """The confident local answers for a job, as a dict of JobAssessment field -> bool."""
+    answers = {
+        'title_matches_preferred': answer_title_matches_preferred(job_title, job_titles),
+        'free_from_stop_words': answer_free_from_stop_words(job_description, stop_words),
+        'meets_years_required': answer_meets_years_required(job_description, profile),
+        'meets_education_requirements': answer_meets_education_requirements(job_description, profile),
+    }
+    return {name: answer for name, answer in answers.items() if answer is not None}
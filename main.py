@@ -1,243 +1,335 @@
 import os
 import time
+from datetime import datetime, timedelta
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import pandas as pd
 
 from analyzer import find_top_job_matches
 from calculate_scores import calculate_desire_score, calculate_experience_score, calculate_requirements_score, \
-    calculate_experience_requirements_score, calculate_overall_score
+    calculate_experience_requirements_score, calculate_overall_score, assessment_bitmask
 from job_helpers import find_best_job_titles_for_user, job_meets_salary_requirements, job_matches_stop_words, \
-    get_job_guidance_for_user, get_derived_data_for_job
-from job_scraper import scrape_job_data, clean_and_deduplicate_jobs, add_derived_data
-from helpers import consolidate_text
+    get_job_guidance_for_user, get_job_guidance_for_users
+from job_scraper import scrape_job_data, clean_and_deduplicate_jobs, add_derived_data, build_job_context
+from helpers import count_tokens
+from text_compaction import compact_job_description
+from resume_profile import get_resume_for_prompt, get_resume_profile_for_user
+from local_answers import local_answers
+from evaluation_cascade import screen_jobs, record_cascade_results, print_cascade_report
+from prescore_model import prescore_jobs, record_prescore_results, print_prescore_report
+from evaluation_reuse import job_fingerprint, reusable_assessments, store_assessment, print_reuse_report
+from derived_data import needs_derived_data, materialize_job, fill_derived_data, print_derived_data_report, \
+    JOB_COLUMNS
 
 # Logging
 import logging
 from pathlib import Path
 import sys
 
-from persistent_storage import save_jobs_to_supabase, get_user_configs, get_active_users_with_resume, \
-    get_recent_jobs, add_user_job_association, get_user_by_id, get_job_by_id, \
-    user_has_recommendation, create_new_job_if_not_exists, get_user_job_matches, update_job_in_supabase
-from llm import query_llm
-from llm_config import MODEL_FAST
+from persistent_storage import save_jobs_to_supabase, get_active_users_with_resume, \
+    get_recent_jobs, get_jobs_by_ids, create_new_job_if_not_exists, get_evaluation_cursor
+from write_behind import queue_user_job_association, queue_evaluation_cursor, flush_writes, \
+    print_write_behind_report
+from user_context import load_user_contexts, refresh_job_ids, add_config_values, has_recommendation
+from llm import evaluate_job_match, evaluate_jobs_batch, ask_chatgpt_about_job, \
+    build_evaluation_request, build_batch_evaluation_request, build_derived_data_request, parse_batch_evaluation, \
+    create_batch_evaluation_prompt, plan_evaluation_batches, rate_job, parse_evaluation_response, EvaluationFailed
+from llm_batch import run_batch
+from llm_client import print_retry_report
+from llm_routing import print_routing_report
+from job_cache import print_job_cache_report
+from llm_metering import BudgetExceeded, metering_context, user_budget_exhausted, print_usage_report
+from llm_config import EVAL_BATCH_MODE, EVAL_BATCH_MAX_JOBS, EVAL_LOCAL_ANSWERS, EVAL_MULTI_USER_MODE, \
+    OFFLINE_BATCH_MODE, DERIVED_DATA_MODE, EARLY_STOP_MODE, EARLY_STOP_TARGET_JOBS, EARLY_STOP_MAX_EVALUATIONS, EARLY_STOP_CANDIDATES, \
+    EARLY_STOP_CURSOR_DAYS, EARLY_STOP_CURSOR_MAX_URLS
 from send_emails import send_email_updates
 from file_utils import write_jobs_to_downloads
 
 
-def get_job_ratings2(original_df, db_user, user_configs):
-    jobs_df = original_df.copy()
+def set_zero_scores(jobs_df, index):
+    jobs_df.at[index, 'desire_score'] = 0
+    jobs_df.at[index, 'experience_score'] = 0
+    jobs_df.at[index, 'meets_requirements_score'] = 0
+    jobs_df.at[index, 'meets_experience_score'] = 0
+    jobs_df.at[index, 'job_score'] = 0
+
+
+def clear_scores(jobs_df, index):
+    """Leaves a job that couldn't be rated without scores, so it isn't saved or remembered as evaluated."""
+    for column in ('desire_score', 'experience_score', 'meets_requirements_score', 'meets_experience_score',
+                   'job_score'):
+        jobs_df.at[index, column] = np.nan
+
+
+def apply_assessment_scores(jobs_df, index, assessment):
+    # Calculate individual scores based on the yes/no responses
+    desire_score = calculate_desire_score(assessment)
+    experience_score = calculate_experience_score(assessment)
+    requirements_score = calculate_requirements_score(assessment)
+    experience_req_score = calculate_experience_requirements_score(assessment)
+
+    # Calculate final overall score
+    overall_score = calculate_overall_score(
+        desire_score,
+        experience_score,
+        requirements_score,
+        experience_req_score
+    )
+
+    # Update DataFrame with all scores
+    jobs_df.at[index, 'desire_score'] = desire_score
+    jobs_df.at[index, 'experience_score'] = experience_score
+    jobs_df.at[index, 'meets_requirements_score'] = requirements_score
+    jobs_df.at[index, 'meets_experience_score'] = experience_req_score
+    jobs_df.at[index, 'job_score'] = overall_score
+    # Get guidance from the assessment
+    jobs_df.at[index, 'guidance'] = assessment.guidance_text
+
+    # Optionally add detailed assessment results for debugging or analysis
+    jobs_df.at[index, 'assessment_details'] = assessment.model_dump_json()
+    # The raw answers are stored so the weights can be tuned later without asking the LLM again
+    jobs_df.at[index, 'assessment_bits'] = assessment_bitmask(assessment)
+
+    return overall_score
+
+
+def get_rating_inputs(db_user, user_configs):
     db_job_titles = [config['string_value'] for config in user_configs if config['key'] == 'job_titles']
     db_skill_words = [config['string_value'] for config in user_configs if config['key'] == 'skill_words']
     db_stop_words = [config['string_value'] for config in user_configs if config['key'] == 'stop_words']
-    db_resume = db_user.get('resume')
-
-    job_titles = db_job_titles or []
-    skill_words = db_skill_words or []
-    stop_words = db_stop_words or []
-
-    resume = consolidate_text(db_resume)
 
+    return {
+        'job_titles': db_job_titles or [],
+        'skill_words': db_skill_words or [],
+        'stop_words': db_stop_words or [],
+        # The compact resume profile stands in for the full resume in every evaluation prompt
+        'resume': get_resume_for_prompt(db_user),
+        'profile': get_resume_profile_for_user(db_user),
+        'resume_text': db_user.get('resume'),
+        'user_id': db_user.get('id')
+    }
+
+
+def get_jobs_to_rate(jobs_df, rating_inputs):
+    """
+    Zero out jobs with stop words in the title and return the rest as evaluation inputs, along with the
+    questions that could be answered locally.
+    """
+    stop_words = rating_inputs['stop_words']
+    pending_jobs = []
     for index, row in jobs_df.iterrows():
         job_title = row.get('title', "N/A")
         company = row.get('company', "N/A")
-        job_description = row.get('description', "N/A")
-        job_description = consolidate_text(job_description)
+        full_description = row.get('description', "N/A")
+        job_description = compact_job_description(full_description, label=f"{job_title} at {company}")
 
         # Check for stop words first to avoid unnecessary API calls
         if any(stop_word.lower() in job_title.lower()
                for stop_word in stop_words):
             print(f"{index}: Skipping {job_title} at {company} due to stop words")
-            jobs_df.at[index, 'desire_score'] = 0
-            jobs_df.at[index, 'experience_score'] = 0
-            jobs_df.at[index, 'meets_requirements_score'] = 0
-            jobs_df.at[index, 'meets_experience_score'] = 0
-            jobs_df.at[index, 'job_score'] = 0
+            set_zero_scores(jobs_df, index)
             continue
 
+        known_answers = {}
+        if EVAL_LOCAL_ANSWERS:
+            known_answers = local_answers(job_title, full_description, rating_inputs['job_titles'], stop_words,
+                                          rating_inputs.get('profile'))
+        pending_jobs.append({'job_id': str(index), 'index': index, 'title': job_title,
+                             'company': company, 'description': job_description, 'known_answers': known_answers,
+                             'job_url': row.get('job_url'),
+                             'fingerprint': job_fingerprint(job_title, full_description)})
+
+    return pending_jobs
+
+
+def screen_pending_jobs(jobs_df, pending_jobs, rating_inputs):
+    """
+    Score the reposts of jobs evaluated before from their stored evaluation, run the local pre-score model and
+    then the cheap screening tier, zero out rejected jobs and return the jobs that go on to the full evaluation.
+    """
+    reused_jobs, pending_jobs = reusable_assessments(pending_jobs, rating_inputs)
+    for job, assessment in reused_jobs:
+        overall_score = apply_assessment_scores(jobs_df, job['index'], assessment)
+        print(f"{job['index']}: Rating reused for {job['title']} at {job['company']}: {overall_score}")
+
+    prescored_jobs, skipped_jobs = prescore_jobs(pending_jobs, rating_inputs)
+    prescore_audits = [job for job in prescored_jobs if job.get('audit') == 'prescore']
+    screened_jobs, rejected_jobs, audited_job_ids = screen_jobs(
+        [job for job in prescored_jobs if job.get('audit') != 'prescore'], rating_inputs)
+
+    for job in skipped_jobs + rejected_jobs:
+        set_zero_scores(jobs_df, job['index'])
+        jobs_df.at[job['index'], 'guidance'] = "Screened out as a poor fit before a full evaluation."
+
+    for job in screened_jobs:
+        if job['job_id'] in audited_job_ids:
+            job['audit'] = 'screen'
+
+    return screened_jobs + prescore_audits
+
+
+def apply_job_ratings(jobs_df, pending_jobs, assessments, rating_inputs):
+    """
+    Score each pending job from its assessment, evaluating any job without one, and keep jobs over 50. A job
+    whose evaluation failed (None in assessments) is left unscored, so it isn't saved.
+    """
+    for job in pending_jobs:
+        index = job['index']
         try:
-            # Get the structured yes/no evaluation from the LLM
-            from llm import evaluate_job_match
-            assessment = evaluate_job_match(
-                job_title=job_title,
-                job_description=job_description,
-                resume=resume,
-                job_titles=job_titles,
-                skill_words=skill_words,
-                stop_words=stop_words
-            )
-
-            # Calculate individual scores based on the yes/no responses
-            desire_score = calculate_desire_score(assessment)
-            experience_score = calculate_experience_score(assessment)
-            requirements_score = calculate_requirements_score(assessment)
-            experience_req_score = calculate_experience_requirements_score(assessment)
-
-            # Calculate final overall score
-            overall_score = calculate_overall_score(
-                desire_score,
-                experience_score,
-                requirements_score,
-                experience_req_score
-            )
-
-            # Update DataFrame with all scores
-            jobs_df.at[index, 'desire_score'] = desire_score
-            jobs_df.at[index, 'experience_score'] = experience_score
-            jobs_df.at[index, 'meets_requirements_score'] = requirements_score
-            jobs_df.at[index, 'meets_experience_score'] = experience_req_score
-            jobs_df.at[index, 'job_score'] = overall_score
-            # Get guidance from the assessment
-            jobs_df.at[index, 'guidance'] = assessment.guidance_text
-
-            print(f"{index}: Rating added for {job_title} at {company}: {overall_score}")
-
-            # Optionally add detailed assessment results for debugging or analysis
-            jobs_df.at[index, 'assessment_details'] = assessment.model_dump_json()
-
+            if job['job_id'] in assessments:
+                assessment = assessments[job['job_id']]
+            else:
+                with metering_context(stage='evaluation', user_id=rating_inputs.get('user_id'),
+                                      job_id=job.get('job_url')):
+                    assessment = evaluate_job_match(
+                        job_title=job['title'],
+                        job_description=job['description'],
+                        resume=rating_inputs['resume'],
+                        job_titles=rating_inputs['job_titles'],
+                        skill_words=rating_inputs['skill_words'],
+                        stop_words=rating_inputs['stop_words'],
+                        known_answers=job.get('known_answers')
+                    )
+            if assessment is None:
+                raise EvaluationFailed(f"Unable to evaluate {job['title']}")
+
+            overall_score = apply_assessment_scores(jobs_df, index, assessment)
+            print(f"{index}: Rating added for {job['title']} at {job['company']}: {overall_score}")
+            store_assessment(job, rating_inputs, assessment)
+
+        except EvaluationFailed as e:
+            print(f"{index}: {e} at {job['company']}, leaving it unscored")
+            clear_scores(jobs_df, index)
+
+        except BudgetExceeded:
+            raise
         except Exception as e:
-            print(f"{index}: Error processing {job_title} at {company}: {str(e)}")
-            # Set all scores to 0 in case of error
-            jobs_df.at[index, 'desire_score'] = 0
-            jobs_df.at[index, 'experience_score'] = 0
-            jobs_df.at[index, 'meets_requirements_score'] = 0
-            jobs_df.at[index, 'meets_experience_score'] = 0
-            jobs_df.at[index, 'job_score'] = 0
-            jobs_df.at[index, 'guidance'] = "Unable to generate guidance due to an error in processing this job."
-
+            print(f"{index}: Error processing {job['title']} at {job['company']}: {str(e)}, leaving it unscored")
+            clear_scores(jobs_df, index)
+
+    if 'job_score' not in jobs_df.columns:
+        # No job was scored at all
+        jobs_df['job_score'] = np.nan
+    record_prescore_results(jobs_df, pending_jobs)
+    record_cascade_results(jobs_df, pending_jobs)
     jobs_over_50 = jobs_df[jobs_df['job_score'].astype(float) > 50]
 
     print('Found jobs with scores over 50: ' + str(len(jobs_over_50)))
     return jobs_over_50
 
 
+def rate_jobs(jobs_df, rating_inputs):
+    """Rate the jobs in jobs_df in place. Returns (jobs_over_50, evaluations), the number of jobs sent to the LLM."""
+    pending_jobs = screen_pending_jobs(jobs_df, get_jobs_to_rate(jobs_df, rating_inputs),
+                                       rating_inputs)
+
+    # Get the structured yes/no evaluations from the LLM, several jobs per request in batch mode
+    assessments = {}
+    if EVAL_BATCH_MODE and len(pending_jobs) > 1:
+        with metering_context(stage='evaluation', user_id=rating_inputs.get('user_id')):
+            assessments = evaluate_jobs_batch(pending_jobs, rating_inputs['resume'], rating_inputs['job_titles'],
+                                              rating_inputs['skill_words'], rating_inputs['stop_words'])
+
+    return apply_job_ratings(jobs_df, pending_jobs, assessments, rating_inputs), len(pending_jobs)
+
+
+def get_job_ratings2(original_df, db_user, user_configs):
+    jobs_df = original_df.copy()
+    try:
+        rated_jobs, evaluations = rate_jobs(jobs_df, get_rating_inputs(db_user, user_configs))
+    except BudgetExceeded as e:
+        print(f"{e}, no jobs rated for user {db_user.get('id')}")
+        return jobs_df.iloc[0:0]
+    return rated_jobs
+
+
+def stream_job_ratings(ranked_jobs, db_user, user_configs):
+    """
+    Rates jobs in the given (descending similarity) order a batch at a time, stopping once the user has
+    EARLY_STOP_TARGET_JOBS jobs over 50 today or EARLY_STOP_MAX_EVALUATIONS jobs have gone to the LLM.
+    Jobs that got a score, from an assessment or by being screened out, are remembered in the user's evaluation
+    cursor, so the next run carries on past them. Jobs that couldn't be rated are left for the next run.
+    """
+    user_id = db_user.get('id')
+    today = datetime.now().date().isoformat()
+    cursor = get_evaluation_cursor(user_id)
+    cursor_is_recent = cursor is not None and \
+        pd.to_datetime(cursor['updated_at']).tz_localize(None) > datetime.now() - timedelta(days=EARLY_STOP_CURSOR_DAYS)
+    evaluated_urls = list(cursor['evaluated_urls']) if cursor_is_recent else []
+    good_jobs = cursor['good_jobs_today'] if cursor_is_recent and cursor['cursor_date'] == today else 0
+
+    candidates = ranked_jobs[~ranked_jobs['job_url'].isin(set(evaluated_urls))]
+    rating_inputs = get_rating_inputs(db_user, user_configs)
+
+    rated_chunks = []
+    evaluations = 0
+    position = 0
+    while position < len(candidates):
+        if good_jobs >= EARLY_STOP_TARGET_JOBS:
+            print(f"User {user_id} has {good_jobs} jobs over 50 today, stopping early")
+            break
+        if evaluations >= EARLY_STOP_MAX_EVALUATIONS:
+            print(f"Used the evaluation budget of {EARLY_STOP_MAX_EVALUATIONS} for user {user_id}, stopping")
+            break
+        if user_budget_exhausted(user_id):
+            print(f"LLM spend budget for user {user_id} is used up, stopping")
+            break
+
+        chunk = candidates.iloc[position:position + min(EVAL_BATCH_MAX_JOBS, EARLY_STOP_MAX_EVALUATIONS - evaluations)]
+        chunk_df = chunk.copy()
+        try:
+            rated_chunk, chunk_evaluations = rate_jobs(chunk_df, rating_inputs)
+        except BudgetExceeded as e:
+            # The chunk stays out of the cursor, so the next run evaluates it
+            print(f"{e}, stopping for user {user_id}")
+            break
+        position += len(chunk)
+        evaluations += chunk_evaluations
+        good_jobs += len(rated_chunk)
+        rated_chunks.append(rated_chunk)
+        evaluated_urls.extend(chunk_df.loc[chunk_df['job_score'].notna(), 'job_url'].tolist())
+
+    print(f"Rated {position} of {len(candidates)} new candidates for user {user_id} with {evaluations} evaluations, "
+          f"{good_jobs} jobs over 50 today")
+    queue_evaluation_cursor(user_id, evaluated_urls[-EARLY_STOP_CURSOR_MAX_URLS:], good_jobs, today)
+
+    return pd.concat(rated_chunks) if rated_chunks else candidates.iloc[0:0]
+
+
 def get_job_ratings(original_df, db_user, user_configs):
     jobs_df = original_df.copy()
     db_job_titles = [config['string_value'] for config in user_configs if config['key'] == 'job_titles']
     db_skill_words = [config['string_value'] for config in user_configs if config['key'] == 'skill_words']
     db_stop_words = [config['string_value'] for config in user_configs if config['key'] == 'stop_words']
-    db_resume = db_user.get('resume')
 
     job_titles = db_job_titles or []
     skill_words = db_skill_words or []
     stop_words = db_stop_words or []
 
-    resume = consolidate_text(db_resume)
+    resume = get_resume_for_prompt(db_user)
 
     for index, row in jobs_df.iterrows():
         job_title = row.get('title', "N/A")
         job_description = row.get('description', "N/A")
-        job_description = consolidate_text(job_description)
-
-        full_message = f"<job_titles>{', '.join(job_titles)}</job_titles>\n" + \
-                       f"<desired_words>{', '.join(skill_words)}</desired_words>\n" + \
-                       f"<undesirable_words>{', '.join(stop_words)}</undesirable_words>\n" + \
-                       f"<resume>{resume}</resume>\n" + \
-                       f"<job_title>{job_title}</job_title>\n" + \
-                       f"<job_description>{job_description}</job_description>\n" + \
-                       """
-                       Given the job titles (job_titles tag), desired words (desired_words tag), undesired words 
-                       (undesirable_words tag), resume (resume tag), job title (job_title tag) and job description 
-                       (job_description tag), make the following ratings:
-                       
-                       1) How the candidate would rate this job on a scale from 1 to 100 in terms of how well it 
-                       matches their experience and the type of job they desire.
-                       2) How the candidate would rate this job on a scale from 1 to 100 as a match for their 
-                       experience level (they aren't underqualified or overqualified).
-                       3) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how 
-                       well the candidate meets the skill requirements for this job.
-                       4) How a hiring manager for this job would rate the candidate on a scale from 1 to 100 on how 
-                       well the candidate meets the experience requirements for this job.
-                       5) Consider the results from steps 1 through 5 then give a final assessment from 1 to 100,
-                       where 1 is very little chance of this being a good match for the candidate and hiring manager, 
-                       and 100 being a perfect match where the candidate will have a great chance to succeed in 
-                       this role.
-                       
-                       For experience level, look for cues in the jobs description that list years of experience, 
-                       then compare that to the level of experience you believe the candidate to have (make an 
-                       assessment based on year in directly applicable fields of work).
-                       
-                       Start your answer immediately with a bulleted list as shown in the example below. Always include 
-                       the left side prefix from the template below in your answer (including for the explanation). 
-                       Address the candidate directly, closely following the template set in the example. NN should be 
-                       replaced in the template with a 2 digit number each time.
-                       """
-        full_message = consolidate_text(full_message)
-        full_message += \
-            """
-            - Candidate desire match: NN
-            - Candidate experience match: NN
-            - Hiring manager skill match: NN
-            - Hiring manager experience match: NN
-            - Final overall match assessment: NN
-            - Explanation of ratings: 
-            You may <like, be lukewarm on, or dislike> this job because of the following reasons: <reasons in one sentence>. The hiring manager may think you would be a <good, reasonable, or bad> fit for this job because of <reasons, in one sentence>. Overall, I think <your overall thoughts about the match between the user and the job in one sentence>.
-            """
-
-        ratings = query_llm(model_name=MODEL_FAST,
-                            system="You are a helpful no-nonsense assistant. You listen to directions carefully and follow them to the letter.",
-                            messages=[{"role": "user", "content": full_message}])
+        job_description = compact_job_description(job_description, label=f"{job_title} at {row.get('company', 'N/A')}")
+
+        ratings = rate_job(job_title, job_description, resume, job_titles, skill_words, stop_words)
 
         if ratings is None:
             print("LLM failed to generate ratings.")
             continue
 
-        print(f"Ratings for job {index}: {ratings}")
-
-        guidance_split = ratings.split("Explanation of ratings:")
-        if len(guidance_split) == 2:
-            guidance = guidance_split[1].strip()
-        else:
-            guidance = ""
-
-        ratings = ratings.split("\n")
-
-        if len(ratings) >= 6:
-            desire_score_split = ratings[0].split(":")
-            if len(desire_score_split) == 2:
-                desire_score = desire_score_split[1].strip()
-                jobs_df.at[index, 'desire_score'] = desire_score
-            else:
-                print("Error: Unable to split desire score.")
-
-            experience_score_split = ratings[1].split(":")
-            if len(experience_score_split) == 2:
-                experience_score = experience_score_split[1].strip()
-                jobs_df.at[index, 'experience_score'] = experience_score
-            else:
-                print("Error: Unable to split experience score.")
-
-            meets_requirements_score_split = ratings[2].split(":")
-            if len(meets_requirements_score_split) == 2:
-                meets_requirements_score = meets_requirements_score_split[1].strip()
-                jobs_df.at[index, 'meets_requirements_score'] = meets_requirements_score
-            else:
-                print("Error: Unable to split meets requirements score.")
-
-            meets_experience_score_split = ratings[3].split(":")
-            if len(meets_experience_score_split) == 2:
-                meets_experience_score = meets_experience_score_split[1].strip()
-                jobs_df.at[index, 'meets_experience_score'] = meets_experience_score
-            else:
-                print("Error: Unable to split meets experience score.")
-
-            overall_job_score_split = ratings[4].split(":")
-            if len(overall_job_score_split) == 2:
-                overall_job_score = overall_job_score_split[1].strip()
-                print(
-                    f"{index}: Adding a rating to: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}: {overall_job_score}")
-                jobs_df.at[index, 'job_score'] = overall_job_score
-            else:
-                print("Error: Unable to split overall job score.")
-
-            if len(guidance) > 0:
-                print(
-                    f"{index}: Adding guidance to: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}: {guidance}")
-                jobs_df.at[index, 'guidance'] = guidance
-        else:
-            print("Error: Ratings list does not have enough elements.")
+        print(f"Ratings for job {index}: {ratings.model_dump_json()}")
+        jobs_df.at[index, 'desire_score'] = ratings.desire_score
+        jobs_df.at[index, 'experience_score'] = ratings.experience_score
+        jobs_df.at[index, 'meets_requirements_score'] = ratings.meets_requirements_score
+        jobs_df.at[index, 'meets_experience_score'] = ratings.meets_experience_score
+        print(f"{index}: Adding a rating to: {row.get('title', 'N/A')} at {row.get('company', 'N/A')}: "
+              f"{ratings.overall_score}")
+        jobs_df.at[index, 'job_score'] = ratings.overall_score
+        jobs_df.at[index, 'guidance'] = ratings.guidance
 
     jobs_over_50 = jobs_df[jobs_df['job_score'].astype(float) > 50]
 
@@ -272,7 +364,7 @@ def get_jobs_for_user(db_user, job_titles):
     if SMALL_RUN:
         results_wanted = min(results_wanted, 2)
     scraped_data = scrape_job_data(
-        user_id,
+        db_user.get('id'),
         job_titles,
         job_sites=['indeed', 'zip_recruiter', 'glassdoor', 'linkedin', 'google'],
         location=db_location,
@@ -286,10 +378,10 @@ def get_jobs_for_user(db_user, job_titles):
     return scraped_data
 
 
-def clean_up_jobs(jobs_df, user_configs):
+def clean_up_jobs(jobs_df, db_user, user_configs):
     db_stop_words = [config['string_value'] for config in user_configs if config['key'] == 'stop_words']
     db_go_words = [config['string_value'] for config in user_configs if config['key'] == 'go_words']
-    db_candidate_min_salary = user.get('min_salary')
+    db_candidate_min_salary = db_user.get('min_salary')
 
     stop_words = db_stop_words or []
     go_words = db_go_words or []
@@ -300,35 +392,188 @@ def clean_up_jobs(jobs_df, user_configs):
     return results_df
 
 
+DERIVED_DATA_QUESTIONS = [('short_summary',
+                           'Provide a short summary of the job.  If the job is fully remote, start with'
+                           ' the sentence "Fully remote! ", otherwise skip this step.  Then, after a'
+                           ' newline, include a single sentence related to the compensation.'
+                           ' Start this sentence with the words "Pay for this role is "'
+                           ' OR simply state "Pay was not specified. "'
+                           ' Next have a newline, then a single'
+                           ' sentence with the minimum number of years experience.  Include the type of'
+                           ' experience being looked for. Next have a newline, followed by key job'
+                           ' responsibilities (no more than 3 sentences).  Finally, have a newline and'
+                           ' follow with job benefits (no more than 3 sentences)'
+                           ),
+                          ('hard_requirements',
+                           'Summarize the hard requirements, things the candidate "must have" from the'
+                           ' description.  Start the list with the number of years experience,'
+                           ' if specified.  Limit this list to 4 bullet points of no more than 1 sentence'
+                           ' each')
+                          ]
+
+
 def get_jobs_with_derived(db_user, jobs_df, job_titles, user_configs):
-    db_resume = db_user.get('resume')
-    resume = db_resume
-
-    derived_data_questions = [('short_summary',
-                               'Provide a short summary of the job.  If the job is fully remote, start with'
-                               ' the sentence "Fully remote! ", otherwise skip this step.  Then, after a'
-                               ' newline, include a single sentence related to the compensation.'
-                               ' Start this sentence with the words "Pay for this role is "'
-                               ' OR simply state "Pay was not specified. "'
-                               ' Next have a newline, then a single'
-                               ' sentence with the minimum number of years experience.  Include the type of'
-                               ' experience being looked for. Next have a newline, followed by key job'
-                               ' responsibilities (no more than 3 sentences).  Finally, have a newline and'
-                               ' follow with job benefits (no more than 3 sentences)'
-                               ),
-                              ('hard_requirements',
-                               'Summarize the hard requirements, things the candidate "must have" from the'
-                               ' description.  Start the list with the number of years experience,'
-                               ' if specified.  Limit this list to 4 bullet points of no more than 1 sentence'
-                               ' each')
-                              ]
-
-    rated_jobs = get_job_ratings2(jobs_df, db_user, user_configs)
-    todays_jobs = add_derived_data(rated_jobs, derived_data_questions, resume=resume)
+    resume = get_resume_for_prompt(db_user)
+
+    if EARLY_STOP_MODE:
+        rated_jobs = stream_job_ratings(jobs_df, db_user, user_configs)
+    else:
+        rated_jobs = get_job_ratings2(jobs_df, db_user, user_configs)
+    if DERIVED_DATA_MODE != 'eager':
+        # Summaries and hard requirements are generated when a job is first shown, see derived_data.py
+        return rated_jobs
+
+    with metering_context(stage='derived_data', user_id=db_user.get('id')):
+        todays_jobs = add_derived_data(rated_jobs, DERIVED_DATA_QUESTIONS, resume=resume)
 
     return todays_jobs
 
 
+def find_top_jobs_for_user(user_context):
+    """Scrape, clean and rank jobs for a user. Returns (configs, best_titles, top_jobs) or None."""
+    user = user_context['user']
+    user_id = user.get('id')
+    if len(user.get('resume')) < 100:
+        print("Resume is too short, skipping.")
+        return None
+
+    best_titles = find_best_job_titles_for_user(user, user_context['configs'])
+    if not user_context['job_titles'] and best_titles:
+        # find_best_job_titles_for_user saved the titles it generated
+        add_config_values(user_context, 'job_titles', best_titles)
+    configs = user_context['configs']
+    all_jobs = get_jobs_for_user(user, best_titles)
+
+    print(f"Found {len(all_jobs)} jobs for user {user_id}")
+
+    # TODO: Find a way to add all jobs to DB without adding short summary and hard_requirements upon initial insert
+    # for index, row in all_jobs.iterrows():
+    #     create_new_job_if_not_exists(row)
+    # print("Jobs added to supabase")
+
+    # Now, try to find some good jobs for this user
+    cleaned_jobs = clean_up_jobs(all_jobs, user, configs)
+    if len(cleaned_jobs) == 0:
+        print("No jobs found, trying the next user.")
+        time.sleep(15)
+        return None
+
+    # With early stop, rank a longer list and let stream_job_ratings decide how far down it goes
+    top_n = EARLY_STOP_CANDIDATES if EARLY_STOP_MODE else 10
+    top_matches = find_top_job_matches(user.get('resume'), cleaned_jobs, top_n=top_n)
+
+    # Keep the matches in descending similarity order
+    top_jobs = cleaned_jobs.loc[top_matches['job_id'].tolist()]
+    return configs, best_titles, top_jobs
+
+
+def build_evaluation_batch(user_runs):
+    """
+    The evaluation requests for every user run, one per planned batch of jobs (or per job outside batch mode),
+    as a dict of custom_id -> request, and a dict of custom_id -> (run number, jobs) to read the results back.
+    """
+    evaluation_requests = {}
+    evaluation_jobs = {}
+    for run_number, user_run in enumerate(user_runs):
+        inputs = user_run['rating_inputs']
+        if EVAL_BATCH_MODE:
+            fixed_tokens = count_tokens(create_batch_evaluation_prompt([], inputs['resume'], inputs['job_titles'],
+                                                                       inputs['skill_words'], inputs['stop_words']))
+            job_groups = plan_evaluation_batches(user_run['pending_jobs'], fixed_tokens)
+        else:
+            job_groups = [[job] for job in user_run['pending_jobs']]
+
+        for group_number, jobs in enumerate(job_groups):
+            custom_id = f"eval|{run_number}|{group_number}"
+            evaluation_jobs[custom_id] = (run_number, jobs)
+            if len(jobs) > 1:
+                evaluation_requests[custom_id] = build_batch_evaluation_request(
+                    jobs, inputs['resume'], inputs['job_titles'], inputs['skill_words'], inputs['stop_words'])
+            else:
+                evaluation_requests[custom_id] = build_evaluation_request(
+                    jobs[0]['title'], jobs[0]['description'], inputs['resume'], inputs['job_titles'],
+                    inputs['skill_words'], inputs['stop_words'], known_answers=jobs[0].get('known_answers'))
+
+    return evaluation_requests, evaluation_jobs
+
+
+def parse_evaluation_batch(results, evaluation_jobs, run_count):
+    """
+    Assessments per run number, as a dict of job_id -> assessment, from the batch results. Jobs whose result is
+    missing or fails to parse are left out, so apply_job_ratings evaluates them synchronously.
+    """
+    assessments_by_run = {run_number: {} for run_number in range(run_count)}
+    for custom_id, content in results.items():
+        run_number, jobs = evaluation_jobs[custom_id]
+        try:
+            if len(jobs) > 1:
+                assessments_by_run[run_number].update(parse_batch_evaluation(content, jobs))
+            else:
+                assessments_by_run[run_number][jobs[0]['job_id']] = parse_evaluation_response(
+                    content, known_answers=jobs[0].get('known_answers'))
+        except Exception as e:
+            print(f"Unable to parse batch result {custom_id}, will evaluate synchronously: {e}")
+
+    return assessments_by_run
+
+
+def run_offline_batch(eligible_users, user_contexts):
+    """
+    Runs the nightly evaluation through the provider's batch endpoint instead of synchronous calls. All users
+    are scraped first, then their evaluations go out as one batch and the derived data for jobs over 50 as a
+    second batch. Anything the batch doesn't return falls back to the normal synchronous path.
+    """
+    user_runs = []
+    for user in eligible_users:
+        print(f"Processing user: {user.get('id')} ({user.get('name')})")
+        top_jobs = find_top_jobs_for_user(user_contexts[user.get('id')])
+        if top_jobs is None:
+            continue
+
+        configs, best_titles, top_10_jobs = top_jobs
+        # The offline batch doesn't stream, so it evaluates up to the per-user budget in one go
+        jobs_df = top_10_jobs.head(EARLY_STOP_MAX_EVALUATIONS if EARLY_STOP_MODE else 10).copy()
+        rating_inputs = get_rating_inputs(user, configs)
+        user_runs.append({
+            'user': user,
+            'jobs_df': jobs_df,
+            'rating_inputs': rating_inputs,
+            'pending_jobs': screen_pending_jobs(jobs_df, get_jobs_to_rate(jobs_df, rating_inputs),
+                                                rating_inputs)
+        })
+
+    evaluation_requests, evaluation_jobs = build_evaluation_batch(user_runs)
+    assessments_by_run = parse_evaluation_batch(run_batch(evaluation_requests, "job evaluations"), evaluation_jobs,
+                                                len(user_runs))
+
+    for run_number, user_run in enumerate(user_runs):
+        user_run['rated_jobs'] = apply_job_ratings(user_run['jobs_df'], user_run['pending_jobs'],
+                                                   assessments_by_run[run_number], user_run['rating_inputs'])
+
+    # Derived data for the jobs that scored over 50
+    derived_requests = {}
+    for run_number, user_run in enumerate(user_runs):
+        for index, row in user_run['rated_jobs'].iterrows():
+            for column_name, question in DERIVED_DATA_QUESTIONS:
+                derived_requests[f"derived|{run_number}|{index}|{column_name}"] = build_derived_data_request(
+                    question, build_job_context(row), user_run['rating_inputs']['resume'])
+
+    derived_results = run_batch(derived_requests, "derived data")
+
+    for run_number, user_run in enumerate(user_runs):
+        rated_jobs = user_run['rated_jobs']
+        derived_data = pd.DataFrame(index=rated_jobs.index)
+        for index, row in rated_jobs.iterrows():
+            for column_name, question in DERIVED_DATA_QUESTIONS:
+                answer = derived_results.get(f"derived|{run_number}|{index}|{column_name}")
+                if answer is None:
+                    answer = ask_chatgpt_about_job(question, build_job_context(row), user_run['rating_inputs']['resume'])
+                derived_data.at[index, column_name] = answer
+
+        jobs_with_derived = pd.concat([derived_data, rated_jobs], axis=1)
+        save_jobs_to_supabase(user_run['user'].get('id'), jobs_with_derived)
+
+
 def find_titles_by_similarity(target_title, job_list, similarity_threshold=0.9):
     if len(job_list) == 0:
         print("No jobs to compare, skipping...")
@@ -378,7 +623,7 @@ def find_titles_by_similarity(target_title, job_list, similarity_threshold=0.9):
     return matching_jobs[:5]
 
 
-def find_existing_jobs_for_users(users):
+def find_existing_jobs_for_users(users, user_contexts=None):
     # Get all recent job and their title (id, title)
     recent_jobs = get_recent_jobs(days_old=2)
     print(f"Found {len(recent_jobs)} recent jobs")
@@ -387,54 +632,91 @@ def find_existing_jobs_for_users(users):
         print("No recent jobs found, skipping...")
         return None
 
-    for user in users:
-        user_job_matches = get_user_job_matches(user.get('id'))
-        user_job_ids = {match['job_id'] for match in user_job_matches}
+    # Collect the (user, job) pairs that need an evaluation, grouped by job so a popular job's description is
+    # only sent once for all of the users it matched
+    # Recommendations saved earlier in the run count as existing ones
+    if user_contexts is None:
+        user_contexts = load_user_contexts(users)
+    else:
+        refresh_job_ids(user_contexts)
 
+    # Title matches for every user first, so the matched jobs can be read in one bulk query
+    matches_by_user = {}
+    for user in users:
         user_id = user.get('id')
-        configs = get_user_configs(user_id)
-        db_job_titles = [config['string_value'] for config in configs if config['key'] == 'job_titles']
-        user_titles = db_job_titles or []
+        user_context = user_contexts[user_id]
+        non_matching_jobs = [job for job in recent_jobs if not has_recommendation(user_context, job[0])]
 
-        matched_jobs = []
-        for title in user_titles:
-            non_matching_jobs = [job for job in recent_jobs if job[0] not in user_job_ids]
+        matched_job_ids = matches_by_user.setdefault(user_id, {})
+        for title in user_context['job_titles']:
             # Find jobs that are similar by title
             similarity_threshold = 0.6
             matching_jobs = find_titles_by_similarity(title, non_matching_jobs,
                                                       similarity_threshold=similarity_threshold)
             print(f"Found {len(matching_jobs)} matching jobs for user {user_id} based on title similar "
                   f"({similarity_threshold}) to title {title}")
-            for job in matching_jobs:
-                if user_has_recommendation(user_id, job[0]):
+            matched_job_ids.update(dict.fromkeys(job[0] for job in matching_jobs))
+
+    # JOB_COLUMNS covers the checks, the guidance prompt and derived data
+    jobs_by_id = {job['id']: job for job in get_jobs_by_ids(
+        {job_id for job_ids in matches_by_user.values() for job_id in job_ids}, columns=JOB_COLUMNS)}
+
+    pending_by_job = {}
+    for user_id, matched_job_ids in matches_by_user.items():
+        user_context = user_contexts[user_id]
+        user = user_context['user']
+        user_configs = user_context['configs']
+        for job_id in matched_job_ids:
+            job = jobs_by_id.get(job_id)
+            if job is None:
+                print(f"Job {job_id} not found, skipping...")
+                continue
+
+            if not job_meets_salary_requirements(user, job):
+                print(f"Job with URL {job_id} does not meet salary requirements for user {user_id}, skipping...")
+                continue
+
+            if job_matches_stop_words(user_configs, job):
+                print(f"Job with URL {job_id} matches stop words for user {user_id}, skipping...")
+                continue
+
+            # Only jobs that survive the checks above get derived data, and only when it's made eagerly
+            if DERIVED_DATA_MODE == 'eager' and needs_derived_data(job):
+                materialize_job(job)
+
+            pending_by_job.setdefault(job_id, []).append((user, user_configs))
+            user_context['job_ids'].add(job_id)
+
+    matched_jobs = []
+    for job_id, candidates in pending_by_job.items():
+        job = jobs_by_id[job_id]
+
+        ratings_by_user = {}
+        if EVAL_MULTI_USER_MODE and len(candidates) > 1:
+            try:
+                with metering_context(stage='guidance', job_id=job_id):
+                    ratings_by_user = get_job_guidance_for_users(candidates, job)
+            except BudgetExceeded as e:
+                print(f"{e}, no more jobs rated this run")
+                break
+
+        for user, user_configs in candidates:
+            user_id = user.get('id')
+            ratings = ratings_by_user.get(str(user_id))
+            if ratings is None:
+                try:
+                    with metering_context(stage='guidance', user_id=user_id, job_id=job_id):
+                        ratings = get_job_guidance_for_user(user, user_configs, job)
+                except BudgetExceeded as e:
+                    print(f"{e}, skipping job {job_id} for user {user_id}")
                     continue
-                else:
-                    job_id = job[0]
-                    job = get_job_by_id(job_id)
-
-                    # Confirm the job has a short_summary, hard_requirements
-                    if job.get('short_summary') is None or job.get('hard_requirements') is None:
-                        derived_data = get_derived_data_for_job(job)
-                        job['short_summary'] = derived_data.get('short_summary')
-                        job['hard_requirements'] = derived_data.get('hard_requirements')
-                        update_job_in_supabase(job)
-
-                    user = get_user_by_id(user_id)
-                    user_configs = get_user_configs(user_id)
-
-                    if not job_meets_salary_requirements(user, job):
-                        print(
-                            f"Job with URL {job_id} does not meet salary requirements for user {user_id}, skipping...")
-                        continue
-
-                    if job_matches_stop_words(user_configs, job):
-                        print(f"Job with URL {job_id} matches stop words for user {user_id}, skipping...")
-                        continue
 
-                    ratings = get_job_guidance_for_user(user, user_configs, job)
+            if ratings is None:
+                print(f"Unable to rate job {job_id} for user {user_id}, skipping...")
+                continue
 
-                    add_user_job_association(user_id, job_id, ratings)
-                    user_job_ids.add(job_id)
+            queue_user_job_association(user_id, job_id, ratings)
+            matched_jobs.append((user_id, job_id))
 
     return matched_jobs
 
@@ -477,51 +759,47 @@ if __name__ == '__main__':
     eligible_users = get_active_users_with_resume()
     if SMALL_RUN:
         eligible_users = eligible_users[:1]
+    user_contexts = load_user_contexts(eligible_users)
 
-    for user in eligible_users:
-        user_id = user.get('id')
-        print(f"Processing user: {user_id} ({user.get('name')})")
-
-        # if user_id != '7d4cdc06-7929-453d-9ab0-88a5901a22fd':
-        #     continue
-
-        if len(user.get('resume')) < 100:
-            print("Resume is too short, skipping.")
-            continue
-
-        configs = get_user_configs(user_id)
-        best_titles = find_best_job_titles_for_user(user, configs)
-        all_jobs = get_jobs_for_user(user, best_titles)
-
-        print(f"Found {len(all_jobs)} jobs for user {user_id}")
+    if OFFLINE_BATCH_MODE and not SMALL_RUN:
+        run_offline_batch(eligible_users, user_contexts)
+    else:
+        for user in eligible_users:
+            user_id = user.get('id')
+            print(f"Processing user: {user_id} ({user.get('name')})")
 
-        # TODO: Find a way to add all jobs to DB without adding short summary and hard_requirements upon initial insert
-        # for index, row in all_jobs.iterrows():
-        #     create_new_job_if_not_exists(row)
-        # print("Jobs added to supabase")
+            # if user_id != '7d4cdc06-7929-453d-9ab0-88a5901a22fd':
+            #     continue
 
-        # Now, try to find some good jobs for this user
-        cleaned_jobs = clean_up_jobs(all_jobs, configs)
-        if len(cleaned_jobs) == 0:
-            print("No jobs found, trying the next user.")
-            time.sleep(15)
-            continue
+            top_jobs = find_top_jobs_for_user(user_contexts[user_id])
+            if top_jobs is None:
+                continue
 
-        top_10_matches = find_top_job_matches(user.get('resume'), cleaned_jobs)
-        top_10_match_urls = top_10_matches['job_url'].tolist()
+            configs, best_titles, top_10_jobs = top_jobs
+            jobs_with_derived = get_jobs_with_derived(user, top_10_jobs, best_titles, configs)
 
-        top_10_jobs = cleaned_jobs[cleaned_jobs['job_url'].isin(top_10_match_urls)]
-        jobs_with_derived = get_jobs_with_derived(user, top_10_jobs, best_titles, configs)
+            save_jobs_to_supabase(user_id, jobs_with_derived)
 
-        save_jobs_to_supabase(user_id, jobs_with_derived)
-
-        # for index, row in jobs_with_derived.iterrows():
-        #     update_job_in_supabase(row)  # Add the derived data
-        #     add_user_job_association(user_id, row.get('id'))
+    print_reuse_report()
+    print_prescore_report()
+    print_cascade_report()
+    print_retry_report()
+    print_routing_report()
 
     if not SMALL_RUN:
-        find_existing_jobs_for_users(eligible_users)
+        find_existing_jobs_for_users(eligible_users, user_contexts)
+        # The digests read the recommendations queued above
+        flush_writes()
         send_email_updates()
+        if DERIVED_DATA_MODE != 'eager':
+            fill_derived_data()
+        print_derived_data_report()
     else:
         print("=== SMALL RUN: skipping existing job matching and email ===")
 
+    # Covers the whole run, including existing job matching and the derived data fill
+    print_usage_report()
+    print_job_cache_report()
+    flush_writes()
+    print_write_behind_report()
+
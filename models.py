@@ -1,4 +1,6 @@
 # models.py
+from typing import List
+
 from pydantic import BaseModel
 
 
@@ -31,3 +33,52 @@ class JobAssessment(BaseModel):
     desire_reason: str
     requirements_reason: str
     guidance_text: str
+
+
+class BatchJobAssessment(JobAssessment):
+    job_id: str
+
+
+class JobAssessmentBatch(BaseModel):
+    assessments: List[BatchJobAssessment]
+
+
+class JobRatings(BaseModel):
+    desire_score: int
+    experience_score: int
+    meets_requirements_score: int
+    meets_experience_score: int
+    overall_score: int
+    guidance: str
+
+
+class UserJobRatings(JobRatings):
+    user_id: str
+
+
+class JobRatingsForUsers(BaseModel):
+    ratings: List[UserJobRatings]
+
+
+class DomainExperience(BaseModel):
+    domain: str
+    years: float
+
+
+class ResumeProfile(BaseModel):
+    total_years_experience: float
+    years_by_domain: List[DomainExperience]
+    skills: List[str]
+    seniority: str
+    education: List[str]
+    recent_titles: List[str]
+    summary: str
+
+
+class JobScreen(BaseModel):
+    job_id: str
+    fit_score: int
+
+
+class JobScreenBatch(BaseModel):
+    screens: List[JobScreen]
@@ -1,11 +1,36 @@
+import functools
 import os
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client
 from supabase.lib.client_options import ClientOptions
+from postgrest.types import CountMethod, ReturnMethod
 import pandas as pd
 from datetime import datetime, timedelta
 
+from job_cache import JobCache, canonical_url, parse_columns, with_key_columns
+
+load_dotenv(dotenv_path=Path('.') / '.env')
+
+# supabase (default) goes through PostgREST, postgres connects directly with a pool, sqlite uses a local file
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'supabase').lower()
+STORAGE_DATABASE_URL = os.getenv('STORAGE_DATABASE_URL')
+STORAGE_SQLITE_PATH = os.getenv('STORAGE_SQLITE_PATH', 'jobs.sqlite3')
+STORAGE_POOL_SIZE = int(os.getenv('STORAGE_POOL_SIZE', '5'))
+STORAGE_JOB_CACHE_SIZE = int(os.getenv('STORAGE_JOB_CACHE_SIZE', '5000'))
+# Writes made during evaluation are queued and flushed in batches by a background thread, see write_behind.py
+STORAGE_WRITE_BEHIND = os.getenv('STORAGE_WRITE_BEHIND', 'true').lower() == 'true'
+STORAGE_WRITE_BATCH_SIZE = int(os.getenv('STORAGE_WRITE_BATCH_SIZE', '50'))
+STORAGE_WRITE_FLUSH_SECONDS = float(os.getenv('STORAGE_WRITE_FLUSH_SECONDS', '2'))
+STORAGE_WRITE_QUEUE_SIZE = int(os.getenv('STORAGE_WRITE_QUEUE_SIZE', '1000'))
+STORAGE_WRITE_SPILL_FILE = os.getenv('STORAGE_WRITE_SPILL_FILE', 'pending_writes.jsonl')
+
+_supabase_client = None
+_sql_storage = None
+_client_lock = threading.Lock()
+job_cache = JobCache(STORAGE_JOB_CACHE_SIZE)
+
 
 def convert_to_int(value):
     try:
@@ -14,6 +39,14 @@ def convert_to_int(value):
         return None
 
 
+def none_if_missing(value):
+    """DataFrame cells for columns a row never filled in come back as NaN, which isn't valid JSON."""
+    try:
+        return None if pd.isna(value) else value
+    except (TypeError, ValueError):
+        return value
+
+
 def convert_to_date(value):
     try:
         if pd.isna(value) or value in ['NaT', '']:
@@ -24,21 +57,46 @@ def convert_to_date(value):
 
 
 def get_supabase_client():
-    # Load environment variables
-    env_path = Path('.') / '.env'
-    load_dotenv(dotenv_path=env_path)
+    """The process's Supabase client, created on first use so every call shares its HTTP connection pool."""
+    global _supabase_client
+    if _supabase_client is None:
+        with _client_lock:
+            if _supabase_client is None:
+                opts = ClientOptions().replace(schema="jobscraper")
+                _supabase_client = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'), options=opts)
+
+    return _supabase_client
+
+
+def get_sql_storage():
+    """The process's SqlStorage for STORAGE_BACKEND postgres or sqlite, None for supabase."""
+    global _sql_storage
+    if STORAGE_BACKEND == 'supabase':
+        return None
+    if _sql_storage is None:
+        with _client_lock:
+            if _sql_storage is None:
+                # storage_backends builds its rows with the helpers in this module
+                from storage_backends import create_sql_storage
+                _sql_storage = create_sql_storage(STORAGE_BACKEND, STORAGE_DATABASE_URL, STORAGE_SQLITE_PATH,
+                                                  STORAGE_POOL_SIZE)
+
+    return _sql_storage
 
-    # Get Supabase URL and key from environment variables
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
 
-    # Initialize Supabase client
-    opts = ClientOptions().replace(schema="jobscraper")
-    supabase: Client = create_client(supabase_url, supabase_key, options=opts)
+def storage_function(function):
+    """Routes the call to the SqlStorage method of the same name when STORAGE_BACKEND isn't supabase."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        storage = get_sql_storage()
+        if storage is None:
+            return function(*args, **kwargs)
+        return getattr(storage, function.__name__)(*args, **kwargs)
 
-    return supabase
+    return wrapper
 
 
+@storage_function
 def save_titles_for_user(user_id, titles):
     supabase = get_supabase_client()
 
@@ -54,6 +112,7 @@ def save_titles_for_user(user_id, titles):
         return None
 
 
+@storage_function
 def get_user_by_id(user_id):
     supabase = get_supabase_client()
     response = (supabase.table('users')
@@ -69,19 +128,49 @@ def get_user_by_id(user_id):
 
 
 def get_job_by_id(job_id):
-    supabase = get_supabase_client()
-    response = (supabase.table('jobs')
-                .select('*')
-                .eq('id', job_id)
-                .execute())
-
-    if response.data:
-        return response.data[0]
+    """The full job row, read from storage at most once per process."""
+    jobs = get_jobs_by_ids([job_id], columns='*')
+    if jobs:
+        return jobs[0]
     else:
-        print(f"Error fetching job: {response.error}")
+        print(f"Error fetching job: {job_id} not found")
         return None
 
 
+def get_job_by_url(url, columns='*'):
+    """The job stored under the URL, from job_cache when it was already read."""
+    job = job_cache.get_by_url(url, parse_columns(columns))
+    if job is None:
+        job_columns, with_description = split_description(columns)
+        jobs = fetch_jobs_by_urls([url], columns=job_columns)
+        if not jobs:
+            return None
+        job = attach_descriptions(jobs)[0] if with_description else jobs[0]
+        job_cache.put(job, complete=parse_columns(columns) is None)
+
+    return job
+
+
+def split_description(columns):
+    """
+    Descriptions live in job_descriptions, not jobs. Returns the select list for the jobs table and whether the
+    description was asked for, '*' asks for it.
+    """
+    wanted = parse_columns(columns)
+    if wanted is None:
+        return '*', True
+    names = [column.strip() for column in columns.split(',') if column.strip() not in ('', 'description')]
+    return with_key_columns(', '.join(names)), 'description' in wanted
+
+
+def attach_descriptions(jobs):
+    descriptions = {row['job_id']: row['description'] for row in fetch_job_descriptions([job['id'] for job in jobs])}
+    for job in jobs:
+        job['description'] = descriptions.get(job['id'])
+    return jobs
+
+
+@storage_function
 def get_user_configs(user_id):
     supabase = get_supabase_client()
     response = (supabase.table('user_configs')
@@ -96,6 +185,51 @@ def get_user_configs(user_id):
         return {}
 
 
+@storage_function
+def get_configs_for_users(user_ids, chunk_size=100, page_size=1000):
+    """Every user_configs row for the users, a chunk of users per query, paged after the last config ID."""
+    supabase = get_supabase_client()
+    user_ids = list(user_ids)
+    configs = []
+    for start in range(0, len(user_ids), chunk_size):
+        last_id = None
+        while True:
+            query = supabase.table('user_configs').select('*').in_('user_id', user_ids[start:start + chunk_size])
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            response = query.order('id').limit(page_size).execute()
+            configs.extend(response.data or [])
+            if not response.data or len(response.data) < page_size:
+                break
+            last_id = response.data[-1]['id']
+
+    return configs
+
+
+@storage_function
+def get_job_ids_for_users(user_ids, chunk_size=100, page_size=1000):
+    """Every (user_id, job_id) pair in users_jobs for the users, paged after the last pair."""
+    supabase = get_supabase_client()
+    user_ids = list(user_ids)
+    pairs = []
+    for start in range(0, len(user_ids), chunk_size):
+        last_pair = None
+        while True:
+            query = supabase.table('users_jobs').select('user_id, job_id').in_('user_id',
+                                                                                user_ids[start:start + chunk_size])
+            if last_pair is not None:
+                query = query.or_(f"user_id.gt.{last_pair[0]},"
+                                  f"and(user_id.eq.{last_pair[0]},job_id.gt.{last_pair[1]})")
+            response = query.order('user_id').order('job_id').limit(page_size).execute()
+            pairs.extend(response.data or [])
+            if not response.data or len(response.data) < page_size:
+                break
+            last_pair = (response.data[-1]['user_id'], response.data[-1]['job_id'])
+
+    return pairs
+
+
+@storage_function
 def get_user_job_matches(user_id):
     supabase = get_supabase_client()
     response = (supabase.table('users_jobs')
@@ -110,6 +244,263 @@ def get_user_job_matches(user_id):
         return None
 
 
+@storage_function
+def get_resume_profile(resume_hash):
+    supabase = get_supabase_client()
+    response = (supabase.table('resume_profiles')
+                .select('profile')
+                .eq('resume_hash', resume_hash)
+                .execute())
+
+    if response.data:
+        return response.data[0]['profile']
+    else:
+        return None
+
+
+@storage_function
+def save_resume_profile(resume_hash, profile):
+    supabase = get_supabase_client()
+    try:
+        response = (supabase.table('resume_profiles')
+                    .upsert({'resume_hash': resume_hash, 'profile': profile})
+                    .execute())
+        if response.data:
+            print(f"Saved resume profile {resume_hash[:12]}")
+        else:
+            print(f"Error saving resume profile: {response.error}")
+    except Exception as e:
+        print(f"Error saving resume profile: {e}")
+        return None
+
+    return response
+
+
+@storage_function
+def get_scored_user_jobs(page_size=1000):
+    """
+    Every users_jobs row scored by an LLM evaluation, for training the pre-score model. Rows zeroed by stop words
+    or screening have no assessment_bits, so they are left out.
+    """
+    supabase = get_supabase_client()
+    rows = []
+    start = 0
+    while True:
+        response = (supabase.table('users_jobs')
+                    .select('user_id, job_id, score, interested')
+                    .not_.is_('score', 'null')
+                    .not_.is_('assessment_bits', 'null')
+                    .range(start, start + page_size - 1)
+                    .execute())
+        rows.extend(response.data or [])
+        if not response.data or len(response.data) < page_size:
+            break
+        start += page_size
+
+    return rows
+
+
+@storage_function
+def iter_user_job_assessments(page_size=1000):
+    """Pages of users_jobs rows that have a stored assessment bitmask, with their current scores."""
+    supabase = get_supabase_client()
+    start = 0
+    while True:
+        response = (supabase.table('users_jobs')
+                    .select('user_id, job_id, assessment_bits, desire_score, experience_score, '
+                            'meets_requirements_score, meets_experience_score, score')
+                    .not_.is_('assessment_bits', 'null')
+                    .order('user_id')
+                    .order('job_id')
+                    .range(start, start + page_size - 1)
+                    .execute())
+        if response.data:
+            yield response.data
+        if not response.data or len(response.data) < page_size:
+            break
+        start += page_size
+
+
+@storage_function
+def update_user_job_scores(rows, chunk_size=500):
+    """Bulk update of the score columns, rows are dicts with user_id, job_id and the new scores."""
+    supabase = get_supabase_client()
+    for start in range(0, len(rows), chunk_size):
+        try:
+            response = (supabase.table('users_jobs')
+                        .upsert(rows[start:start + chunk_size], on_conflict='user_id,job_id')
+                        .execute())
+            if not response.data:
+                print(f"Error updating user job scores: {response.error}")
+        except Exception as e:
+            print(f"Error updating user job scores: {e}")
+
+
+def get_jobs_by_ids(job_ids, columns='id, title, description', chunk_size=200):
+    """Rows with at least the columns asked for, from job_cache where it can and in bulk from storage otherwise."""
+    wanted = parse_columns(columns)
+    job_ids = list(dict.fromkeys(job_ids))
+    jobs_by_id = {}
+    missing = []
+    for job_id in job_ids:
+        job = job_cache.get(job_id, wanted)
+        if job is None:
+            missing.append(job_id)
+        else:
+            jobs_by_id[job_id] = job
+
+    if missing:
+        job_columns, with_description = split_description(columns)
+        jobs = fetch_jobs_by_ids(missing, columns=job_columns, chunk_size=chunk_size)
+        if with_description:
+            attach_descriptions(jobs)
+        for job in jobs:
+            job_cache.put(job, complete=wanted is None)
+            jobs_by_id[job['id']] = job
+
+    return [jobs_by_id[job_id] for job_id in job_ids if job_id in jobs_by_id]
+
+
+@storage_function
+def fetch_jobs_by_ids(job_ids, columns='id, title, description', chunk_size=200):
+    supabase = get_supabase_client()
+    job_ids = list(job_ids)
+    jobs = []
+    for start in range(0, len(job_ids), chunk_size):
+        response = (supabase.table('jobs')
+                    .select(columns)
+                    .in_('id', job_ids[start:start + chunk_size])
+                    .execute())
+        jobs.extend(response.data or [])
+
+    return jobs
+
+
+@storage_function
+def fetch_job_descriptions(job_ids, chunk_size=100):
+    supabase = get_supabase_client()
+    job_ids = list(job_ids)
+    descriptions = []
+    for start in range(0, len(job_ids), chunk_size):
+        response = (supabase.table('job_descriptions')
+                    .select('job_id, description')
+                    .in_('job_id', job_ids[start:start + chunk_size])
+                    .execute())
+        descriptions.extend(response.data or [])
+
+    return descriptions
+
+
+@storage_function
+def save_job_descriptions(rows, overwrite=False):
+    """
+    Stores job_descriptions rows (job_id, description). Existing descriptions are left alone unless overwrite.
+    Returns the number of rows sent, None on an error.
+    """
+    rows = [row for row in rows if row.get('description')]
+    if not rows:
+        return 0
+    supabase = get_supabase_client()
+    try:
+        (supabase.table('job_descriptions')
+         .upsert(rows, on_conflict='job_id', ignore_duplicates=not overwrite, returning=ReturnMethod.minimal)
+         .execute())
+    except Exception as e:
+        print(f"Error saving job descriptions: {e}")
+        return None
+
+    return len(rows)
+
+
+@storage_function
+def fetch_jobs_by_urls(urls, columns='id, url', chunk_size=100):
+    """Jobs stored under the URLs. The URLs are canonicalized first, the same way build_job_row stores them."""
+    supabase = get_supabase_client()
+    urls = list(dict.fromkeys(canonical_url(url) for url in urls))
+    jobs = []
+    for start in range(0, len(urls), chunk_size):
+        response = (supabase.table('jobs')
+                    .select(columns)
+                    .in_('url', urls[start:start + chunk_size])
+                    .execute())
+        jobs.extend(response.data or [])
+
+    return jobs
+
+
+@storage_function
+def get_evaluation_cursor(user_id):
+    supabase = get_supabase_client()
+    response = (supabase.table('evaluation_cursors')
+                .select('evaluated_urls, good_jobs_today, cursor_date, updated_at')
+                .eq('user_id', user_id)
+                .execute())
+
+    if response.data:
+        return response.data[0]
+    else:
+        return None
+
+
+@storage_function
+def save_evaluation_cursor(user_id, evaluated_urls, good_jobs_today, cursor_date):
+    supabase = get_supabase_client()
+    try:
+        response = (supabase.table('evaluation_cursors')
+                    .upsert({'user_id': user_id, 'evaluated_urls': evaluated_urls, 'good_jobs_today': good_jobs_today,
+                             'cursor_date': cursor_date, 'updated_at': datetime.now().isoformat()})
+                    .execute())
+        if not response.data:
+            print(f"Error saving evaluation cursor for user {user_id}: {response.error}")
+    except Exception as e:
+        print(f"Error saving evaluation cursor for user {user_id}: {e}")
+        return None
+
+    return response
+
+
+@storage_function
+def get_stored_evaluations(resume_hash, profile_hash, since, page_size=1000):
+    supabase = get_supabase_client()
+    rows = []
+    start = 0
+    while True:
+        response = (supabase.table('evaluation_store')
+                    .select('fingerprint, assessment')
+                    .eq('resume_hash', resume_hash)
+                    .eq('profile_hash', profile_hash)
+                    .gte('created_at', since)
+                    .range(start, start + page_size - 1)
+                    .execute())
+        rows.extend(response.data or [])
+        if not response.data or len(response.data) < page_size:
+            break
+        start += page_size
+
+    return rows
+
+
+def build_stored_evaluation_row(resume_hash, profile_hash, fingerprint, title, assessment):
+    return {'resume_hash': resume_hash, 'profile_hash': profile_hash, 'fingerprint': fingerprint, 'title': title,
+            'assessment': assessment}
+
+
+@storage_function
+def insert_stored_evaluations(rows):
+    """Inserts evaluation_store rows in one statement. Returns the number inserted, None on an error."""
+    supabase = get_supabase_client()
+    try:
+        response = (supabase.table('evaluation_store')
+                    .insert(rows, count=CountMethod.exact, returning=ReturnMethod.minimal)
+                    .execute())
+    except Exception as e:
+        print(f"Error storing evaluations: {e}")
+        return None
+
+    return response.count
+
+
+@storage_function
 def get_active_users_with_resume():
     supabase = get_supabase_client()
     response = supabase.rpc('get_active_users_with_resume').execute()
@@ -122,126 +513,203 @@ def get_active_users_with_resume():
         return None
 
 
+@storage_function
+def iter_recent_jobs(days_old=7, columns='id, title', page_size=1000):
+    """
+    Pages of jobs posted, or pulled when the posting date is unknown, in the last days_old days. The date filter
+    runs in the database on the jobs_date_posted_idx and jobs_date_pulled_idx indexes, and pages continue after
+    the last ID seen (keyset pagination), so each page costs the same however large the table gets.
+    """
+    supabase = get_supabase_client()
+    cutoff_date = (datetime.now() - timedelta(days=days_old)).date().isoformat()
+    last_id = None
+    while True:
+        query = (supabase.table('jobs')
+                 .select(columns)
+                 .or_(f"date_posted.gt.{cutoff_date},and(date_posted.is.null,date_pulled.gt.{cutoff_date})"))
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        response = query.order('id').limit(page_size).execute()
+
+        if response.data:
+            yield response.data
+        if not response.data or len(response.data) < page_size:
+            break
+        last_id = response.data[-1]['id']
+
+
 def get_recent_jobs(days_old=7):
+    """(id, title) of every recent job, see iter_recent_jobs."""
+    return [(job['id'], job['title']) for page in iter_recent_jobs(days_old) for job in page]
+
+
+def save_derived_data(job_id, derived_data):
+    """Writes only the derived text columns, leaving the rest of the job row alone."""
+    if not update_job_columns(job_id, derived_data):
+        print(f"Error saving derived data for job {job_id}")
+        return None
+
+    job_cache.update(job_id, derived_data)
+    print(f"Saved derived data for job {job_id}")
+    return derived_data
+
+
+@storage_function
+def update_job_columns(job_id, values):
+    """Updates the given columns of one job. Returns the number of rows updated, None on an error."""
     supabase = get_supabase_client()
-    response = (supabase.table('jobs')
-                .select('id, title, date_posted, date_pulled')
+    try:
+        result = (supabase.table('jobs')
+                  .update(values, count=CountMethod.exact, returning=ReturnMethod.minimal)
+                  .eq('id', job_id)
+                  .execute())
+    except Exception as e:
+        print(f"Error updating job {job_id}: {e}")
+        return None
+
+    return result.count
+
+
+@storage_function
+def get_job_ids_missing_derived_data(limit):
+    """IDs of the highest scoring recommended jobs that have no short_summary yet, best first."""
+    supabase = get_supabase_client()
+    response = (supabase.table('recent_high_score_jobs')
+                .select('id, score')
+                .is_('short_summary', 'null')
+                .order('score', desc=True)
+                .limit(limit * 4)
                 .execute())
 
-    if response.data:
-        cutoff_date = datetime.now() - timedelta(days=days_old)
-        jobs = [(item['id'], item['title']) for item in response.data if
-                pd.to_datetime(item.get('date_posted') or item.get('date_pulled')) > cutoff_date]
-        return jobs
+    # A job recommended to several users appears once per user
+    job_ids = list(dict.fromkeys(row['id'] for row in response.data or []))
+    return job_ids[:limit]
 
-    else:
-        print(f"Error fetching jobs: {response.error}")
-        return None
+
+@storage_function
+def get_email_recipients():
+    """Users who get email digests."""
+    supabase = get_supabase_client()
+    response = supabase.table('users').select('id, email, name, send_emails').neq('send_emails', 'never').execute()
+    return response.data or []
 
 
-def update_job_in_supabase(job):
+@storage_function
+def get_unemailed_jobs(user_id):
+    """The user's recommended jobs that haven't been in a digest yet, best first."""
     supabase = get_supabase_client()
-    job_id = job.get('id')
-    job_exists = supabase.table('jobs').select('id').eq('id', job_id).execute()
-    if not job_exists.data:
-        print(f"Job with ID {job_id} does not exist, skipping...")
-        return
-
-    job_data = {
-        'title': job.get('title'),
-        'company': job.get('company'),
-        'short_summary': job.get('short_summary'),
-        'hard_requirements': job.get('hard_requirements'),
-        'job_site': job.get('site'),
-        'url': job.get('job_url'),
-        'location': None if pd.isna(job.get('location')) else job.get('location'),
-        'date_posted': convert_to_date(job.get('date_posted')),
-        'comp_interval': None if pd.isna(job.get('interval')) else job.get('interval'),
-        'comp_min': convert_to_int(job.get('min_amount')),
-        'comp_max': convert_to_int(job.get('max_amount')),
-        'comp_currency': None if pd.isna(job.get('currency')) else job.get('currency'),
-        'emails': None if pd.isna(job.get('emails')) else job.get('emails'),
-        'description': job.get('description'),
-        'date_pulled': datetime.now().isoformat(),
-        'searched_title': job.get('searched_title')
-    }
+    response = (supabase.table('recent_high_score_jobs')
+                .select('id, user_id, score, title, company, location, comp_min, comp_max, guidance')
+                .eq('user_id', user_id).eq('email_sent', False)
+                .order('score', desc=True)
+                .execute())
+    return response.data or []
+
 
+@storage_function
+def mark_emails_sent(user_id, job_ids):
+    """Flags the jobs as emailed to the user in one update."""
+    if not job_ids:
+        return 0
+    supabase = get_supabase_client()
     try:
-        result = supabase.table('jobs').update(job_data).eq('id', job_id).execute()
-        if result.data:
-            print(f"Updated job with ID {job_id}!")  # {result.data}")
-        else:
-            print(f"Error updating job: {result.error}")
+        response = (supabase.table('users_jobs').update({'email_sent': True})
+                    .eq('user_id', user_id)
+                    .in_('job_id', list(job_ids))
+                    .execute())
     except Exception as e:
-        print(f"Error updating job: {e}")
-        print(f"Error on job data: {job_data}")
+        print(f"Error updating email sent status for user {user_id}: {e}")
         return None
 
-    return result
+    return len(response.data or [])
 
 
-def save_jobs_to_supabase(user_id, df):
+@storage_function
+def save_jobs_to_supabase(user_id, df, chunk_size=100):
+    """
+    Bulk save of a user's rated jobs. The batch is deduped by canonical URL, new jobs are inserted in one statement
+    (jobs already stored under the same URL are left as they are), their IDs are read back, their descriptions
+    are stored in job_descriptions, and the user's associations are inserted in one statement, skipping any the user
+    already has. A batch of up to chunk_size jobs takes four round trips.
+    """
     print(f"Saving {len(df)} jobs to Supabase...")
-    # Load environment variables
-    env_path = Path('.') / '.env'
-    load_dotenv(dotenv_path=env_path)
+    rows_by_url = {}
+    for index, row in df.iterrows():
+        if convert_to_int(row.get('job_score')) is None:
+            print("job_score cannot be converted to an integer")
+            continue
 
-    # Get Supabase URL and key from environment variables
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
+        job_url = row.get('job_url')
+        if job_url is None or pd.isna(job_url) or canonical_url(job_url) in rows_by_url:
+            continue
+        rows_by_url[canonical_url(job_url)] = row
 
-    # Initialize Supabase client
-    opts = ClientOptions().replace(schema="jobscraper")
-    supabase: Client = create_client(supabase_url, supabase_key, options=opts)
+    if not rows_by_url:
+        return 0
 
-    for index, row in df.iterrows():
+    supabase = get_supabase_client()
+    urls = list(rows_by_url)
+    saved = 0
+    for start in range(0, len(urls), chunk_size):
+        chunk_urls = urls[start:start + chunk_size]
         try:
-            job_score = int(row.get('job_score'))
-        except ValueError:
-            print("job_score cannot be converted to an integer")
+            (supabase.table('jobs')
+             .upsert([build_job_row(rows_by_url[url]) for url in chunk_urls], on_conflict='url',
+                     ignore_duplicates=True, returning=ReturnMethod.minimal)
+             .execute())
+            stored_jobs = supabase.table('jobs').select('id, url').in_('url', chunk_urls).execute()
+        except Exception as e:
+            print(f"Error saving jobs: {e}")
             continue
 
-        job_exists = supabase.table('jobs').select('id').eq('url', row.get('job_url', 'N/A')).execute()
-        if not job_exists.data:
-            print(f"Job with URL {row.get('job_url', 'N/A')} does not exist, creating new job...")
-            result = create_new_job(supabase, row)
-            job_id = result.data[0].get('id')
-            if not result.data:
-                print(f"Error inserting job: {result.error}")
-                continue
-        else:
-            job_id = job_exists.data[0].get('id')
+        job_ids = {job['url']: job['id'] for job in stored_jobs.data or []}
+        for url in chunk_urls:
+            if url not in job_ids:
+                print(f"Job with URL {url} was not saved, skipping...")
+
+        save_job_descriptions([build_description_row(job_ids[url], rows_by_url[url])
+                               for url in chunk_urls if url in job_ids])
 
-        if user_has_recommendation(user_id, job_id):
-            print(f"Job with URL {row.get('job_url', 'N/A')} already exists for user {user_id}, skipping...")
+        associations = [build_users_jobs_row(user_id, job_ids[url], rows_by_url[url])
+                        for url in chunk_urls if url in job_ids]
+        if not associations:
+            continue
+        try:
+            result = (supabase.table('users_jobs')
+                      .upsert(associations, on_conflict='user_id,job_id', ignore_duplicates=True)
+                      .execute())
+        except Exception as e:
+            print(f"Error inserting user jobs: {e}")
             continue
-        else:
-            create_new_job_association(supabase, user_id, job_id, row)
 
+        saved += len(result.data or [])
+
+    print(f"Saved {len(urls)} jobs for user {user_id}, {saved} new recommendations")
+    return saved
 
-def create_new_job_if_not_exists(row):
-    supabase = get_supabase_client()
-    job_exists = supabase.table('jobs').select('id').eq('url', row.get('job_url', 'N/A')).execute()
-    if not job_exists.data:
-        print(f"Job with URL {row.get('job_url', 'N/A')} does not exist, creating new job...")
-        result = create_new_job(supabase, row)
-        job_id = result.data[0].get('id')
-        if not result.data:
-            print(f"Error inserting job: {result.error}")
-    else:
-        job_id = job_exists.data[0].get('id')
 
+def create_new_job_if_not_exists(row):
+    job = get_job_by_url(row.get('job_url', 'N/A'), columns='id')
+    if job is not None:
+        return job['id']
+
+    print(f"Job with URL {row.get('job_url', 'N/A')} does not exist, creating new job...")
+    new_job = build_job_row(row)
+    job_id = insert_job(new_job)
+    if job_id is not None:
+        save_job_descriptions([build_description_row(job_id, row)])
+        job_cache.put({'id': job_id, **new_job})
     return job_id
 
 
-def create_new_job(supabase, row):
-    new_job = {
+def build_job_row(row):
+    return {
         'title': row.get('title'),
         'company': row.get('company'),
-        'short_summary': row.get('short_summary'),
-        'hard_requirements': row.get('hard_requirements'),
+        'short_summary': none_if_missing(row.get('short_summary')),
+        'hard_requirements': none_if_missing(row.get('hard_requirements')),
         'job_site': row.get('site'),
-        'url': row.get('job_url'),
+        'url': canonical_url(row.get('job_url')),
         'location': None if pd.isna(row.get('location')) else row.get('location'),
         'date_posted': convert_to_date(row.get('date_posted')),
         'comp_interval': None if pd.isna(row.get('interval')) else row.get('interval'),
@@ -249,25 +717,35 @@ def create_new_job(supabase, row):
         'comp_max': convert_to_int(row.get('max_amount')),
         'comp_currency': None if pd.isna(row.get('currency')) else row.get('currency'),
         'emails': None if pd.isna(row.get('emails')) else row.get('emails'),
-        'description': row.get('description'),
         'date_pulled': datetime.now().isoformat(),
         'searched_title': row.get('searched_title')
     }
 
+
+def build_description_row(job_id, row):
+    return {'job_id': job_id, 'description': none_if_missing(row.get('description'))}
+
+
+@storage_function
+def insert_job(new_job):
+    """Inserts a job row built by build_job_row, returns its ID or None."""
+    supabase = get_supabase_client()
     try:
         result = supabase.table('jobs').insert(new_job).execute()
         if result.data:
             print(f"Inserted job!")  # {result.data}")
         else:
             print(f"Error inserting job: {result.error}")
+            return None
     except Exception as e:
         print(f"Error inserting job: {e}")
         print(f"Error on job data: {new_job}")
         return None
 
-    return result
+    return result.data[0].get('id')
 
 
+@storage_function
 def user_has_recommendation(user_id, job_id):
     supabase = get_supabase_client()
     has_rec = (supabase.table('users_jobs')
@@ -282,34 +760,39 @@ def user_has_recommendation(user_id, job_id):
         return False
 
 
-def add_user_job_association(user_id, job_id, ratings):
-    supabase = get_supabase_client()
-    users_jobs_row = {
+def build_association_row(user_id, job_id, ratings):
+    return {
         'user_id': user_id,
         'job_id': job_id,
-        'desire_score': ratings.get('desire_score'),
-        'experience_score': ratings.get('experience_score'),
-        'meets_requirements_score': ratings.get('meets_requirements_score'),
-        'meets_experience_score': ratings.get('meets_experience_score'),
-        'score': ratings.get('overall_score'),
+        'desire_score': convert_to_int(ratings.get('desire_score')),
+        'experience_score': convert_to_int(ratings.get('experience_score')),
+        'meets_requirements_score': convert_to_int(ratings.get('meets_requirements_score')),
+        'meets_experience_score': convert_to_int(ratings.get('meets_experience_score')),
+        'score': convert_to_int(ratings.get('overall_score')),
         'guidance': ratings.get('guidance')
     }
+
+
+@storage_function
+def insert_user_job_rows(rows):
+    """
+    Inserts users_jobs rows in one statement, skipping pairs that already exist, so replaying a batch is safe.
+    Returns the number of rows inserted, None on an error.
+    """
+    supabase = get_supabase_client()
     try:
-        association_result = supabase.table('users_jobs').insert(users_jobs_row).execute()
-        if association_result.data:
-            print(f"Inserted user job association!")  #: {association_result.data}")
-        else:
-            print(f"Error inserting user job: {association_result.error}")
+        response = (supabase.table('users_jobs')
+                    .upsert(rows, on_conflict='user_id,job_id', ignore_duplicates=True)
+                    .execute())
     except Exception as e:
-        print(f"Error inserting user job: {e}")
-        print(f"Error on user-job data: {users_jobs_row}")
+        print(f"Error inserting user jobs: {e}")
         return None
 
-    return association_result
+    return len(response.data or [])
 
 
-def create_new_job_association(supabase, user_id, job_id, row):
-    users_jobs_row = {
+def build_users_jobs_row(user_id, job_id, row):
+    return {
         'user_id': user_id,
         'job_id': job_id,
         'desire_score': int(row.get('desire_score', 0)),
@@ -317,8 +800,13 @@ def create_new_job_association(supabase, user_id, job_id, row):
         'meets_requirements_score': int(row.get('meets_requirements_score', 0)),
         'meets_experience_score': int(row.get('meets_experience_score', 0)),
         'score': int(row.get('job_score', 0)),
-        'guidance': row.get('guidance')
+        'guidance': none_if_missing(row.get('guidance')),
+        'assessment_bits': None if pd.isna(row.get('assessment_bits')) else int(row.get('assessment_bits'))
     }
+
+
+def create_new_job_association(supabase, user_id, job_id, row):
+    users_jobs_row = build_users_jobs_row(user_id, job_id, row)
     try:
         association_result = supabase.table('users_jobs').insert(users_jobs_row).execute()
         if association_result.data:
@@ -0,0 +1,316 @@
+"""
+A small CPU model, trained on the scores already stored in users_jobs, that predicts whether the LLM evaluation
+would score a job over 50. Jobs it is confident will score 50 or less are skipped before any LLM call.
+
+python prescore_model.py train    # fit on the stored history and write a new versioned artifact
+python prescore_model.py report   # show the holdout metrics of the artifact in use
+"""
+import argparse
+import glob
+import os
+import random
+from datetime import datetime
+
+import joblib
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import roc_auc_score
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.model_selection import train_test_split
+
+from helpers import consolidate_text, count_tokens
+from llm_config import PRESCORE_MODE, PRESCORE_MODEL_DIR, PRESCORE_MAX_MISS_RATE, SCREEN_AUDIT_RATE
+from persistent_storage import get_scored_user_jobs, get_jobs_by_ids, get_user_by_id, get_user_configs
+from resume_profile import get_resume_profile_for_user
+from text_compaction import compact_description
+from local_answers import title_words, answer_title_matches_preferred, answer_free_from_stop_words, \
+    answer_meets_years_required, answer_meets_education_requirements, required_years
+
+# Bump when the features change, artifacts trained on other feature versions are ignored
+PRESCORE_FEATURE_VERSION = 2
+FEATURE_NAMES = ['resume_similarity', 'title_similarity', 'title_overlap', 'skill_coverage', 'free_from_stop_words',
+                 'title_matches', 'meets_years', 'meets_education', 'years_gap', 'description_tokens']
+GOOD_SCORE = 50
+MIN_TRAINING_ROWS = 200
+
+prescore_stats = {
+    'scored': 0,
+    'skipped': 0,  # jobs not sent to the LLM
+    'audited': 0,  # jobs the model would skip, evaluated anyway to measure misses
+    'audited_and_over_50': 0,  # audited jobs that scored over 50, i.e. good jobs the model would have missed
+}
+
+_loaded_model = None
+
+
+def tri_state(answer):
+    """Local answers are True, False or unknown (None), encoded as 1, 0 and 0.5."""
+    return 0.5 if answer is None else float(answer)
+
+
+def fit_vectorizer(texts):
+    """
+    The TF-IDF vocabulary and weights for the similarity features, fitted once over the training corpus and saved
+    with the model, so inference on a handful of jobs weighs terms the way training did.
+    """
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2), max_features=5000, stop_words='english')
+    vectorizer.fit([text for text in texts if text])
+    return vectorizer
+
+
+def text_similarities(vectorizer, anchor, texts):
+    """Cosine similarity of each text to the anchor, in the fitted vectorizer's space."""
+    if not anchor or not texts:
+        return [0.0] * len(texts)
+    matrix = vectorizer.transform([anchor] + texts)
+    return cosine_similarity(matrix[0:1], matrix[1:])[0].tolist()
+
+
+def job_texts(jobs):
+    """(titles, title plus description texts) of a list of dicts with title and description keys."""
+    titles = [job.get('title') or '' for job in jobs]
+    return titles, [title + ' ' + consolidate_text(job.get('description') or '') for title, job in zip(titles, jobs)]
+
+
+def job_features(jobs, resume_text, job_titles, skill_words, stop_words, vectorizer, profile=None):
+    """Feature rows, in FEATURE_NAMES order, for a list of dicts with title and description keys for one user."""
+    descriptions = [consolidate_text(job.get('description') or '') for job in jobs]
+    titles, texts = job_texts(jobs)
+    resume_similarity = text_similarities(vectorizer, consolidate_text(resume_text or ''), texts)
+    title_similarity = text_similarities(vectorizer, ' '.join(job_titles), titles)
+
+    skills = [skill.lower() for skill in skill_words if skill.strip()]
+    rows = []
+    for position, (title, description) in enumerate(zip(titles, descriptions)):
+        job_words = title_words(title)
+        title_overlap = max((len(job_words & title_words(preferred)) / len(title_words(preferred))
+                             for preferred in job_titles if title_words(preferred)), default=0.0)
+        lowered = description.lower()
+        skill_coverage = sum(1 for skill in skills if skill in lowered) / len(skills) if skills else 0.0
+        years = required_years(description)
+        years_gap = (profile.total_years_experience - years[-1]) if (profile is not None and years) else 0.0
+
+        rows.append([
+            resume_similarity[position],
+            title_similarity[position],
+            title_overlap,
+            skill_coverage,
+            float(answer_free_from_stop_words(description, stop_words)),
+            tri_state(answer_title_matches_preferred(title, job_titles)),
+            tri_state(answer_meets_years_required(description, profile)),
+            tri_state(answer_meets_education_requirements(description, profile)),
+            float(np.clip(years_gap, -10, 10)),
+            float(np.log1p(count_tokens(description))),
+        ])
+
+    return np.array(rows, dtype=float).reshape(len(rows), len(FEATURE_NAMES))
+
+
+def artifact_paths():
+    return sorted(glob.glob(os.path.join(PRESCORE_MODEL_DIR, f"prescore-v{PRESCORE_FEATURE_VERSION}-*.joblib")))
+
+
+def load_prescore_model():
+    """The newest artifact for the current feature version, or None if there isn't one."""
+    global _loaded_model
+    if _loaded_model is None:
+        paths = artifact_paths()
+        if not paths:
+            _loaded_model = False
+        else:
+            try:
+                _loaded_model = joblib.load(paths[-1])
+                print(f"Loaded pre-score model {os.path.basename(paths[-1])}")
+            except Exception as e:
+                print(f"Unable to load pre-score model {paths[-1]}: {e}")
+                _loaded_model = False
+
+    return _loaded_model or None
+
+
+def prescore_jobs(pending_jobs, rating_inputs):
+    """
+    Returns (jobs_to_evaluate, skipped_jobs). Jobs below the artifact's skip threshold are skipped, except for
+    a SCREEN_AUDIT_RATE sample that is evaluated anyway (flagged audit='prescore') to keep measuring misses.
+    """
+    artifact = load_prescore_model() if PRESCORE_MODE == 'on' else None
+    if artifact is None or len(pending_jobs) == 0:
+        return pending_jobs, []
+
+    features = job_features(pending_jobs, rating_inputs.get('resume_text'), rating_inputs['job_titles'],
+                            rating_inputs['skill_words'], rating_inputs['stop_words'], artifact['vectorizer'],
+                            rating_inputs.get('profile'))
+    probabilities = artifact['model'].predict_proba(features)[:, 1]
+
+    jobs_to_evaluate = []
+    skipped_jobs = []
+    for job, probability in zip(pending_jobs, probabilities):
+        prescore_stats['scored'] += 1
+        if probability >= artifact['skip_below']:
+            jobs_to_evaluate.append(job)
+        elif random.random() < SCREEN_AUDIT_RATE:
+            prescore_stats['audited'] += 1
+            job['audit'] = 'prescore'
+            jobs_to_evaluate.append(job)
+        else:
+            prescore_stats['skipped'] += 1
+            print(f"{job['index']}: Pre-score skipped {job['title']} at {job['company']} "
+                  f"(p(over {GOOD_SCORE}) = {probability:.2f})")
+            skipped_jobs.append(job)
+
+    return jobs_to_evaluate, skipped_jobs
+
+
+def record_prescore_results(jobs_df, evaluated_jobs):
+    for job in evaluated_jobs:
+        if job.get('audit') == 'prescore' and float(jobs_df.at[job['index'], 'job_score']) > GOOD_SCORE:
+            prescore_stats['audited_and_over_50'] += 1
+
+
+def print_prescore_report():
+    if prescore_stats['scored'] == 0:
+        return
+
+    stats = prescore_stats
+    print(f"Pre-score: scored {stats['scored']} jobs, skipped {stats['skipped']} LLM evaluations")
+    if stats['audited'] > 0:
+        print(f"Pre-score: {stats['audited_and_over_50']} of {stats['audited']} audited jobs it would have skipped "
+              f"scored over {GOOD_SCORE}")
+
+
+def load_training_users():
+    """
+    (user, configs, job_titles, jobs, labels) for every user with a resume, from the users_jobs rows an LLM
+    evaluation scored. The label is whether the score was over 50.
+    """
+    rows = get_scored_user_jobs()
+    jobs_by_id = {job['id']: job for job in get_jobs_by_ids({row['job_id'] for row in rows})}
+
+    rows_by_user = {}
+    for row in rows:
+        if row.get('score') is not None and row['job_id'] in jobs_by_id:
+            rows_by_user.setdefault(row['user_id'], []).append((jobs_by_id[row['job_id']], row['score']))
+
+    users = []
+    for user_id, user_rows in rows_by_user.items():
+        user = get_user_by_id(user_id)
+        if user is None or not user.get('resume'):
+            continue
+        configs = get_user_configs(user_id) or []
+        # Inference sees compacted descriptions, so train on the same
+        jobs = [{'title': job.get('title'), 'description': compact_description(job.get('description') or '')[0]}
+                for job, score in user_rows]
+        job_titles = [config['string_value'] for config in configs if config['key'] == 'job_titles']
+        users.append((user, configs, job_titles, jobs, [int(score > GOOD_SCORE) for job, score in user_rows]))
+
+    return users
+
+
+def fit_training_vectorizer(users, train_positions):
+    """
+    The vectorizer fitted on the resumes, preferred titles and the jobs at train_positions (positions in the
+    order training_features returns rows), so no holdout job shapes the term weights.
+    """
+    corpus = []
+    position = 0
+    for user, configs, job_titles, jobs, labels in users:
+        texts = job_texts(jobs)[1]
+        corpus.extend(text for offset, text in enumerate(texts) if position + offset in train_positions)
+        corpus.extend([consolidate_text(user.get('resume')), ' '.join(job_titles)])
+        position += len(jobs)
+
+    return fit_vectorizer(corpus)
+
+
+def training_features(users, vectorizer):
+    """Feature matrix and labels of every user's jobs, one user after another."""
+    if not users:
+        return np.empty((0, len(FEATURE_NAMES))), np.array([])
+
+    features = []
+    labels = []
+    for user, configs, job_titles, jobs, user_labels in users:
+        features.append(job_features(
+            jobs, user.get('resume'), job_titles,
+            [config['string_value'] for config in configs if config['key'] == 'skill_words'],
+            [config['string_value'] for config in configs if config['key'] == 'stop_words'],
+            vectorizer, get_resume_profile_for_user(user)))
+        labels.extend(user_labels)
+
+    return np.vstack(features), np.array(labels)
+
+
+def choose_skip_threshold(probabilities, labels, max_miss_rate=PRESCORE_MAX_MISS_RATE):
+    """The highest probability cutoff that misses no more than max_miss_rate of the good jobs on the holdout."""
+    good_probabilities = np.sort(probabilities[labels == 1])
+    if len(good_probabilities) == 0:
+        return 0.0
+    allowed_misses = int(np.floor(max_miss_rate * len(good_probabilities)))
+    return float(good_probabilities[allowed_misses]) if allowed_misses > 0 else float(good_probabilities[0])
+
+
+def train():
+    """
+    Fits the vectorizer and the model on 80% of the scored jobs and chooses the skip threshold on the other 20%.
+    The model that is saved is the one the threshold and metrics were measured on.
+    """
+    users = load_training_users()
+    labels = np.array([label for user in users for label in user[4]])
+    print(f"Loaded {len(labels)} scored jobs, {int(labels.sum()) if len(labels) else 0} over {GOOD_SCORE}")
+    if len(labels) < MIN_TRAINING_ROWS or len(set(labels)) < 2:
+        print(f"Need at least {MIN_TRAINING_ROWS} scored jobs with both outcomes to train, not writing a model")
+        return None
+
+    train_positions, test_positions = train_test_split(
+        np.arange(len(labels)), test_size=0.2, random_state=42, stratify=labels)
+    vectorizer = fit_training_vectorizer(users, set(train_positions.tolist()))
+    features, labels = training_features(users, vectorizer)
+    test_labels = labels[test_positions]
+
+    model = GradientBoostingClassifier(n_estimators=200, max_depth=3, learning_rate=0.05, random_state=42)
+    model.fit(features[train_positions], labels[train_positions])
+
+    probabilities = model.predict_proba(features[test_positions])[:, 1]
+    skip_below = choose_skip_threshold(probabilities, test_labels)
+    skipped = probabilities < skip_below
+    metrics = {
+        'rows': int(len(labels)),
+        'holdout_rows': int(len(test_labels)),
+        'auc': float(roc_auc_score(test_labels, probabilities)),
+        'calls_saved_rate': float(skipped.mean()),
+        'good_jobs_missed_rate': float((skipped & (test_labels == 1)).sum() / max(1, (test_labels == 1).sum())),
+    }
+
+    os.makedirs(PRESCORE_MODEL_DIR, exist_ok=True)
+    path = os.path.join(PRESCORE_MODEL_DIR,
+                        f"prescore-v{PRESCORE_FEATURE_VERSION}-{datetime.now().strftime('%Y%m%d%H%M%S')}.joblib")
+    joblib.dump({'feature_version': PRESCORE_FEATURE_VERSION, 'feature_names': FEATURE_NAMES,
+                 'trained_at': datetime.now().isoformat(), 'skip_below': skip_below, 'metrics': metrics,
+                 'model': model, 'vectorizer': vectorizer}, path)
+
+    print(f"Wrote {path}")
+    print_metrics(skip_below, metrics)
+    return path
+
+
+def print_metrics(skip_below, metrics):
+    print(f"Holdout AUC {metrics['auc']:.3f} on {metrics['holdout_rows']} of {metrics['rows']} jobs")
+    print(f"Skipping below p = {skip_below:.3f} saves {metrics['calls_saved_rate']:.0%} of evaluations and misses "
+          f"{metrics['good_jobs_missed_rate']:.0%} of jobs over {GOOD_SCORE}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train or inspect the pre-score model")
+    parser.add_argument('command', choices=['train', 'report'])
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train()
+    else:
+        loaded = load_prescore_model()
+        if loaded is None:
+            print(f"No pre-score model for feature version {PRESCORE_FEATURE_VERSION} in {PRESCORE_MODEL_DIR}")
+        else:
+            print(f"Trained {loaded['trained_at']}")
+            print_metrics(loaded['skip_below'], loaded['metrics'])
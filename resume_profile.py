@@ -0,0 +1,103 @@
+import hashlib
+
+from helpers import consolidate_text
+from llm import build_model_schema_format
+from llm_client import create_completion
+from llm_config import MODEL_STRUCTURED
+from llm_metering import metering_context
+from models import ResumeProfile
+from persistent_storage import get_resume_profile, save_resume_profile
+
+# Bump when the profile schema or prompt changes so stored profiles are regenerated
+PROFILE_VERSION = 1
+
+# Profiles already loaded or generated in this process, by resume hash
+_profile_cache = {}
+
+
+def resume_hash(resume):
+    normalized = consolidate_text(resume or '').strip().lower()
+    return hashlib.sha256(f"v{PROFILE_VERSION}:{normalized}".encode('utf-8')).hexdigest()
+
+
+def create_profile_prompt(resume):
+    return f"""Distill the candidate's resume below into a compact structured profile.
+
+       Resume: {resume}
+
+       - total_years_experience: total years of professional experience
+       - years_by_domain: years of experience per domain or field of work (e.g. backend engineering, data science,
+         people management), most significant first, at most 6 entries
+       - skills: the candidate's most relevant technical and domain skills, at most 25
+       - seniority: one of intern, junior, mid, senior, staff, principal, manager, director, executive
+       - education: degrees and certifications, one short entry each
+       - recent_titles: the candidate's 3 most recent job titles, most recent first
+       - summary: two sentences describing the candidate's background and strengths
+       """
+
+
+def distill_resume(resume):
+    with metering_context(stage='resume_profile'):
+        completion = create_completion({
+            "model": MODEL_STRUCTURED,
+            "messages": [
+                {"role": "system",
+                 "content": "You are an expert recruiter who summarizes resumes accurately and concisely."},
+                {"role": "user", "content": create_profile_prompt(consolidate_text(resume))}
+            ],
+            "response_format": build_model_schema_format("resume_profile", ResumeProfile)
+        })
+    return ResumeProfile.model_validate_json(completion.choices[0].message.content)
+
+
+def get_resume_profile_for_user(db_user):
+    """
+    Returns the user's ResumeProfile, generating it only when the resume has changed since it was last distilled.
+    Returns None if the profile can't be generated.
+    """
+    resume = db_user.get('resume')
+    if not resume:
+        return None
+
+    key = resume_hash(resume)
+    if key in _profile_cache:
+        return _profile_cache[key]
+
+    stored = get_resume_profile(key)
+    if stored is not None:
+        try:
+            profile = ResumeProfile.model_validate(stored)
+            _profile_cache[key] = profile
+            return profile
+        except Exception as e:
+            print(f"Stored resume profile {key[:12]} is invalid, regenerating: {e}")
+
+    print(f"Distilling resume profile for user {db_user.get('id')}...")
+    try:
+        profile = distill_resume(resume)
+    except Exception as e:
+        print(f"Error distilling resume profile: {e}")
+        return None
+
+    save_resume_profile(key, profile.model_dump())
+    _profile_cache[key] = profile
+    return profile
+
+
+def format_resume_profile(profile):
+    domains = ', '.join(f"{item.domain} ({item.years:g} yrs)" for item in profile.years_by_domain)
+    return (f"{profile.summary} "
+            f"Seniority: {profile.seniority}. "
+            f"Total experience: {profile.total_years_experience:g} years. "
+            f"Experience by domain: {domains}. "
+            f"Recent titles: {', '.join(profile.recent_titles)}. "
+            f"Skills: {', '.join(profile.skills)}. "
+            f"Education: {', '.join(profile.education) or 'None listed'}.")
+
+
+def get_resume_for_prompt(db_user):
+    """The compact profile text for evaluation prompts, falling back to the full resume."""
+    profile = get_resume_profile_for_user(db_user)
+    if profile is None:
+        return consolidate_text(db_user.get('resume'))
+    return format_resume_profile(profile)
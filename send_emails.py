@@ -3,16 +3,16 @@ from datetime import datetime
 from jinja2 import Environment, FileSystemLoader
 from mailjet_rest import Client
 
-from persistent_storage import get_supabase_client
+from derived_data import materialize_derived_data
+from persistent_storage import get_email_recipients, get_unemailed_jobs, mark_emails_sent
 
 
 def send_email_updates():
-    supabase = get_supabase_client()
-    users = supabase.table('users').select('id, email, name, send_emails').neq('send_emails', 'never').execute()
+    users = get_email_recipients()
 
     current_time = datetime.now()
 
-    for user in users.data:
+    for user in users:
         send_emails = user['send_emails']
         if current_time.hour > 8 and send_emails == 'daily':
             continue
@@ -24,21 +24,20 @@ def send_email_updates():
 
         user_name = user['name']
         user_email = user['email']
-        unemailed_jobs = (supabase.table('recent_high_score_jobs')
-                          .select('id, user_id, score, title, company', 'location', 'comp_min', 'comp_max', 'guidance')
-                          .eq('user_id', user_id).eq('email_sent', False)
-                          .order('score', desc=True)
-                          .execute())
+        unemailed_jobs = get_unemailed_jobs(user_id)
 
-        if not unemailed_jobs.data or len(unemailed_jobs.data) == 0:
+        if len(unemailed_jobs) == 0:
             print(f"No new jobs for {user_name}, skipping email.")
             continue
 
-        print(f"Found {len(unemailed_jobs.data)} new jobs for {user_name}")
+        print(f"Found {len(unemailed_jobs)} new jobs for {user_name}")
+
+        # The jobs in the digest are the ones the user will open, so make sure they have summaries
+        materialize_derived_data([job['id'] for job in unemailed_jobs[:3]])
 
         email_jobs_data = []
-        for job in unemailed_jobs.data[:3]:
-            score = int(job['score'])
+        for job in unemailed_jobs[:3]:
+            score = job['score']
             score_color = '#59c9a5' if score > 85 else '#93c1b2' if score > 75 else '#888'
             guidance_color = '#59c9a522' if score > 85 else '#93c1b222' if score > 75 else '#88888822'
             title = job['title']
@@ -75,7 +74,7 @@ def send_email_updates():
         print(email_jobs_data)
 
         # Send email
-        send_email(user_email, user_name, email_jobs_data, total_job_count=len(unemailed_jobs.data))
+        send_email(user_email, user_name, email_jobs_data, total_job_count=len(unemailed_jobs))
         update_email_sent_status(unemailed_jobs)
 
 
@@ -116,12 +115,9 @@ def send_email(user_email, user_name, jobs, total_job_count):
 
 
 def update_email_sent_status(unemailed_jobs):
-    supabase = get_supabase_client()
-    for job in unemailed_jobs.data:
-        job_id = job['id']
-        user_id = job['user_id']
-
-        (supabase.table('users_jobs').update({'email_sent': True})
-         .eq('user_id', user_id)
-         .eq('job_id', job_id)
-         .execute())
+    job_ids_by_user = {}
+    for job in unemailed_jobs:
+        job_ids_by_user.setdefault(job['user_id'], []).append(job['id'])
+
+    for user_id, job_ids in job_ids_by_user.items():
+        mark_emails_sent(user_id, job_ids)
@@ -0,0 +1,515 @@
+"""
+SQL implementations of the persistent_storage functions, used when STORAGE_BACKEND is `postgres` (a pooled direct
+connection to the same database Supabase serves) or `sqlite` (an embedded file, for running and benchmarking the
+whole pipeline offline). Each method has the name, arguments and return shape of the persistent_storage function
+it stands in for, so the rest of the code doesn't know which backend it is talking to.
+
+python storage_backends.py init-sqlite [--path jobs.sqlite3]   # create an empty SQLite database
+python storage_backends.py add-user <email> --resume resume.txt [--title "Data Engineer" ...]
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from job_cache import canonical_url
+from persistent_storage import build_job_row, build_users_jobs_row, build_description_row, convert_to_int, \
+    none_if_missing
+
+# Mirrors db_scripts/tables.sql, views.sql and functions.sql in SQLite's dialect
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id text PRIMARY KEY,
+    created_at text DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    title text,
+    company text,
+    short_summary text,
+    hard_requirements text,
+    job_site text,
+    url text UNIQUE,
+    location text,
+    date_posted text,
+    comp_interval text,
+    comp_min integer,
+    comp_max integer,
+    comp_currency text,
+    emails text,
+    searched_title text,
+    date_pulled text
+);
+
+CREATE TABLE IF NOT EXISTS job_descriptions (
+    job_id text PRIMARY KEY REFERENCES jobs (id) ON DELETE CASCADE,
+    description text
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id text PRIMARY KEY,
+    created_at text DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    email text,
+    location text,
+    remote_preference text,
+    distance integer,
+    results_wanted integer,
+    min_salary integer,
+    resume text,
+    name text,
+    is_public boolean DEFAULT 0 NOT NULL,
+    send_emails text DEFAULT 'never' NOT NULL,
+    onboarding_complete boolean DEFAULT 0,
+    last_login text
+);
+
+CREATE TABLE IF NOT EXISTS users_jobs (
+    user_id text NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    job_id text NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    score integer,
+    interested boolean,
+    has_applied boolean,
+    desire_score integer,
+    experience_score integer,
+    meets_requirements_score integer,
+    meets_experience_score integer,
+    email_sent boolean DEFAULT 0 NOT NULL,
+    guidance text,
+    assessment_bits integer,
+    PRIMARY KEY (user_id, job_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_configs (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    created_at text DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    key text,
+    string_value text,
+    int_value integer,
+    bool_value boolean,
+    user_id text
+);
+
+CREATE TABLE IF NOT EXISTS resume_profiles (
+    resume_hash text PRIMARY KEY,
+    profile text NOT NULL,
+    created_at text DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS evaluation_cursors (
+    user_id text PRIMARY KEY,
+    evaluated_urls text DEFAULT '[]' NOT NULL,
+    good_jobs_today integer DEFAULT 0 NOT NULL,
+    cursor_date text,
+    updated_at text DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS evaluation_store (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    created_at text DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    resume_hash text NOT NULL,
+    profile_hash text NOT NULL,
+    fingerprint integer NOT NULL,
+    title text,
+    assessment text NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS evaluation_store_key_idx ON evaluation_store (resume_hash, profile_hash, created_at);
+CREATE INDEX IF NOT EXISTS user_configs_user_id_idx ON user_configs (user_id);
+CREATE INDEX IF NOT EXISTS jobs_date_posted_idx ON jobs (date_posted);
+CREATE INDEX IF NOT EXISTS jobs_date_pulled_idx ON jobs (date_pulled);
+CREATE INDEX IF NOT EXISTS users_jobs_email_score_idx ON users_jobs (user_id, email_sent, score DESC, job_id)
+    WHERE score >= 50;
+
+CREATE VIEW IF NOT EXISTS recent_high_score_jobs AS
+SELECT
+    uj.user_id, uj.score, uj.desire_score, uj.experience_score, uj.meets_requirements_score,
+    uj.meets_experience_score, uj.interested, uj.has_applied, uj.email_sent, uj.guidance,
+    j.id, j.created_at, j.title, j.company, j.short_summary, j.hard_requirements, j.job_site, j.url, j.location,
+    j.date_posted, j.comp_interval, j.comp_min, j.comp_max, j.comp_currency, j.emails, j.date_pulled
+FROM users_jobs uj
+JOIN jobs j ON uj.job_id = j.id
+WHERE
+    (
+      ((uj.interested IS NULL OR uj.interested = 0) AND (j.date_posted > date('now', '-14 days')
+                                                         OR j.date_pulled > date('now', '-14 days')))
+      OR uj.interested = 1
+      OR uj.has_applied = 1
+    )
+    AND uj.score >= 50;
+"""
+
+# Columns stored as jsonb in Postgres and as text in SQLite
+JSON_COLUMNS = ('profile', 'evaluated_urls', 'assessment')
+USERS_JOBS_COLUMNS = ('user_id', 'job_id', 'desire_score', 'experience_score', 'meets_requirements_score',
+                      'meets_experience_score', 'score', 'guidance', 'assessment_bits')
+JOB_COLUMNS = ('id',) + tuple(build_job_row({}).keys())
+STORED_EVALUATION_COLUMNS = ('resume_hash', 'profile_hash', 'fingerprint', 'title', 'assessment', 'created_at')
+SCORE_COLUMNS = ('desire_score', 'experience_score', 'meets_requirements_score', 'meets_experience_score', 'score')
+
+
+class SqlStorage:
+    """Shared SQL for both backends. Queries are written for Postgres and translated by sql() where needed."""
+    name = 'sql'
+
+    @contextmanager
+    def cursor(self):
+        raise NotImplementedError
+
+    def sql(self, query):
+        return query
+
+    def to_json(self, value):
+        return json.dumps(value, default=str)
+
+    def row_to_dict(self, cursor, row):
+        record = dict(zip([column[0] for column in cursor.description], row))
+        for column, value in record.items():
+            # PostgREST returns dates as ISO strings
+            if isinstance(value, (date, datetime)):
+                record[column] = value.isoformat()
+        for column in JSON_COLUMNS:
+            if isinstance(record.get(column), str):
+                record[column] = json.loads(record[column])
+        return record
+
+    def fetch_all(self, query, params=()):
+        with self.cursor() as cursor:
+            cursor.execute(self.sql(query), params)
+            return [self.row_to_dict(cursor, row) for row in cursor.fetchall()]
+
+    def fetch_one(self, query, params=()):
+        rows = self.fetch_all(query, params)
+        return rows[0] if rows else None
+
+    def fetch_in_chunks(self, query, values, chunk_size):
+        """Runs query, whose {} is filled with placeholders, once per chunk of values and concatenates the rows."""
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            rows.extend(self.fetch_all(query.format(', '.join(['%s'] * len(chunk))), chunk))
+        return rows
+
+    def execute(self, query, params=()):
+        with self.cursor() as cursor:
+            cursor.execute(self.sql(query), params)
+            return cursor.rowcount
+
+    def insert_rows(self, cursor, table, columns, rows, suffix=''):
+        """One multi-row INSERT, returns the rows from the RETURNING clause in suffix, if any."""
+        if not rows:
+            return []
+        values = ', '.join('(' + ', '.join(['%s'] * len(columns)) + ')' for _ in rows)
+        params = [row.get(column) for row in rows for column in columns]
+        cursor.execute(self.sql(f"INSERT INTO jobscraper.{table} ({', '.join(columns)}) VALUES {values} {suffix}"),
+                       params)
+        return [self.row_to_dict(cursor, row) for row in cursor.fetchall()] if 'RETURNING' in suffix else []
+
+    def save_titles_for_user(self, user_id, titles):
+        with self.cursor() as cursor:
+            self.insert_rows(cursor, 'user_configs', ('user_id', 'key', 'string_value'),
+                             [{'user_id': user_id, 'key': 'job_titles', 'string_value': title} for title in titles])
+        print(f"Inserted titles for user {user_id}: {titles}")
+
+    def get_user_by_id(self, user_id):
+        user = self.fetch_one("SELECT * FROM jobscraper.users WHERE id = %s", (user_id,))
+        if user is None:
+            print(f"Error fetching user: {user_id} not found")
+        return user
+
+    def get_user_configs(self, user_id):
+        configs = self.fetch_all("SELECT * FROM jobscraper.user_configs WHERE user_id = %s", (user_id,))
+        if not configs:
+            print("Error fetching configs or configs were empty")
+            return {}
+        return configs
+
+    def get_configs_for_users(self, user_ids, chunk_size=100, page_size=1000):
+        return self.fetch_in_chunks("SELECT * FROM jobscraper.user_configs WHERE user_id IN ({}) ORDER BY id",
+                                    user_ids, chunk_size)
+
+    def get_job_ids_for_users(self, user_ids, chunk_size=100, page_size=1000):
+        return self.fetch_in_chunks("SELECT user_id, job_id FROM jobscraper.users_jobs WHERE user_id IN ({})",
+                                    user_ids, chunk_size)
+
+    def get_user_job_matches(self, user_id):
+        return self.fetch_all("SELECT user_id, job_id FROM jobscraper.users_jobs WHERE user_id = %s",
+                              (user_id,)) or None
+
+    def get_resume_profile(self, resume_hash):
+        row = self.fetch_one("SELECT profile FROM jobscraper.resume_profiles WHERE resume_hash = %s", (resume_hash,))
+        return row['profile'] if row else None
+
+    def save_resume_profile(self, resume_hash, profile):
+        self.execute("INSERT INTO jobscraper.resume_profiles (resume_hash, profile) VALUES (%s, %s) "
+                     "ON CONFLICT (resume_hash) DO UPDATE SET profile = excluded.profile",
+                     (resume_hash, self.to_json(profile)))
+        print(f"Saved resume profile {resume_hash[:12]}")
+        return True
+
+    def get_scored_user_jobs(self, page_size=1000):
+        return self.fetch_all("SELECT user_id, job_id, score, interested FROM jobscraper.users_jobs "
+                              "WHERE score IS NOT NULL AND assessment_bits IS NOT NULL")
+
+    def iter_user_job_assessments(self, page_size=1000):
+        after, params = '', ()
+        while True:
+            page = self.fetch_all("SELECT user_id, job_id, assessment_bits, desire_score, experience_score, "
+                                  "meets_requirements_score, meets_experience_score, score "
+                                  f"FROM jobscraper.users_jobs WHERE assessment_bits IS NOT NULL {after}"
+                                  "ORDER BY user_id, job_id LIMIT %s", params + (page_size,))
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            # Keyset pagination: continue after the last (user_id, job_id) instead of counting an offset
+            after = "AND (user_id > %s OR (user_id = %s AND job_id > %s)) "
+            params = (page[-1]['user_id'], page[-1]['user_id'], page[-1]['job_id'])
+
+    def update_user_job_scores(self, rows, chunk_size=500):
+        assignments = ', '.join(f"{column} = %s" for column in SCORE_COLUMNS)
+        with self.cursor() as cursor:
+            cursor.executemany(self.sql(f"UPDATE jobscraper.users_jobs SET {assignments} "
+                                        f"WHERE user_id = %s AND job_id = %s"),
+                               [[row.get(column) for column in SCORE_COLUMNS] + [row['user_id'], row['job_id']]
+                                for row in rows])
+
+    def fetch_jobs_by_ids(self, job_ids, columns='id, title, description', chunk_size=200):
+        return self.fetch_in_chunks(f"SELECT {columns} FROM jobscraper.jobs WHERE id IN ({{}})", job_ids, chunk_size)
+
+    def fetch_job_descriptions(self, job_ids, chunk_size=100):
+        return self.fetch_in_chunks("SELECT job_id, description FROM jobscraper.job_descriptions WHERE job_id IN ({})",
+                                    job_ids, chunk_size)
+
+    def save_job_descriptions(self, rows, overwrite=False):
+        rows = [row for row in rows if row.get('description')]
+        with self.cursor() as cursor:
+            self.insert_rows(cursor, 'job_descriptions', ('job_id', 'description'), rows,
+                             'ON CONFLICT (job_id) DO UPDATE SET description = excluded.description' if overwrite
+                             else 'ON CONFLICT (job_id) DO NOTHING')
+        return len(rows)
+
+    def fetch_jobs_by_urls(self, urls, columns='id, url', chunk_size=100):
+        return self.fetch_in_chunks(f"SELECT {columns} FROM jobscraper.jobs WHERE url IN ({{}})",
+                                    list(dict.fromkeys(canonical_url(url) for url in urls)), chunk_size)
+
+    def update_job_columns(self, job_id, values):
+        assignments = ', '.join(f"{column} = %s" for column in values)
+        return self.execute(f"UPDATE jobscraper.jobs SET {assignments} WHERE id = %s", list(values.values()) + [job_id])
+
+    def get_evaluation_cursor(self, user_id):
+        return self.fetch_one("SELECT evaluated_urls, good_jobs_today, cursor_date, updated_at "
+                              "FROM jobscraper.evaluation_cursors WHERE user_id = %s", (user_id,))
+
+    def save_evaluation_cursor(self, user_id, evaluated_urls, good_jobs_today, cursor_date):
+        self.execute("INSERT INTO jobscraper.evaluation_cursors "
+                     "(user_id, evaluated_urls, good_jobs_today, cursor_date, updated_at) VALUES (%s, %s, %s, %s, %s) "
+                     "ON CONFLICT (user_id) DO UPDATE SET evaluated_urls = excluded.evaluated_urls, "
+                     "good_jobs_today = excluded.good_jobs_today, cursor_date = excluded.cursor_date, "
+                     "updated_at = excluded.updated_at",
+                     (user_id, self.to_json(evaluated_urls), good_jobs_today, cursor_date, datetime.now().isoformat()))
+        return True
+
+    def get_stored_evaluations(self, resume_hash, profile_hash, since, page_size=1000):
+        return self.fetch_all("SELECT fingerprint, assessment FROM jobscraper.evaluation_store "
+                              "WHERE resume_hash = %s AND profile_hash = %s AND created_at >= %s",
+                              (resume_hash, profile_hash, since))
+
+    def insert_stored_evaluations(self, rows):
+        created_at = datetime.now().isoformat()
+        with self.cursor() as cursor:
+            self.insert_rows(cursor, 'evaluation_store', STORED_EVALUATION_COLUMNS,
+                             [{**row, 'assessment': self.to_json(row['assessment']), 'created_at': created_at}
+                              for row in rows])
+        return len(rows)
+
+    def get_active_users_with_resume(self):
+        since = (datetime.now() - timedelta(days=30)).isoformat()
+        users = self.fetch_all("SELECT * FROM jobscraper.users "
+                               "WHERE resume IS NOT NULL AND resume <> '' AND last_login >= %s", (since,))
+        if not users:
+            print("Error fetching roles: no active users with a resume")
+            return None
+        return users
+
+    def iter_recent_jobs(self, days_old=7, columns='id, title', page_size=1000):
+        cutoff_date = (datetime.now() - timedelta(days=days_old)).date().isoformat()
+        after, params = '', ()
+        while True:
+            page = self.fetch_all(f"SELECT {columns} FROM jobscraper.jobs "
+                                  "WHERE (date_posted > %s OR (date_posted IS NULL AND date_pulled > %s)) "
+                                  f"{after}ORDER BY id LIMIT %s", (cutoff_date, cutoff_date) + params + (page_size,))
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            after, params = "AND id > %s ", (page[-1]['id'],)
+
+    def get_job_ids_missing_derived_data(self, limit):
+        rows = self.fetch_all("SELECT id, MAX(score) AS best_score "
+                              "FROM jobscraper.recent_high_score_jobs WHERE short_summary IS NULL "
+                              "GROUP BY id ORDER BY best_score DESC LIMIT %s", (limit,))
+        return [row['id'] for row in rows]
+
+    def save_jobs_to_supabase(self, user_id, df, chunk_size=100):
+        print(f"Saving {len(df)} jobs to {self.name}...")
+        rows_by_url = {}
+        for index, row in df.iterrows():
+            if convert_to_int(row.get('job_score')) is None:
+                print("job_score cannot be converted to an integer")
+                continue
+            job_url = row.get('job_url')
+            if job_url is None or pd.isna(job_url) or canonical_url(job_url) in rows_by_url:
+                continue
+            rows_by_url[canonical_url(job_url)] = row
+
+        urls = list(rows_by_url)
+        saved = 0
+        for start in range(0, len(urls), chunk_size):
+            chunk_urls = urls[start:start + chunk_size]
+            with self.cursor() as cursor:
+                self.insert_rows(cursor, 'jobs', JOB_COLUMNS,
+                                 [{'id': str(uuid.uuid4()), **build_job_row(rows_by_url[url])} for url in chunk_urls],
+                                 'ON CONFLICT (url) DO NOTHING')
+                cursor.execute(self.sql(f"SELECT id, url FROM jobscraper.jobs "
+                                        f"WHERE url IN ({', '.join(['%s'] * len(chunk_urls))})"), chunk_urls)
+                job_ids = {url: job_id for job_id, url in cursor.fetchall()}
+                self.insert_rows(cursor, 'job_descriptions', ('job_id', 'description'),
+                                 [build_description_row(job_ids[url], rows_by_url[url]) for url in chunk_urls
+                                  if url in job_ids and none_if_missing(rows_by_url[url].get('description'))],
+                                 'ON CONFLICT (job_id) DO NOTHING')
+                associations = [build_users_jobs_row(user_id, job_ids[url], rows_by_url[url])
+                                for url in chunk_urls if url in job_ids]
+                saved += len(self.insert_rows(cursor, 'users_jobs', USERS_JOBS_COLUMNS, associations,
+                                              'ON CONFLICT (user_id, job_id) DO NOTHING RETURNING job_id'))
+
+        print(f"Saved {len(urls)} jobs for user {user_id}, {saved} new recommendations")
+        return saved
+
+    def insert_job(self, new_job):
+        job_id = str(uuid.uuid4())
+        with self.cursor() as cursor:
+            self.insert_rows(cursor, 'jobs', JOB_COLUMNS, [{'id': job_id, **new_job}])
+        print(f"Inserted job!")
+        return job_id
+
+    def user_has_recommendation(self, user_id, job_id):
+        return self.fetch_one("SELECT 1 AS found FROM jobscraper.users_jobs WHERE user_id = %s AND job_id = %s",
+                              (user_id, job_id)) is not None
+
+    def insert_user_job_rows(self, rows):
+        with self.cursor() as cursor:
+            return len(self.insert_rows(cursor, 'users_jobs', USERS_JOBS_COLUMNS, rows,
+                                        'ON CONFLICT (user_id, job_id) DO NOTHING RETURNING job_id'))
+
+    def get_email_recipients(self):
+        return self.fetch_all("SELECT id, email, name, send_emails FROM jobscraper.users WHERE send_emails <> 'never'")
+
+    def get_unemailed_jobs(self, user_id):
+        return self.fetch_all("SELECT id, user_id, score, title, company, location, comp_min, comp_max, guidance "
+                              "FROM jobscraper.recent_high_score_jobs WHERE user_id = %s AND email_sent = %s "
+                              "ORDER BY score DESC", (user_id, False))
+
+    def mark_emails_sent(self, user_id, job_ids):
+        if not job_ids:
+            return 0
+        return self.execute(f"UPDATE jobscraper.users_jobs SET email_sent = %s "
+                            f"WHERE user_id = %s AND job_id IN ({', '.join(['%s'] * len(job_ids))})",
+                            [True, user_id] + list(job_ids))
+
+
+class PostgresStorage(SqlStorage):
+    """Direct connection to Postgres through a thread-safe pool, shared by every thread in the process."""
+    name = 'Postgres'
+
+    def __init__(self, database_url, pool_size):
+        try:
+            from psycopg2.pool import ThreadedConnectionPool
+        except ImportError:
+            raise ImportError("STORAGE_BACKEND=postgres needs psycopg2: pip install psycopg2-binary")
+        self.pool = ThreadedConnectionPool(1, pool_size, database_url)
+
+    @contextmanager
+    def cursor(self):
+        connection = self.pool.getconn()
+        try:
+            with connection.cursor() as cursor:
+                yield cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            self.pool.putconn(connection)
+
+
+class SqliteStorage(SqlStorage):
+    """One embedded database file, one connection serialized by a lock (SQLite has a single writer anyway)."""
+    name = 'SQLite'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SQLITE_SCHEMA)
+
+    def sql(self, query):
+        return query.replace('jobscraper.', '').replace('%s', '?')
+
+    @contextmanager
+    def cursor(self):
+        with self.lock:
+            cursor = self.connection.cursor()
+            try:
+                yield cursor
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def add_user(self, email, resume, titles=(), name=None, send_emails='never'):
+        """Creates a user who counts as active, for offline runs. Returns the new user's ID."""
+        user_id = str(uuid.uuid4())
+        self.execute("INSERT INTO users (id, email, name, resume, send_emails, last_login) "
+                     "VALUES (%s, %s, %s, %s, %s, %s)",
+                     (user_id, email, name or email, resume, send_emails, datetime.now().isoformat()))
+        if titles:
+            self.save_titles_for_user(user_id, list(titles))
+        return user_id
+
+
+def create_sql_storage(backend, database_url=None, sqlite_path=None, pool_size=5):
+    if backend == 'postgres':
+        if not database_url:
+            raise ValueError("STORAGE_BACKEND=postgres needs STORAGE_DATABASE_URL")
+        return PostgresStorage(database_url, pool_size)
+    if backend == 'sqlite':
+        return SqliteStorage(sqlite_path)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend}, expected supabase, postgres or sqlite")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline SQLite storage")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    init_parser = subparsers.add_parser('init-sqlite')
+    init_parser.add_argument('--path', default='jobs.sqlite3')
+    user_parser = subparsers.add_parser('add-user')
+    user_parser.add_argument('email')
+    user_parser.add_argument('--resume', required=True, help="path to a plain text resume")
+    user_parser.add_argument('--title', action='append', default=[])
+    user_parser.add_argument('--path', default='jobs.sqlite3')
+    args = parser.parse_args()
+
+    storage = SqliteStorage(args.path)
+    if args.command == 'init-sqlite':
+        print(f"Created SQLite database {args.path}")
+    else:
+        with open(args.resume) as resume_file:
+            new_user_id = storage.add_user(args.email, resume_file.read(), args.title)
+        print(f"Added user {new_user_id} to {args.path}")
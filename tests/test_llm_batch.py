@@ -0,0 +1,80 @@
+"""
+Runs the offline batch path against batch_stub_server: requests go out through llm_batch.run_batch, come back
+from the stub's output file, and a result that fails to parse is evaluated synchronously instead.
+"""
+import pandas as pd
+import pytest
+from openai import OpenAI
+
+import llm_batch
+import main
+from batch_stub_server import start_stub_server
+
+
+@pytest.fixture
+def stub_batch_client(monkeypatch):
+    server = start_stub_server()
+    client = OpenAI(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", api_key="stub", max_retries=0)
+    monkeypatch.setattr(llm_batch, 'get_batch_client', lambda: client)
+    # The stub finishes a batch on its second poll, there's no need to wait between polls
+    monkeypatch.setattr(llm_batch.time, 'sleep', lambda seconds: None)
+    yield client
+    server.shutdown()
+    server.server_close()
+
+
+def make_user_run(titles):
+    jobs_df = pd.DataFrame({'title': titles, 'company': ['Acme'] * len(titles),
+                            'job_url': [f"https://example.com/jobs/{index}" for index in range(len(titles))]})
+    pending_jobs = [{'job_id': str(index), 'index': index, 'title': title, 'company': 'Acme',
+                     'description': f"{title} working on Python services.", 'known_answers': {},
+                     'job_url': f"https://example.com/jobs/{index}", 'fingerprint': index}
+                    for index, title in enumerate(titles)]
+    rating_inputs = {'resume': "Python developer with 8 years of experience.", 'job_titles': ["Python Developer"],
+                     'skill_words': ["python"], 'stop_words': [], 'user_id': None}
+    return {'jobs_df': jobs_df, 'pending_jobs': pending_jobs, 'rating_inputs': rating_inputs}
+
+
+def test_run_batch_returns_every_result(stub_batch_client):
+    requests = {
+        'free-text': {'model': 'openai/gpt-4.1-nano', 'messages': [{'role': 'user', 'content': "Summarize the job"}]},
+        'structured': main.build_evaluation_request("Python Developer", "Python services.", "Python developer",
+                                                    ["Python Developer"], ["python"], []),
+    }
+
+    results = llm_batch.run_batch(requests, "test batch")
+
+    assert set(results) == set(requests)
+    assert results['free-text'].startswith("Stub answer")
+    assert main.parse_evaluation_response(results['structured']) is not None
+
+
+def test_unparseable_result_is_evaluated_synchronously(stub_batch_client, monkeypatch):
+    monkeypatch.setattr(main, 'EVAL_BATCH_MODE', False)
+    monkeypatch.setattr(main, 'store_assessment', lambda job, rating_inputs, assessment: None)
+    user_run = make_user_run(["Python Developer", "Backend Engineer"])
+
+    evaluation_requests, evaluation_jobs = main.build_evaluation_batch([user_run])
+    # Without its response format the stub answers the second job in plain text, which can't be parsed
+    broken_id = next(custom_id for custom_id, (run_number, jobs) in evaluation_jobs.items()
+                     if jobs[0]['job_id'] == '1')
+    evaluation_requests[broken_id] = {key: value for key, value in evaluation_requests[broken_id].items()
+                                      if key != 'response_format'}
+
+    results = llm_batch.run_batch(evaluation_requests, "job evaluations")
+    assert set(results) == set(evaluation_requests)
+
+    assessments = main.parse_evaluation_batch(results, evaluation_jobs, 1)[0]
+    assert set(assessments) == {'0'}
+
+    evaluated = []
+
+    def evaluate_job_match(job_title, **kwargs):
+        evaluated.append(job_title)
+        return assessments['0']
+
+    monkeypatch.setattr(main, 'evaluate_job_match', evaluate_job_match)
+    main.apply_job_ratings(user_run['jobs_df'], user_run['pending_jobs'], assessments, user_run['rating_inputs'])
+
+    assert evaluated == ["Backend Engineer"]
+    assert user_run['jobs_df']['job_score'].notna().all()
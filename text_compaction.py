@@ -0,0 +1,157 @@
+import re
+
+from helpers import consolidate_text, count_tokens
+from llm_config import DESCRIPTION_TOKEN_BUDGET
+
+# Headings that start a section we never need to send to the LLM
+BOILERPLATE_HEADINGS = ['equal opportunity', 'equal employment', 'eeo', 'diversity', 'inclusion', 'accommodation',
+                        'about us', 'about the company', 'who we are', 'our mission', 'our values', 'our culture',
+                        'life at', 'why join', 'why work', 'privacy', 'disclaimer', 'legal', 'e-verify',
+                        'pay transparency', 'applicant', 'notice to', 'california residents']
+BENEFITS_HEADINGS = ['benefits', 'perks', 'what we offer', 'we offer', 'compensation and benefits']
+
+# Headings that start a section we always want to keep
+PRIORITY_HEADINGS = ['requirement', 'qualification', 'responsibilit', "what you'll do", 'what you will do',
+                     'what you bring', "what you'll bring", 'must have', 'skills', 'experience', 'about the role',
+                     'the role', 'your role', 'duties', 'you will', 'you have', 'education', 'nice to have',
+                     'preferred', 'salary', 'compensation', 'pay range']
+
+# Lines and sentences that are boilerplate wherever they appear, outside of priority sections
+BOILERPLATE_PHRASES = ['equal opportunity employer', 'without regard to', 'regardless of race', 'sexual orientation',
+                       'gender identity', 'protected veteran', 'reasonable accommodation', 'e-verify',
+                       'pay transparency', 'fair chance', 'arrest and conviction', 'privacy policy',
+                       'privacy notice', 'do not accept unsolicited', 'recruitment agencies', 'drug-free workplace',
+                       'background check', 'at-will']
+
+HEADING_MAX_LENGTH = 80
+
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+
+def is_heading(line):
+    stripped = line.strip().strip('*#_ ').strip()
+    if not stripped or len(stripped) > HEADING_MAX_LENGTH:
+        return False
+    return (line.strip().startswith(('#', '**')) or stripped.endswith(':') or
+            (stripped.isupper() and len(stripped.split()) <= 8))
+
+
+def matches_any(text, phrases):
+    text = text.lower()
+    return any(phrase in text for phrase in phrases)
+
+
+def split_sections(text):
+    """
+    Split a description into (heading, [paragraphs]) sections, each paragraph a list of its lines. Text before any
+    heading has a heading of ''.
+    """
+    sections = [('', [])]
+    paragraph = []
+    for line in text.replace('\r', '\n').split('\n'):
+        if is_heading(line):
+            if paragraph:
+                sections[-1][1].append(paragraph)
+                paragraph = []
+            sections.append((line.strip(), []))
+        elif line.strip():
+            paragraph.append(line.strip())
+        elif paragraph:
+            sections[-1][1].append(paragraph)
+            paragraph = []
+
+    if paragraph:
+        sections[-1][1].append(paragraph)
+
+    return sections
+
+
+def drop_boilerplate(lines):
+    """Drops the lines, or the sentences within a line, that contain a boilerplate phrase."""
+    kept = []
+    for line in lines:
+        sentences = [sentence for sentence in SENTENCE_BREAK.split(line)
+                     if not matches_any(sentence, BOILERPLATE_PHRASES)]
+        if sentences:
+            kept.append(' '.join(sentences))
+    return kept
+
+
+def normalize_paragraph(paragraph):
+    return re.sub(r'[\W_]+', ' ', paragraph.lower()).strip()
+
+
+def truncate_to_tokens(text, max_tokens):
+    words = text.split(' ')
+    while words and count_tokens(' '.join(words)) > max_tokens:
+        words = words[:max(1, int(len(words) * 0.9))] if len(words) > 1 else []
+    return ' '.join(words)
+
+
+def compact_description(description, token_budget=DESCRIPTION_TOKEN_BUDGET, keep_benefits=False):
+    """
+    Compacts a scraped job description for prompting. Boilerplate sections (EEO statements, company blurbs,
+    legal notices and, unless keep_benefits is set, benefits) are dropped, as are boilerplate lines and sentences
+    outside requirement and responsibility sections, repeated paragraphs are removed, and the result is capped at
+    token_budget, keeping requirement and responsibility sections first.
+    Returns (compacted_text, tokens_saved).
+    """
+    if not description:
+        return description, 0
+
+    original_tokens = count_tokens(description)
+    skipped_headings = BOILERPLATE_HEADINGS if keep_benefits else BOILERPLATE_HEADINGS + BENEFITS_HEADINGS
+
+    seen = set()
+    blocks = []  # (order, priority, text)
+    for heading, paragraphs in split_sections(description):
+        if heading and matches_any(heading, skipped_headings) and not matches_any(heading, PRIORITY_HEADINGS):
+            # Remember skipped paragraphs so a company blurb repeated later in the posting is dropped too
+            seen.update(normalize_paragraph(' '.join(lines)) for lines in paragraphs)
+            continue
+
+        priority = bool(heading) and matches_any(heading, PRIORITY_HEADINGS)
+        kept = []
+        for lines in paragraphs:
+            key = normalize_paragraph(' '.join(lines))
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            # A requirement like passing a background check is still a requirement
+            if not priority:
+                lines = drop_boilerplate(lines)
+            if lines:
+                kept.append(' '.join(lines))
+
+        if kept:
+            text = consolidate_text(' '.join(([heading.strip('*#_ ')] if heading else []) + kept))
+            blocks.append((len(blocks), priority, text))
+
+    # Fill the budget with priority sections first, then the rest, and put them back in their original order
+    selected = []
+    remaining = token_budget
+    for order, priority, text in sorted(blocks, key=lambda block: (not block[1], block[0])):
+        if remaining <= 0:
+            break
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            text = truncate_to_tokens(text, remaining)
+            tokens = count_tokens(text)
+        if text:
+            selected.append((order, text))
+            remaining -= tokens
+
+    compacted = ' '.join(text for order, text in sorted(selected)).strip()
+    if not compacted:
+        # Nothing survived (e.g. a description that is all boilerplate), fall back to a capped original
+        compacted = truncate_to_tokens(consolidate_text(description), token_budget)
+
+    return compacted, max(0, original_tokens - count_tokens(compacted))
+
+
+def compact_job_description(description, label='', token_budget=DESCRIPTION_TOKEN_BUDGET, keep_benefits=False):
+    """Compacts a description and reports the tokens saved for the job."""
+    compacted, tokens_saved = compact_description(description, token_budget, keep_benefits)
+    if tokens_saved > 0:
+        print(f"Compacted description{' for ' + label if label else ''}: saved {tokens_saved} tokens")
+    return compacted
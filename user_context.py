@@ -0,0 +1,63 @@
+"""
+Everything the batch run needs to know about its users, loaded up front in a fixed number of bulk queries instead
+of per user and per matched job: each user's configs, parsed into their title, skill and stop word lists, and the
+set of jobs the user already has a recommendation for.
+"""
+from persistent_storage import get_configs_for_users, get_job_ids_for_users
+
+CONFIG_LISTS = ('job_titles', 'skill_words', 'stop_words')
+
+
+def config_values(configs, key):
+    return [config['string_value'] for config in configs if config['key'] == key]
+
+
+def build_user_context(user, configs, job_ids):
+    context = {
+        'user': user,
+        'configs': configs,
+        'job_ids': set(job_ids),
+    }
+    for key in CONFIG_LISTS:
+        context[key] = config_values(configs, key)
+    return context
+
+
+def load_user_contexts(users):
+    """Returns a dict of user_id -> context for the users, from one configs query and one users_jobs query."""
+    user_ids = [user.get('id') for user in users]
+
+    configs_by_user = {user_id: [] for user_id in user_ids}
+    for config in get_configs_for_users(user_ids):
+        configs_by_user.setdefault(config['user_id'], []).append(config)
+
+    job_ids_by_user = {user_id: [] for user_id in user_ids}
+    for pair in get_job_ids_for_users(user_ids):
+        job_ids_by_user.setdefault(pair['user_id'], []).append(pair['job_id'])
+
+    contexts = {user.get('id'): build_user_context(user, configs_by_user[user.get('id')],
+                                                   job_ids_by_user[user.get('id')])
+                for user in users}
+    print(f"Loaded {len(contexts)} users with {sum(len(configs) for configs in configs_by_user.values())} configs "
+          f"and {sum(len(job_ids) for job_ids in job_ids_by_user.values())} existing recommendations")
+    return contexts
+
+
+def refresh_job_ids(contexts):
+    """Reloads every user's existing recommendations in one query, e.g. after the run saved new ones."""
+    for context in contexts.values():
+        context['job_ids'] = set()
+    for pair in get_job_ids_for_users(list(contexts)):
+        if pair['user_id'] in contexts:
+            contexts[pair['user_id']]['job_ids'].add(pair['job_id'])
+
+
+def add_config_values(context, key, values):
+    """Keeps a context in step with configs saved during the run, such as generated job titles."""
+    context['configs'] = context['configs'] + [{'user_id': context['user'].get('id'), 'key': key,
+                                                'string_value': value} for value in values]
+    context[key] = config_values(context['configs'], key)
+
+
+def has_recommendation(context, job_id):
+    return job_id in context['job_ids']
@@ -0,0 +1,214 @@
+"""
+Write-behind buffer for the writes made while jobs are being evaluated: new recommendations, stored evaluations
+and evaluation cursors. queue_* calls append the write to STORAGE_WRITE_SPILL_FILE and put it on an in-process
+queue, and a background thread flushes the queue in batches of STORAGE_WRITE_BATCH_SIZE, or every
+STORAGE_WRITE_FLUSH_SECONDS, with one statement per kind of write. After each batch the spill file is rewritten
+with only the writes that aren't stored yet, failed ones included, and removed once there are none, so the next
+run replays exactly what a crashed or failed run didn't store. evaluation_store rows are plain inserts, so only a
+crash between storing a batch and rewriting the file can store that batch twice.
+When the queue holds STORAGE_WRITE_QUEUE_SIZE writes, queue_* calls wait, and that wait is reported.
+
+flush_writes() blocks until everything queued so far is stored, call it before reading back what was written.
+With STORAGE_WRITE_BEHIND=false every write is made synchronously as before.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from persistent_storage import STORAGE_WRITE_BEHIND, STORAGE_WRITE_BATCH_SIZE, STORAGE_WRITE_FLUSH_SECONDS, \
+    STORAGE_WRITE_QUEUE_SIZE, STORAGE_WRITE_SPILL_FILE, build_association_row, build_stored_evaluation_row, \
+    insert_user_job_rows, insert_stored_evaluations, save_evaluation_cursor
+
+write_behind_stats = {
+    'queued': 0,
+    'written': 0,
+    'failed': 0,
+    'batches': 0,
+    'replayed': 0,
+    'max_queue_depth': 0,
+    'producer_wait_seconds': 0.0,  # time queue_* calls spent waiting on a full queue
+    'max_write_lag_seconds': 0.0,  # longest time from queueing a write to storing it
+}
+
+
+def write_user_job_rows(rows):
+    return insert_user_job_rows(rows) is not None
+
+
+def write_stored_evaluations(rows):
+    return insert_stored_evaluations(rows) is not None
+
+
+def write_evaluation_cursors(rows):
+    # Only the latest cursor per user matters
+    latest = {row['user_id']: row for row in rows}
+    return all(save_evaluation_cursor(**row) is not None for row in latest.values())
+
+
+WRITERS = {
+    'users_jobs': write_user_job_rows,
+    'evaluation_store': write_stored_evaluations,
+    'evaluation_cursors': write_evaluation_cursors,
+}
+
+
+class WriteBehindBuffer:
+    def __init__(self, batch_size, flush_seconds, queue_size, spill_file):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.spill_file = spill_file
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spill_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.unwritten = {}  # sequence number -> write, every write that isn't stored yet, as in the spill file
+        self.next_sequence = 0
+        self.worker = None
+
+    def start(self):
+        # Locked so concurrent first submits start one worker and replay the spill file once
+        with self.start_lock:
+            if self.worker is not None:
+                return
+            self.worker = threading.Thread(target=self.run, name='write-behind', daemon=True)
+            self.worker.start()
+            atexit.register(self.flush)
+            self.replay()
+
+    def replay(self):
+        """Queues the writes a previous run left in the spill file."""
+        if not self.spill_file or not os.path.exists(self.spill_file):
+            return
+        with open(self.spill_file) as spill:
+            writes = [json.loads(line) for line in spill if line.strip()]
+        if writes:
+            print(f"Replaying {len(writes)} writes left in {self.spill_file} by an earlier run")
+        for write in writes:
+            write_behind_stats['replayed'] += 1
+            self.put(write, spill=False)
+
+    def submit(self, kind, row):
+        self.start()
+        write_behind_stats['queued'] += 1
+        self.put({'kind': kind, 'row': row}, spill=True)
+
+    def put(self, write, spill):
+        with self.spill_lock:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            self.unwritten[sequence] = write
+            if spill and self.spill_file:
+                with open(self.spill_file, 'a') as spill_file:
+                    spill_file.write(json.dumps(write, default=str) + "\n")
+
+        started = time.monotonic()
+        self.queue.put((sequence, time.monotonic(), write))
+        write_behind_stats['producer_wait_seconds'] += time.monotonic() - started
+        write_behind_stats['max_queue_depth'] = max(write_behind_stats['max_queue_depth'], self.queue.qsize())
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                # The worker has to keep running, or flush() would wait forever for these task_done calls
+                print(f"Error storing a batch of {len(batch)} writes: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write_batch(self, batch):
+        writes_by_kind = {}
+        for sequence, queued_at, write in batch:
+            writes_by_kind.setdefault(write['kind'], []).append((sequence, write['row']))
+
+        stored = []
+        for kind, writes in writes_by_kind.items():
+            rows = [row for sequence, row in writes]
+            try:
+                written = WRITERS[kind](rows)
+            except Exception as e:
+                print(f"Error writing {len(rows)} {kind} rows: {e}")
+                written = False
+            if written:
+                write_behind_stats['written'] += len(rows)
+                stored.extend(sequence for sequence, row in writes)
+            else:
+                write_behind_stats['failed'] += len(rows)
+                print(f"{len(rows)} {kind} writes failed, they stay in {self.spill_file} for the next run")
+        write_behind_stats['batches'] += 1
+
+        now = time.monotonic()
+        write_behind_stats['max_write_lag_seconds'] = max(write_behind_stats['max_write_lag_seconds'],
+                                                          max(now - queued_at for sequence, queued_at, write in batch))
+        with self.spill_lock:
+            for sequence in stored:
+                del self.unwritten[sequence]
+            self.rewrite_spill_file()
+
+    def rewrite_spill_file(self):
+        """Leaves only the unwritten writes in the spill file, or removes it. Called holding spill_lock."""
+        if not self.spill_file:
+            return
+        if not self.unwritten:
+            if os.path.exists(self.spill_file):
+                os.remove(self.spill_file)
+            return
+        temporary_file = self.spill_file + '.tmp'
+        with open(temporary_file, 'w') as spill_file:
+            for write in self.unwritten.values():
+                spill_file.write(json.dumps(write, default=str) + "\n")
+        os.replace(temporary_file, self.spill_file)
+
+    def flush(self):
+        if self.worker is not None:
+            self.queue.join()
+
+
+_buffer = WriteBehindBuffer(STORAGE_WRITE_BATCH_SIZE, STORAGE_WRITE_FLUSH_SECONDS, STORAGE_WRITE_QUEUE_SIZE,
+                            STORAGE_WRITE_SPILL_FILE)
+
+
+def queue_write(kind, row):
+    if STORAGE_WRITE_BEHIND:
+        _buffer.submit(kind, row)
+    else:
+        WRITERS[kind]([row])
+
+
+def queue_user_job_association(user_id, job_id, ratings):
+    queue_write('users_jobs', build_association_row(user_id, job_id, ratings))
+
+
+def queue_stored_evaluation(resume_hash, profile_hash, fingerprint, title, assessment):
+    queue_write('evaluation_store', build_stored_evaluation_row(resume_hash, profile_hash, fingerprint, title,
+                                                                assessment))
+
+
+def queue_evaluation_cursor(user_id, evaluated_urls, good_jobs_today, cursor_date):
+    queue_write('evaluation_cursors', {'user_id': user_id, 'evaluated_urls': evaluated_urls,
+                                       'good_jobs_today': good_jobs_today, 'cursor_date': cursor_date})
+
+
+def flush_writes():
+    _buffer.flush()
+
+
+def print_write_behind_report():
+    if write_behind_stats['queued'] == 0 and write_behind_stats['replayed'] == 0:
+        return
+
+    print(f"Write-behind: {write_behind_stats['written']} writes in {write_behind_stats['batches']} batches, "
+          f"{write_behind_stats['failed']} failed, {write_behind_stats['replayed']} replayed from an earlier run")
+    print(f"  queue depth peaked at {write_behind_stats['max_queue_depth']} of {STORAGE_WRITE_QUEUE_SIZE}, "
+          f"producers waited {write_behind_stats['producer_wait_seconds']:.2f}s on a full queue, "
+          f"longest write lag {write_behind_stats['max_write_lag_seconds']:.2f}s")